@@ -1,93 +1,36 @@
 import asyncio
 import logging
-from multiprocessing import Process
-
-import asyncpg
-from aiogram import Bot, Dispatcher
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
-from flask import Flask, jsonify, request
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
-
-from bot.common.commands import set_bot_commands
-from bot.handlers.admin import admin_router
-from bot.handlers.common import common_router, pdf_router
-from bot.handlers.participant import participant_router
-from config import DATABASE_URL, OPTION, POSTGRESQL, TELEGRAM_TOKEN, TELEGRAM_TOKEN_TEST
+import multiprocessing
 
 # Налаштування логів
 logging.basicConfig(level=logging.INFO)
 
-app = Flask(__name__)
-
-@app.route("/")
-def index():
-    return "Flask-сервер працює. Бот запущено!"
-
-@app.route("/params", methods=["GET"])
-def get_params():
-    """Обробляє GET запити й повертає передані параметри."""
-    params = request.args
-    return jsonify({"parameters": params})
-
-if str(OPTION) == 'MySQL':
-    DATABASE = DATABASE_URL
-    from bot.database.database import Base, Database, DatabaseMiddleware
-else:
-    from bot.database.database_postgres import Base, Database, DatabaseMiddleware
-    DATABASE = "postgresql+asyncpg" + str(POSTGRESQL)
-
-engine = create_async_engine(DATABASE, future=True)
-async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
-db = Database(session_factory=async_session)
-
-# Ініціалізація Telegram-бота
-bot = Bot(
-    token=TELEGRAM_TOKEN,
-    default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-)
-
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
-dp.message.middleware(DatabaseMiddleware(db))
+# Модулі бота й веб-сервера імпортуються всередині цільових функцій процесів:
+# кожен дочірній процес завантажує лише свій стек і сам створює свої ресурси.
 
-dp.include_router(admin_router)
-dp.include_router(common_router)
-dp.include_router(participant_router)
-dp.include_router(pdf_router)
-
-async def create_tables():
-    """Створює таблиці у базі даних."""
-    async with engine.begin() as conn:
-        # await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
-
-    logging.info("Таблиці створено.")
-
-async def run_bot():
-    """Запускає Telegram-бота."""
-    await bot.delete_webhook(drop_pending_updates=True)  # Скидання закинутих повідомлень
-    logging.info("Встановлення команд для бота...")
-    await set_bot_commands(bot)  # Встановлюємо команди
-    logging.info("Команди встановлено. Telegram-бот запущено.")
-    await dp.start_polling(bot)
 
 def start_bot():
     """Функція для запуску Telegram-бота в окремому процесі."""
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(create_tables())
-    loop.run_until_complete(run_bot())
+    from bot.main import run_bot
+
+    asyncio.run(run_bot())
+
 
 def start_flask():
     """Функція для запуску Flask-сервера."""
+    from bot.common.memory import log_memory_usage
+    from web import app
+
+    log_memory_usage("web")
     app.run(host="0.0.0.0", port=5000, debug=False)
 
+
 def main():
-    """Основна функція для запуску бота та створення БД в одному подієвому циклі."""
-    bot_process = Process(target=start_bot)
-    flask_process = Process(target=start_flask)
+    """Запускає бота та Flask-сервер в окремих процесах."""
+    # spawn замість fork: дочірні процеси стартують з чистого інтерпретатора й нічого не успадковують
+    context = multiprocessing.get_context("spawn")
+    bot_process = context.Process(target=start_bot, name="bot")
+    flask_process = context.Process(target=start_flask, name="web")
 
     bot_process.start()
     flask_process.start()
@@ -95,5 +38,6 @@ def main():
     bot_process.join()
     flask_process.join()
 
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,84 @@
+"""Догін апдейтів, що накопичились, поки бот не працював (деплой, падіння).
+
+Замість drop_pending_updates бот на старті забирає чергу з Telegram пакетами по 100 і лише
+потрібних типів. Апдейти різних чатів обробляються паралельно, одного чату — по черзі,
+у порядку надходження. Останній порожній запит підтверджує чергу, тож polling після догону
+її вже не отримує. Апдейти догону не проходять через відро токенів антифлуду: черга
+користувача за час простою — не флуд. Якщо Telegram недоступний, догін зупиняється,
+а решту черги забере звичайний polling.
+"""
+
+import asyncio
+import logging
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramNetworkError, TelegramServerError
+from aiogram.methods import GetUpdates
+from aiogram.types import Update
+
+BATCH_LIMIT = 100  # Максимум, який віддає getUpdates
+CONCURRENCY = 20  # Одночасних апдейтів, щоб не вичерпати пул з'єднань БД
+
+
+def _chat_id(update: Update):
+    if update.message:
+        return update.message.chat.id
+    if update.callback_query:
+        message = update.callback_query.message
+        return message.chat.id if message else update.callback_query.from_user.id
+    return None
+
+
+async def catch_up(bot: Bot, dispatcher: Dispatcher, allowed_updates=None):
+    """Обробляє всю чергу апдейтів і повертає їх кількість."""
+    allowed_updates = allowed_updates or dispatcher.resolve_used_update_types()
+    started = time.perf_counter()
+    limit = asyncio.Semaphore(CONCURRENCY)
+    tails = {}  # chat_id -> остання задача чату: наступна чекає її завершення
+    tasks = []
+    offset = None
+    batches = 0
+    errors = 0
+
+    async def feed(update, previous):
+        nonlocal errors
+        if previous is not None:
+            await asyncio.wait([previous])
+        async with limit:
+            try:
+                await dispatcher.feed_update(bot, update, catch_up=True)
+            except Exception as e:
+                errors += 1
+                logging.error(f"Догін: помилка обробки апдейту {update.update_id}: {e}")
+
+    try:
+        await bot.delete_webhook()  # getUpdates не працює, поки зареєстровано вебхук; черга лишається
+        while True:
+            updates = await bot(
+                GetUpdates(offset=offset, limit=BATCH_LIMIT, timeout=0, allowed_updates=allowed_updates)
+            )
+            if not updates:
+                break
+            batches += 1
+            for update in updates:
+                offset = update.update_id + 1
+                chat_id = _chat_id(update)
+                task = asyncio.create_task(feed(update, tails.get(chat_id)))
+                if chat_id is not None:
+                    tails[chat_id] = task
+                tasks.append(task)
+    except (TelegramNetworkError, TelegramServerError) as e:
+        # Непідтверджені апдейти лишаються в черзі Telegram, їх отримає polling
+        logging.error(f"Догін перервано: не вдалося отримати апдейти: {e}")
+
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    if tasks:
+        logging.info(
+            f"Догін після рестарту: {len(tasks)} апдейтів з {len(tails)} чатів, пакетів {batches}, "
+            f"помилок {errors}, за {elapsed:.2f} с ({len(tasks) / max(elapsed, 1e-9):.0f}/с)"
+        )
+    else:
+        logging.info(f"Догін після рестарту: черга порожня ({elapsed:.2f} с)")
+    return len(tasks)
@@ -0,0 +1,98 @@
+import logging
+import time
+
+MAX_CODE = 10000  # Коди сесій — randint(1000, 9999)
+REFRESH_INTERVAL = 60.0  # Як часто бітмапа звіряється з open_sessions (сесії могли змінити інші процеси)
+
+
+class ActiveSessions:
+    """
+    Бітмапа незавершених сесій за кодом: перевірка сесії в middleware — одна операція над
+    байтом, без запиту до БД.
+
+    Біт known означає, що відповідь для коду вже є в пам'яті (відкрита або закрита);
+    у БД ідемо лише за кодом, якого процес ще не бачив, і раз на REFRESH_INTERVAL — за повним списком.
+    """
+
+    def __init__(self):
+        self.active = bytearray(MAX_CODE // 8 + 1)
+        self.known = bytearray(MAX_CODE // 8 + 1)
+        self.refreshed_at = 0.0
+        self._refreshing = False
+        self.hits = 0
+        self.lookups = 0
+        self.rejected = 0
+
+    @staticmethod
+    def _get(bitmap, code):
+        return bitmap[code >> 3] >> (code & 7) & 1
+
+    @staticmethod
+    def _set(bitmap, code, value):
+        if value:
+            bitmap[code >> 3] |= 1 << (code & 7)
+        else:
+            bitmap[code >> 3] &= ~(1 << (code & 7)) & 0xFF
+
+    def __contains__(self, session_code):
+        """Відкрита за даними в пам'яті, без звернення до БД."""
+        code = int(session_code)
+        return 0 <= code < MAX_CODE and bool(self._get(self.active, code))
+
+    def open(self, session_code):
+        code = int(session_code)
+        if 0 <= code < MAX_CODE:
+            self._set(self.known, code, True)
+            self._set(self.active, code, True)
+
+    def close(self, session_code):
+        code = int(session_code)
+        if 0 <= code < MAX_CODE:
+            self._set(self.known, code, True)
+            self._set(self.active, code, False)
+
+    async def refresh(self, db):
+        """Перебудовує бітмапу з таблиці open_sessions."""
+        self._refreshing = True
+        try:
+            codes = await db.get_open_session_codes()
+        finally:
+            self._refreshing = False
+        active = bytearray(MAX_CODE // 8 + 1)
+        for code in codes:
+            if 0 <= code < MAX_CODE:
+                self._set(active, code, True)
+        # Закриті коди знову невідомі: якщо сесію відкрив інший процес, перевіримо її в БД
+        self.active, self.known = active, bytearray(active)
+        self.refreshed_at = time.monotonic()
+
+    async def is_active(self, db, session_code):
+        try:
+            code = int(session_code)
+        except (TypeError, ValueError):
+            return False
+        if time.monotonic() - self.refreshed_at >= REFRESH_INTERVAL and not self._refreshing:
+            await self.refresh(db)
+
+        if 0 <= code < MAX_CODE and self._get(self.known, code):
+            self.hits += 1
+            active = self._get(self.active, code)
+        else:
+            self.lookups += 1
+            active = await db.is_session_open(code)
+            if active:
+                self.open(code)
+            else:
+                self.close(code)
+        if not active:
+            self.rejected += 1
+        return bool(active)
+
+    def report(self):
+        logging.info(
+            f"Активні сесії: {sum(bin(byte).count('1') for byte in self.active)}, перевірок з пам'яті {self.hits}, "
+            f"запитів до БД {self.lookups}, відхилено застарілих {self.rejected}"
+        )
+
+
+active_sessions = ActiveSessions()
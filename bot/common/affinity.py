@@ -0,0 +1,26 @@
+class Affinity:
+    """
+    Прив'язка чатів до сесій для шардованого режиму (див. bot/sharding.py).
+
+    Хендлери повідомляють, що чат тепер належить сесії, і супервізор надалі спрямовує
+    апдейти цього чату на воркер сесії. В однопроцесному режимі виклики нічого не роблять.
+    """
+
+    def __init__(self):
+        self.channel = None  # multiprocessing.Queue до супервізора; задається лише у воркері
+
+    def bind(self, session_code, *chat_ids):
+        if self.channel is not None:
+            self.channel.put(("bind", int(session_code), chat_ids))
+
+    def unbind(self, session_code):
+        """Сесія завершилась — її чати супервізор далі розподіляє як звичайні."""
+        if self.channel is not None:
+            self.channel.put(("unbind", int(session_code)))
+
+    def wake_outbox(self):
+        if self.channel is not None:
+            self.channel.put(("wake",))
+
+
+affinity = Affinity()
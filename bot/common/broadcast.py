@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+# Ліміти Telegram: ~30 повідомлень/с на бота і ~1 повідомлення/с в один чат.
+# Беремо з запасом, щоб не впиратися у flood control.
+BOT_RATE = 25
+CHAT_INTERVAL = 1.0
+CONCURRENCY = 8
+MAX_RETRIES = 3
+
+
+class TokenBucket:
+    """Класичне відро токенів: rate токенів за секунду, не більше capacity в запасі."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class Broadcaster:
+    """
+    Відправка повідомлень у межах лімітів Telegram; через нього outbox доставляє розсилки.
+
+    Надсилає паралельно (не більше concurrency одночасно), тримаючись ліміту бота та
+    ліміту одного чату. На TelegramRetryAfter призупиняє всю розсилку на вказаний час,
+    мережеві та 5xx помилки повторює з наростаючою паузою.
+    """
+
+    def __init__(self, bot_rate=BOT_RATE, chat_interval=CHAT_INTERVAL, concurrency=CONCURRENCY,
+                 max_retries=MAX_RETRIES):
+        self.bucket = TokenBucket(bot_rate, bot_rate)
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._chat_next = {}
+        self._resume_at = 0.0
+
+    async def _wait_for_slot(self, chat_id):
+        now = time.monotonic()
+        # Слот у чаті резервуємо до сну, щоб паралельні відправки в той самий чат не злиплися
+        slot = max(now, self._resume_at, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = slot + self.chat_interval
+        if len(self._chat_next) > 10_000:
+            self._chat_next = {chat: at for chat, at in self._chat_next.items() if at > now}
+        if slot > now:
+            await asyncio.sleep(slot - now)
+        await self.bucket.acquire()
+
+    async def send_message(self, bot, chat_id, **kwargs) -> bool:
+        """Надсилає одне повідомлення з урахуванням лімітів. Повертає True, якщо доставлено."""
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self._wait_for_slot(chat_id)
+                try:
+                    await bot.send_message(chat_id=chat_id, **kwargs)
+                    return True
+                except TelegramRetryAfter as e:
+                    logging.warning(f"Flood control: пауза розсилки на {e.retry_after} с")
+                    self._resume_at = max(self._resume_at, time.monotonic() + e.retry_after)
+                except (TelegramNetworkError, TelegramServerError) as e:
+                    if attempt == self.max_retries:
+                        logging.error(f"Не вдалося надіслати повідомлення {chat_id}: {e}")
+                        return False
+                    await asyncio.sleep(2 ** attempt)
+                except Exception as e:
+                    # Заблокований бот, видалений чат тощо - повтор не допоможе
+                    logging.error(f"Не вдалося надіслати повідомлення {chat_id}: {e}")
+                    return False
+            logging.error(f"Не вдалося надіслати повідомлення {chat_id}: вичерпано спроби")
+            return False
+
+
+broadcaster = Broadcaster()
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+
+IDLE_TTL = 60.0  # Скільки секунд порожня черга чату живе, перш ніж її прибрати
+SWEEP_INTERVAL = 30.0
+DEPTH_WARNING = 10  # Стільки апдейтів одного чату в очікуванні вже варто помітити в логах
+
+
+class _ChatQueue:
+    __slots__ = ("lock", "depth", "idle_since")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0
+        self.idle_since = time.monotonic()
+
+
+class ChatQueues(BaseEventIsolation):
+    """
+    Черга на кожен чат: апдейти різних чатів обробляються паралельно, одного чату — строго
+    по черзі, у порядку надходження (asyncio.Lock пропускає очікувачів FIFO).
+
+    Підключається як events_isolation диспетчера: FSMContextMiddleware бере lock за ключем
+    чату ще до першого await, тож порядок у черзі збігається з порядком апдейтів.
+    """
+
+    def __init__(self, idle_ttl=IDLE_TTL):
+        self.idle_ttl = idle_ttl
+        self._queues = {}
+        self._last_sweep = time.monotonic()
+        self.processed = 0
+        self.evicted = 0
+        self.peak_depth = 0
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey):
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _ChatQueue()
+        queue.depth += 1
+        if queue.depth > self.peak_depth:
+            self.peak_depth = queue.depth
+        if queue.depth == DEPTH_WARNING:
+            logging.warning(f"Черга чату {key.chat_id}: {queue.depth} апдейтів в очікуванні")
+        try:
+            async with queue.lock:
+                yield
+        finally:
+            queue.depth -= 1
+            self.processed += 1
+            if queue.depth == 0:
+                queue.idle_since = time.monotonic()
+            self._sweep()
+
+    def _sweep(self):
+        now = time.monotonic()
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        idle = [key for key, queue in self._queues.items() if queue.depth == 0 and now - queue.idle_since >= self.idle_ttl]
+        for key in idle:
+            del self._queues[key]
+        self.evicted += len(idle)
+
+    def depths(self):
+        """Глибина черг зараз: чатів із чергою, зайнятих чатів, апдейтів в очікуванні, найдовша черга."""
+        busy = [queue.depth for queue in self._queues.values() if queue.depth]
+        return len(self._queues), len(busy), sum(depth - 1 for depth in busy), max(busy, default=0)
+
+    def report(self):
+        chats, busy, waiting, deepest = self.depths()
+        logging.info(
+            f"Черги чатів: {chats} (зайнятих {busy}), в очікуванні {waiting}, найдовша {deepest}, "
+            f"пік {self.peak_depth}, оброблено {self.processed}, прибрано неактивних {self.evicted}"
+        )
+
+    async def close(self) -> None:
+        self.report()
+        self._queues.clear()
+
+
+chat_queues = ChatQueues()
@@ -0,0 +1,35 @@
+import base64
+import hashlib
+import hmac
+
+from config import JOIN_LINK_SECRET, TELEGRAM_TOKEN
+
+SIGNATURE_BYTES = 12  # 16 символів base64url: payload /start вміщується в ліміт Telegram у 64 символи
+
+
+def _key():
+    # Без окремого секрету ключ виводиться з токена бота — він і так відомий лише серверу
+    return hashlib.sha256((JOIN_LINK_SECRET or TELEGRAM_TOKEN or "").encode()).digest()
+
+
+def _signature(session_code, password):
+    digest = hmac.new(_key(), f"join:{session_code}:{password}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:SIGNATURE_BYTES]).decode().rstrip("=")
+
+
+def make_join_token(session_code, password):
+    """
+    Payload посилання t.me/<bot>?start=<token>: код сесії та підпис коду разом із паролем.
+    Посилання замінює пароль і перестає діяти для нової сесії з тим самим кодом.
+    """
+    return f"{session_code}-{_signature(session_code, password)}"
+
+
+def token_session_code(token):
+    """Код сесії з payload або None, якщо це не посилання приєднання."""
+    code, _, signature = (token or "").partition("-")
+    return int(code) if code.isdigit() and signature else None
+
+
+def verify_join_token(token, session_code, password):
+    return hmac.compare_digest(token.encode(), make_join_token(session_code, password).encode())
@@ -0,0 +1,185 @@
+# Код голосу в бюлетені: 0 — ще не голосував, ABSENT — учасник вийшов із сесії
+OPTIONS = ("За", "Проти", "Утримаюсь")
+VOTE_CODES = {option: code for code, option in enumerate(OPTIONS, start=1)}
+NOT_VOTED = 0
+ABSENT = 255
+
+
+class ItemLedger:
+    """
+    Бюлетені одного питання: байт на учасника за його слотом у ростері.
+    Усі операції O(1) — лічильники оновлюються разом із бюлетенем.
+    """
+    __slots__ = ("question", "ballots", "tallies", "voted", "expected", "closed")
+
+    def __init__(self, question, absent):
+        self.question = question
+        self.ballots = bytearray(absent)
+        self.tallies = [0] * (len(OPTIONS) + 1)
+        self.voted = 0
+        self.expected = len(absent) - absent.count(ABSENT)
+        self.closed = False
+
+    def has_voted(self, slot):
+        return self.ballots[slot] not in (NOT_VOTED, ABSENT)
+
+    def record(self, slot, vote):
+        """Записує голос; повторний голос переносить його з попереднього варіанта. Повертає True для першого голосу."""
+        code = VOTE_CODES[vote]
+        previous = self.ballots[slot]
+        if previous == ABSENT:
+            return False
+        self.ballots[slot] = code
+        self.tallies[code] += 1
+        if previous == NOT_VOTED:
+            self.voted += 1
+            return True
+        self.tallies[previous] -= 1
+        return False
+
+    def leave(self, slot):
+        # Голос, якщо він уже є, лишається — як і рядок у таблиці votes
+        if self.ballots[slot] == NOT_VOTED:
+            self.ballots[slot] = ABSENT
+            self.expected -= 1
+
+    def all_voted(self):
+        return self.voted >= self.expected
+
+    def completes(self, slot):
+        """Чи стане перший голос цього слота останнім очікуваним (ще не внесений у бюлетені голос апдейту)."""
+        return self.ballots[slot] == NOT_VOTED and self.voted + 1 >= self.expected
+
+    def results(self):
+        return {option: self.tallies[code] for option, code in VOTE_CODES.items()}
+
+
+class LiveSession:
+    """
+    Спільний для всіх учасників стан сесії під час голосування: порядок денний, поточне питання,
+    ростер, зафіксований на старті, і бюлетені питань. У FSM користувачів лишається лише код сесії.
+    """
+    __slots__ = ("code", "agenda", "item_ids", "slots", "absent", "current_index", "ledgers")
+
+    def __init__(self, code, agenda, roster, item_ids=(), current_index=0):
+        self.code = code
+        self.agenda = tuple(agenda)
+        self.item_ids = tuple(item_ids)
+        self.slots = {user_id: slot for slot, user_id in enumerate(dict.fromkeys(roster))}
+        self.absent = bytearray(len(self.slots))
+        self.current_index = current_index
+        self.ledgers = {}
+
+    @property
+    def remaining(self):
+        """Скільки питань порядку денного ще після поточного."""
+        return max(len(self.agenda) - self.current_index - 1, 0)
+
+    @property
+    def current_question(self):
+        if 0 <= self.current_index < len(self.agenda):
+            return self.agenda[self.current_index]
+        return None
+
+    @property
+    def current_item_id(self):
+        if 0 <= self.current_index < len(self.item_ids):
+            return self.item_ids[self.current_index]
+        return None
+
+    @property
+    def current(self):
+        """Бюлетені поточного питання; створюються при першому зверненні."""
+        ledger = self.ledgers.get(self.current_index)
+        if ledger is None and self.current_question is not None:
+            ledger = self.ledgers[self.current_index] = ItemLedger(self.current_question, self.absent)
+        return ledger
+
+    def slot(self, user_id):
+        return self.slots.get(user_id)
+
+    def has_voted(self, user_id):
+        slot = self.slots.get(user_id)
+        return slot is not None and self.current.has_voted(slot)
+
+    def non_voters(self):
+        """Учасники ростера без бюлетеня поточного питання: ростер мінус ті, хто проголосував або вийшов."""
+        ballots = self.current.ballots
+        return self.slots.keys() - {user_id for user_id, slot in self.slots.items() if ballots[slot] != NOT_VOTED}
+
+    def record(self, user_id, vote):
+        slot = self.slots.get(user_id)
+        if slot is None:
+            return False
+        return self.current.record(slot, vote)
+
+    def leave(self, user_id):
+        slot = self.slots.get(user_id)
+        if slot is None or self.absent[slot] == ABSENT:
+            return
+        self.absent[slot] = ABSENT
+        ledger = self.ledgers.get(self.current_index)
+        if ledger is not None and not ledger.closed:
+            ledger.leave(slot)
+
+
+class VotingEngine:
+    """
+    Голосування активних сесій у пам'яті процесу. БД лишається основним записом:
+    після перезапуску стан сесії відновлюється з неї при першому ж голосі.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+
+    def start(self, session_code, agenda, roster, item_ids=()):
+        live = LiveSession(int(session_code), agenda, roster, item_ids)
+        self._sessions[live.code] = live
+        return live
+
+    def get(self, session_code):
+        return self._sessions.get(int(session_code))
+
+    async def ensure(self, db, session_code):
+        """Повертає стан сесії, за потреби відновлюючи його з БД (current_question_index, учасники, голоси)."""
+        live = self._sessions.get(int(session_code))
+        if live is not None:
+            return live
+
+        # Послідовно: у межах апдейту всі запити йдуть одним з'єднанням
+        agenda = await db.get_session_agenda(session_code)
+        roster = await db.get_session_participants(session_code)
+        item_ids = await db.get_agenda_item_ids(session_code)
+        current_index = await db.get_current_question_index(session_code)
+        if not agenda or current_index is None:
+            return None
+
+        live = LiveSession(int(session_code), agenda, roster, item_ids, current_index)
+        if live.current is not None:
+            for user_id, vote in await db.get_question_votes(session_code, live.current_question):
+                if vote in VOTE_CODES:
+                    live.record(user_id, vote)
+        # Якщо паралельний апдейт уже відновив сесію, лишаємо його копію
+        return self._sessions.setdefault(live.code, live)
+
+    def advance(self, session_code, question_index):
+        live = self.get(session_code)
+        if live is not None:
+            live.current_index = question_index
+        return live
+
+    def close_item(self, session_code):
+        live = self.get(session_code)
+        if live is not None and live.current is not None:
+            live.current.closed = True
+
+    def leave(self, session_code, user_id):
+        live = self.get(session_code)
+        if live is not None:
+            live.leave(user_id)
+
+    def end(self, session_code):
+        self._sessions.pop(int(session_code), None)
+
+
+live_voting = VotingEngine()
@@ -0,0 +1,25 @@
+import logging
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_memory_mb():
+    """Пікове RSS поточного процесу в МБ або None, якщо платформа цього не підтримує."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux віддає кілобайти, macOS - байти
+    if sys.platform == "darwin":
+        peak //= 1024
+    return peak / 1024
+
+
+def log_memory_usage(process_name):
+    """Логує пікове споживання пам'яті процесом, щоб порівнювати процеси між собою."""
+    peak = peak_memory_mb()
+    if peak is not None:
+        logging.info(f"Процес {process_name}: пікове RSS {peak:.1f} МБ")
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import logging
+
+from bot.common.broadcast import broadcaster
+
+BATCH_SIZE = 100
+POLL_INTERVAL = 5.0
+MAX_ATTEMPTS = 5
+CLAIM_LEASE = 60.0  # Секунд, на які пачка закріплюється за процесом
+PURGE_INTERVAL = 3600.0
+FAILED_RETENTION = 7 * 24 * 3600.0  # Скільки тримати остаточно недоставлені повідомлення для розбору
+
+
+class Outbox:
+    """
+    Надійна розсилка через таблицю outbox.
+
+    Хендлер лише записує повідомлення в БД (в тій самій транзакції, що й решта змін апдейту)
+    і одразу повертається. Фоновий воркер забирає їх пачками, надсилає через broadcaster
+    і підтверджує доставку видаленням рядка. Недоставлене після падіння процесу
+    доставляється після рестарту. Пачку процес спершу забирає (claim_outbox), тож кілька
+    реплік з власним воркером outbox не надсилають одне повідомлення двічі.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, poll_interval=POLL_INTERVAL, max_attempts=MAX_ATTEMPTS):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._wakeup = None
+        self._task = None
+        self.notify = None  # У шардованому режимі воркер будить outbox супервізора через цей виклик
+
+    async def enqueue(self, db, chat_ids, text, parse_mode=None, reply_markup=None) -> int:
+        """Ставить повідомлення в чергу для всіх chat_ids. Повертає кількість отримувачів."""
+        chat_ids = list(chat_ids)
+        markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else None
+        await db.add_outbox_messages(chat_ids, text, parse_mode=parse_mode, reply_markup=markup)
+        # Будимо воркер лише після коміту, інакше він ще не побачить нових рядків
+        db.after_commit(self.wake)
+        return len(chat_ids)
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+        elif self.notify is not None:
+            self.notify()
+
+    def start(self, bot, db):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(bot, db))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, bot, db):
+        logging.info("Воркер outbox запущено.")
+        loop = asyncio.get_running_loop()
+        purge_at = loop.time()
+        while True:
+            try:
+                self._wakeup.clear()
+                if loop.time() >= purge_at:
+                    purge_at = loop.time() + PURGE_INTERVAL
+                    purged = await db.purge_outbox(FAILED_RETENTION)
+                    if purged:
+                        logging.info(f"Outbox: видалено {purged} недоставлених повідомлень, старших за {FAILED_RETENTION / 86400:.0f} дн.")
+                batch = await db.claim_outbox(self.batch_size, CLAIM_LEASE)
+                # Якщо з пачки нічого не пішло (наприклад, мережа лежить), чекаємо, а не крутимо повтори
+                if batch and await self._deliver(bot, db, batch):
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Помилка воркера outbox: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, bot, db, batch):
+        # Чати - паралельно, повідомлення в межах одного чату - по черзі, щоб не переплутати порядок
+        by_chat = {}
+        for message in batch:
+            by_chat.setdefault(message.chat_id, []).append(message)
+
+        delivered_ids, failed_ids, released_ids = [], [], []
+
+        async def deliver_chat(messages):
+            for position, message in enumerate(messages):
+                sent = await broadcaster.send_message(
+                    bot,
+                    message.chat_id,
+                    text=message.text,
+                    parse_mode=message.parse_mode,
+                    reply_markup=json.loads(message.reply_markup) if message.reply_markup else None,
+                )
+                if not sent:
+                    # Решта повідомлень чату чекає повтору цього, інакше вони прийдуть раніше за нього
+                    failed_ids.append(message.id)
+                    released_ids.extend(later.id for later in messages[position + 1:])
+                    return
+                delivered_ids.append(message.id)
+
+        await asyncio.gather(*(deliver_chat(messages) for messages in by_chat.values()))
+        await db.ack_outbox(delivered_ids, failed_ids, max_attempts=self.max_attempts, released_ids=released_ids)
+        logging.info(f"Outbox: доставлено {len(delivered_ids)}, не доставлено {len(failed_ids)}")
+        return len(delivered_ids)
+
+
+outbox = Outbox()
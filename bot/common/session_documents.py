@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import os
+import time
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+
+from bot.common.utils import render_attendance_list, render_protocol
+
+DOCUMENTS = (
+    ("protocol", "📜 Протокол", render_protocol),
+    ("attendance", "📝 Додаток присутності", render_attendance_list),
+)
+
+
+class _Delivery:
+    __slots__ = ("bot", "chat_id", "message_id", "status", "lock")
+
+    def __init__(self, bot, chat_id):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = None
+        self.status = {key: "⏳ готується" for key, _, _ in DOCUMENTS}
+        self.lock = asyncio.Lock()
+
+    def render(self):
+        return "\n".join(f"{title}: {self.status[key]}" for key, title, _ in DOCUMENTS)
+
+
+class SessionDocuments:
+    """
+    Документи завершеної сесії, що готуються вже після фіксації транзакції.
+
+    Обидва документи рендеряться паралельно в потоках зі знімка сесії (БД більше не потрібна),
+    кожен надсилається адміну, щойно готовий, а одне повідомлення показує стан обох.
+    """
+
+    def __init__(self):
+        self._tasks = set()
+
+    def start(self, bot, chat_id, snapshot):
+        task = asyncio.create_task(self._deliver(bot, chat_id, snapshot))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def stop(self):
+        """Дочікується документів, що ще готуються, щоб рестарт їх не загубив."""
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _deliver(self, bot, chat_id, snapshot):
+        started = time.perf_counter()
+        delivery = _Delivery(bot, chat_id)
+        try:
+            sent = await bot.send_message(chat_id=chat_id, text=delivery.render(), parse_mode=None)
+            delivery.message_id = sent.message_id
+        except Exception as e:
+            logging.error(f"Не вдалося надіслати стан документів адміну {chat_id}: {e}")
+        await asyncio.gather(*(self._document(delivery, snapshot, key, render)
+                               for key, _, render in DOCUMENTS))
+        logging.info(f"Документи сесії {snapshot.session_code} надіслано за {time.perf_counter() - started:.2f} с")
+
+    async def _document(self, delivery, snapshot, key, render):
+        path = None
+        try:
+            path = await asyncio.to_thread(render, snapshot)
+            await delivery.bot.send_document(chat_id=delivery.chat_id, document=FSInputFile(path))
+            delivery.status[key] = "✅ надіслано"
+        except Exception as e:
+            logging.error(f"Помилка під час генерації документа {key} сесії {snapshot.session_code}: {e}")
+            delivery.status[key] = f"❌ помилка: {e}"
+        finally:
+            if path and os.path.exists(path):
+                os.remove(path)
+        await self._update(delivery)
+
+    async def _update(self, delivery):
+        # Текст береться під замком, тож останнє редагування завжди показує актуальний стан
+        if delivery.message_id is None:
+            return
+        async with delivery.lock:
+            try:
+                await delivery.bot.edit_message_text(
+                    chat_id=delivery.chat_id, message_id=delivery.message_id, text=delivery.render(), parse_mode=None
+                )
+            except TelegramBadRequest as e:
+                logging.warning(f"Не вдалося оновити стан документів: {e}")
+
+
+session_documents = SessionDocuments()
@@ -0,0 +1,217 @@
+"""Індекс точного тексту і стану FSM для хендлерів повідомлень.
+
+Більшість хендлерів спрацьовують на текст кнопки (F.text == "...", F.text.in_(...)),
+команду (Command("...")) або конкретний стан FSM. Звичайний роутер перевіряє фільтри всіх
+хендлерів по черзі; IndexedRouter один раз розкладає хендлери за ключем тексту й станом і для
+повідомлення перевіряє лише тих, що можуть спрацювати, — решта фільтрів (F.document, SessionFilter
+тощо) лишається як є. Порядок хендлерів зберігається, тож перший збіг той самий, що й без індексу.
+
+Заміряти вартість вибору хендлера на реальних роутерах бота:
+
+    python -m bot.common.text_index --rounds 200
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from aiogram import Router
+from aiogram.dispatcher.event.bases import UNHANDLED, SkipHandler
+from aiogram.dispatcher.event.telegram import TelegramEventObserver
+from aiogram.filters import Command, StateFilter
+from aiogram.fsm.state import State
+from aiogram.types import Chat, Message, User
+from aiogram.utils.magic_filter import MagicFilter
+from magic_filter.operations import ComparatorOperation, FunctionOperation, GetAttributeOperation
+from magic_filter.util import in_op
+
+_OTHER = object()  # Текст або стан, яких не чекає жоден хендлер
+
+
+def text_key(text):
+    """Ключ індексу: сам текст, а для команди — "/команда" без аргументів і @згадки."""
+    if text and text[0] == "/":
+        return text.split(maxsplit=1)[0].partition("@")[0]
+    return text
+
+
+def _text_keys(filter_):
+    """Множина ключів тексту, поза якими фільтр точно не пропустить повідомлення, або None."""
+    if isinstance(filter_, Command):
+        if filter_.prefix != "/" or filter_.ignore_case or not all(isinstance(c, str) for c in filter_.commands):
+            return None
+        return {f"/{command}" for command in filter_.commands}
+    if isinstance(filter_, MagicFilter):
+        operations = filter_._operations
+        if len(operations) != 2 or not isinstance(operations[0], GetAttributeOperation):
+            return None
+        if operations[0].name != "text":
+            return None
+        operation = operations[1]
+        if isinstance(operation, ComparatorOperation) and operation.comparator.__name__ == "eq":
+            return {text_key(operation.right)} if isinstance(operation.right, str) else None
+        if isinstance(operation, FunctionOperation) and operation.function is in_op:
+            values = operation.args[0]
+            return {text_key(value) for value in values} if all(isinstance(v, str) for v in values) else None
+    return None
+
+
+def _state_keys(filter_):
+    """Множина станів, у яких фільтр може пропустити повідомлення, або None."""
+    if isinstance(filter_, State):
+        states = (filter_,)
+    elif isinstance(filter_, StateFilter):
+        states = filter_.states
+    else:
+        return None
+    keys = set()
+    for state in states:
+        if isinstance(state, State):
+            state = state.state
+        elif state is not None and not isinstance(state, str):
+            return None  # Група станів
+        if state == "*":
+            return None
+        keys.add(state)
+    return keys
+
+
+class TextIndexObserver(TelegramEventObserver):
+    """Спостерігач повідомлень, що перебирає лише хендлери-кандидати з індексу."""
+
+    def __init__(self, router, event_name):
+        super().__init__(router=router, event_name=event_name)
+        self.indexed = True
+        self._keys = None  # (ключі тексту, стани) кожного хендлера; будується при першому повідомленні
+        self._texts = set()
+        self._states = set()
+        self._candidates = {}
+
+    def register(self, callback, *filters, flags=None, **kwargs):
+        self._keys = None
+        return super().register(callback, *filters, flags=flags, **kwargs)
+
+    def _build(self):
+        self._keys = []
+        for handler in self.handlers:
+            texts = states = None
+            for filter_object in handler.filters:
+                target = filter_object.magic if filter_object.magic is not None else filter_object.callback
+                if texts is None:
+                    texts = _text_keys(target)
+                if states is None:
+                    states = _state_keys(target)
+            self._keys.append((texts, states))
+        self._texts = {key for texts, _ in self._keys for key in texts or ()}
+        self._states = {key for _, states in self._keys for key in states or ()}
+        self._candidates = {}
+
+    def candidates(self, event, raw_state=None):
+        if not self.indexed:
+            return self.handlers
+        if self._keys is None:
+            self._build()
+        key = text_key(event.text or event.caption) if isinstance(event, Message) else None
+        if key not in self._texts:
+            key = _OTHER
+        if raw_state not in self._states:
+            raw_state = _OTHER
+        candidates = self._candidates.get((key, raw_state))
+        if candidates is None:
+            # Хендлер лишається, якщо його текст і стан (коли вони задані) можуть збігтися
+            candidates = self._candidates[(key, raw_state)] = [
+                handler
+                for handler, (texts, states) in zip(self.handlers, self._keys)
+                if (texts is None or key in texts) and (states is None or raw_state in states)
+            ]
+        return candidates
+
+    async def match(self, event, **kwargs):
+        """Перший хендлер, усі фільтри якого пропускають подію, та дані фільтрів."""
+        for handler in self.candidates(event, kwargs.get("raw_state")):
+            kwargs["handler"] = handler
+            result, data = await handler.check(event, **kwargs)
+            if result:
+                return handler, data
+        return None, None
+
+    async def trigger(self, event, **kwargs):
+        # Те саме, що TelegramEventObserver.trigger, але лише по кандидатах
+        for handler in self.candidates(event, kwargs.get("raw_state")):
+            kwargs["handler"] = handler
+            result, data = await handler.check(event, **kwargs)
+            if result:
+                kwargs.update(data)
+                try:
+                    wrapped_inner = self.outer_middleware.wrap_middlewares(
+                        self._resolve_middlewares(),
+                        handler.call,
+                    )
+                    return await wrapped_inner(event, kwargs)
+                except SkipHandler:
+                    continue
+
+        return UNHANDLED
+
+
+class IndexedRouter(Router):
+    """Router, у якого повідомлення розбирає TextIndexObserver."""
+
+    def __init__(self, *, name=None):
+        super().__init__(name=name)
+        self.message = self.observers["message"] = TextIndexObserver(router=self, event_name="message")
+
+
+def _sample_messages():
+    from bot.common.live_voting import OPTIONS
+
+    texts = [
+        "/start", "/info", "/join", "/leave", "/help", "/post", "/merge_pdf",
+        "Створити сесію", "Приєднатися до сесії", "ℹ️ Інформація про сесію", "🚪 Вийти з сесії",
+        "✅ Почати голосування по питаннях порядку денного", "❌ Завершити сесію", "Допомога",
+        *OPTIONS, "Іван Петренко", "1. Звіт голови\n2. Бюджет", "4821",
+    ]
+    user = User(id=1, is_bot=False, first_name="Bench")
+    chat = Chat(id=1, type="private")
+    return [Message(message_id=i, date=datetime.now(), chat=chat, from_user=user, text=text) for i, text in enumerate(texts)]
+
+
+async def benchmark(rounds):
+    """Середній час вибору хендлера на повідомлення: усі роутери бота в порядку підключення."""
+    from bot.handlers.admin import admin_router
+    from bot.handlers.common import common_router, pdf_router
+    from bot.handlers.participant import participant_router
+
+    observers = [router.message for router in (admin_router, common_router, participant_router, pdf_router)]
+    messages = _sample_messages()
+    states = [None, "voting", "proposer_entry"]
+
+    async def run():
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for raw_state in states:
+                for message in messages:
+                    for observer in observers:
+                        handler, _ = await observer.match(message, raw_state=raw_state, bot=None, session_code=1234)
+                        if handler is not None:
+                            break
+        return (time.perf_counter() - started) / (rounds * len(states) * len(messages))
+
+    results = {}
+    for indexed in (False, True):
+        for observer in observers:
+            observer.indexed = indexed
+        await run()  # прогрів
+        results[indexed] = await run()
+
+    before, after = results[False], results[True]
+    print(f"Без індексу: {before * 1e6:.1f} мкс/повідомлення")
+    print(f"З індексом:  {after * 1e6:.1f} мкс/повідомлення ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Вартість вибору хендлера повідомлення")
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(benchmark(args.rounds))
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from datetime import datetime
 
@@ -30,11 +31,32 @@ def set_page_margins(document):
     section.right_margin = Cm(2)
 
 
-async def generate_protocol(session_code, db):
+class SessionSnapshot:
+    """Усі дані завершеної сесії, потрібні документам, зібрані один раз."""
+
+    __slots__ = ("session_code", "date", "admin_id", "participants", "agenda", "voting_results",
+                 "council_info", "details", "proposers", "drafts")
+
+    def __init__(self, session_code, date, admin_id, participants, agenda, voting_results,
+                 council_info, details, proposers, drafts):
+        self.session_code = session_code
+        self.date = date
+        self.admin_id = admin_id
+        self.participants = participants
+        self.agenda = agenda
+        self.voting_results = voting_results
+        self.council_info = council_info
+        self.details = details
+        self.proposers = proposers
+        self.drafts = drafts
+
+
+async def collect_session_snapshot(session_code, db, voting_results=None):
     """
-    Генерує протокол для завершеної сесії.
+    Читає з БД усе для протоколу й додатка присутності, щоб рендер ішов уже без БД.
+
+    :param voting_results: Підсумки, якщо вони вже є (їх повертає end_session).
     """
-    # Отримуємо дані про сесію
     session = await db.get_session_by_code(session_code)
     if not session:
         raise ValueError("Сесія не знайдена.")
@@ -42,12 +64,61 @@ async def generate_protocol(session_code, db):
     admin_id = session.admin_id
     participants = await db.get_session_participants_with_names(session_code) or []
     agenda = await db.get_session_agenda(session_code) or []
-    voting_results = await db.get_all_vote_results(session_code) or {}
+    if voting_results is None:
+        voting_results = await db.get_all_vote_results(session_code) or {}
+
+    # Питання з готовою секцією (draft_protocol_section) беруть доповідача й підсумки з неї
+    drafts = await db.get_protocol_drafts(session_code)
+    proposers = {}
+    for question in voting_results:
+        if question in drafts:
+            continue
+        proposed_name = await db.get_proposed_name(session_code, question) or "_________________"
+        proposed_rv = await db.get_name_rv(admin_id, proposed_name)
+        proposers[question] = proposed_rv.name_rv if proposed_rv and proposed_rv.name_rv else proposed_name
+
+    return SessionSnapshot(
+        session_code=session_code,
+        date=session.date,
+        admin_id=admin_id,
+        participants=participants,
+        agenda=agenda,
+        voting_results=voting_results,
+        council_info=await db.get_full_youth_council_info(admin_id) or {},
+        details=await db.get_session_details(session_code),
+        proposers=proposers,
+        drafts=drafts,
+    )
+
+
+async def draft_protocol_section(db, session_code, admin_id, question, proposer_name, tallies):
+    """
+    Готує секцію протоколу для щойно закритого питання, поки адмін переходить до наступного:
+    формулювання рішення (spaCy), доповідач у родовому відмінку та підсумки голосування.
+
+    :param tallies: {"for", "against", "abstain", "not_voted"} на момент закриття питання.
+    """
+    proposed_rv = await db.get_name_rv(admin_id, proposer_name)
+    proposer_rv = proposed_rv.name_rv if proposed_rv and proposed_rv.name_rv else proposer_name
+    wording = await asyncio.to_thread(convert_to_infinitive, question)
+    await db.save_protocol_draft(session_code, question, wording, proposer_rv, tallies)
 
-    print(voting_results)
 
-    youth_council_info = await db.get_full_youth_council_info(admin_id)
-    protocol_info = await db.get_session_details(session_code)
+async def generate_protocol(session_code, db):
+    """
+    Генерує протокол для завершеної сесії.
+    """
+    snapshot = await collect_session_snapshot(session_code, db)
+    return await asyncio.to_thread(render_protocol, snapshot)
+
+
+def render_protocol(snapshot):
+    """Рендерить протокол зі знімка сесії (синхронно: python-docx і spaCy) і повертає шлях до файлу."""
+    participants = snapshot.participants
+    agenda = snapshot.agenda
+    voting_results = snapshot.voting_results
+    youth_council_info = snapshot.council_info
+    protocol_info = snapshot.details
 
     council_name = youth_council_info.get("name", "______________________________________________________")
     if council_name.lower().strip()[:14] == 'молодіжна рада':
@@ -60,9 +131,9 @@ async def generate_protocol(session_code, db):
     session_type = protocol_info.get('session_type', "______________")
 
     try:
-        date = session.date.strftime("%Y_%m_%d_%H_%M")
+        date = snapshot.date.strftime("%Y_%m_%d_%H_%M")
     except Exception as e:
-        date = session.date
+        date = snapshot.date
 
     file_name = f"{date}_Протокол_{number}.docx"
     file_path = os.path.join("protocols", file_name)
@@ -115,15 +186,15 @@ async def generate_protocol(session_code, db):
     run.bold = True
 
     for i, (question, results) in enumerate(voting_results.items(), start=1):
-        question_inf = convert_to_infinitive(question)
+        draft = snapshot.drafts.get(question)
+        if draft:
+            question_inf, proposer_text, results = draft["wording"], draft["proposer_rv"], draft["tallies"]
+        else:
+            question_inf, proposer_text = convert_to_infinitive(question), snapshot.proposers[question]
         paragraph = document.add_paragraph(style='Normal')
         run = paragraph.add_run(f"{i}. По {questions[i]} питанню порядку денного слухали")
         run.bold = True
 
-        proposed_name = await db.get_proposed_name(session_code, question) or "_________________"
-        proposed_rv = await db.get_name_rv(admin_id, proposed_name)
-        proposer_text = proposed_rv.name_rv if proposed_rv and proposed_rv.name_rv else proposed_name
-
         document.add_paragraph(
             f"{proposer_text}, який запропонував {question_inf}", style='Normal'
         )
@@ -177,15 +248,15 @@ async def generate_attendance_list_full(session_code, db):
     :param db: Об'єкт бази даних.
     :return: Шлях до збереженого файлу анкети.
     """
-    session = await db.get_session_by_code(session_code)
-    if not session:
-        raise ValueError("Сесія не знайдена.")
+    snapshot = await collect_session_snapshot(session_code, db)
+    return await asyncio.to_thread(render_attendance_list, snapshot)
 
-    admin_id = session.admin_id
-    participants = await db.get_session_participants_with_names(session_code) or []
 
-    youth_council_info = await db.get_full_youth_council_info(admin_id)
-    protocol_info = await db.get_session_details(session_code)
+def render_attendance_list(snapshot):
+    """Рендерить анкету присутності зі знімка сесії і повертає шлях до файлу."""
+    participants = snapshot.participants
+    youth_council_info = snapshot.council_info
+    protocol_info = snapshot.details
 
     council_name = youth_council_info.get("name", "______________________________________________________")
     if council_name.lower().strip()[:14] == 'молодіжна рада':
@@ -197,9 +268,9 @@ async def generate_attendance_list_full(session_code, db):
 
     # Формуємо ім'я файлу додатка
     try:
-        date = session.date.strftime("%Y_%m_%d_%H_%M")
+        date = snapshot.date.strftime("%Y_%m_%d_%H_%M")
     except Exception as e:
-        date = session.date
+        date = snapshot.date
 
     file_name = f"{date}_Додаток_присутності_{number}.docx"
     file_path = os.path.join("protocols", file_name)
@@ -262,6 +333,7 @@ async def generate_attendance_list_full(session_code, db):
                     run.font.name = "Times New Roman"
                     run.font.size = Pt(14)
 
+    os.makedirs("protocols", exist_ok=True)
     document.save(file_path)
 
     return file_path
\ No newline at end of file
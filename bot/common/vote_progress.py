@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+# Не частіше одного редагування за цей інтервал: 40 голосів за пару секунд дадуть 2-3 редагування
+EDIT_INTERVAL = 1.5
+OPTIONS = ("За", "Проти", "Утримаюсь")
+
+
+class _ItemProgress:
+    __slots__ = ("bot", "chat_id", "message_id", "number", "question", "total", "votes",
+                 "closed", "last_edit", "rendered", "flush_task")
+
+    def __init__(self, bot, chat_id, number, question, total):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = None
+        self.number = number
+        self.question = question
+        self.total = total
+        self.votes = {}
+        self.closed = False
+        self.last_edit = 0.0
+        self.rendered = None
+        self.flush_task = None
+
+    def render(self):
+        tallies = {option: 0 for option in OPTIONS}
+        for vote in self.votes.values():
+            if vote in tallies:
+                tallies[vote] += 1
+        status = "✅ Голосування завершено" if self.closed else "🗳 Йде голосування"
+        return (
+            f"{status}\n<b>{self.number}. {self.question}</b>\n\n"
+            f"Проголосували: <b>{len(self.votes)}/{self.total}</b>\n"
+            f"За: {tallies['За']} · Проти: {tallies['Проти']} · Утримались: {tallies['Утримаюсь']}"
+        )
+
+
+class VoteProgress:
+    """
+    Одне «живе» повідомлення в чаті адміна на кожне питання: x/y проголосували та поточні підсумки.
+
+    Оновлюється з шляху голосування (record), а не опитуванням БД; редагування згортаються
+    так, щоб між ними минало щонайменше EDIT_INTERVAL секунд.
+    """
+
+    def __init__(self, edit_interval=EDIT_INTERVAL):
+        self.edit_interval = edit_interval
+        self._items = {}
+        self._finishing = set()  # Фінальні редагування, щоб задачі не зібрав GC до завершення
+
+    async def open(self, bot, admin_id, session_code, number, question, total):
+        """Надсилає адміну нове повідомлення прогресу для питання; попереднє питання сесії закривається."""
+        await self.close(session_code)
+        item = _ItemProgress(bot, admin_id, number, question, total)
+        self._items[int(session_code)] = item
+        item.rendered = item.render()
+        try:
+            sent = await bot.send_message(chat_id=admin_id, text=item.rendered, parse_mode="HTML")
+        except Exception as e:
+            logging.error(f"Не вдалося надіслати прогрес голосування адміну {admin_id}: {e}")
+            return
+        item.message_id = sent.message_id
+        item.last_edit = time.monotonic()
+
+    def record(self, session_code, user_id, vote):
+        """Враховує голос і планує оновлення повідомлення, якщо воно ще не заплановане."""
+        item = self._items.get(int(session_code))
+        if item is None or item.closed:
+            return
+        item.votes[user_id] = vote
+        if item.flush_task is None:
+            item.flush_task = asyncio.create_task(self._flush_later(item))
+
+    async def close(self, session_code):
+        """Фіналізує повідомлення питання одразу, без очікування інтервалу."""
+        task = self.finish(session_code)
+        if task is not None:
+            await task
+
+    def finish(self, session_code):
+        """Закриває питання синхронно (для after_commit), фінальне редагування йде фоновою задачею."""
+        item = self._items.pop(int(session_code), None)
+        if item is None:
+            return None
+        item.closed = True
+        if item.flush_task is not None:
+            item.flush_task.cancel()
+            item.flush_task = None
+        task = asyncio.create_task(self._edit(item))
+        self._finishing.add(task)
+        task.add_done_callback(self._finishing.discard)
+        return task
+
+    async def _flush_later(self, item):
+        try:
+            delay = item.last_edit + self.edit_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            item.flush_task = None
+            await self._edit(item)
+        except asyncio.CancelledError:
+            pass
+
+    async def _edit(self, item):
+        text = item.render()
+        if item.message_id is None or text == item.rendered:
+            return
+        item.rendered = text
+        item.last_edit = time.monotonic()
+        try:
+            await item.bot.edit_message_text(
+                text=text, chat_id=item.chat_id, message_id=item.message_id, parse_mode="HTML"
+            )
+        except TelegramRetryAfter as e:
+            # Повторимо з актуальним станом уже після паузи
+            item.rendered = None
+            item.last_edit = time.monotonic() + e.retry_after
+            if not item.closed and item.flush_task is None:
+                item.flush_task = asyncio.create_task(self._flush_later(item))
+        except TelegramBadRequest as e:
+            logging.warning(f"Не вдалося оновити прогрес голосування: {e}")
+
+
+vote_progress = VoteProgress()
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+
+from bot.common.live_voting import live_voting
+from bot.common.outbox import outbox
+from bot.keyboards.common import vote_inline_kb
+
+
+class VoteReminders:
+    """
+    Нагадування тим, хто ще не проголосував за поточне питання.
+
+    На кожну сесію — один таймер поточного питання: ставиться, коли питання розіслано, і
+    скасовується, щойно голосування по ньому закрито. Коли таймер спрацьовує, тим, хто не
+    голосував, через outbox надходить повідомлення з тими самими кнопками голосування.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.delay = 0
+        self._timers = {}
+
+    def configure(self, db, delay):
+        """db — основний Database процесу (не копія апдейту), delay — секунди; 0 вимикає нагадування."""
+        self.db = db
+        self.delay = delay
+
+    def schedule(self, session_code, item_id):
+        self.cancel(session_code)
+        if self.delay <= 0 or self.db is None or item_id is None:
+            return
+        code = int(session_code)
+        self._timers[code] = asyncio.create_task(self._remind_later(code, item_id))
+
+    def cancel(self, session_code):
+        timer = self._timers.pop(int(session_code), None)
+        if timer is not None:
+            timer.cancel()
+
+    def stop(self):
+        for session_code in list(self._timers):
+            self.cancel(session_code)
+
+    async def _remind_later(self, session_code, item_id):
+        await asyncio.sleep(self.delay)
+        try:
+            live = live_voting.get(session_code)
+            # Питання вже змінилось або закрилось, а скасування ще не дійшло
+            if live is None or live.current_item_id != item_id or live.current.closed:
+                return
+            non_voters = live.non_voters()
+            if not non_voters:
+                return
+            number = live.current_index + 1
+            await outbox.enqueue(
+                self.db,
+                non_voters,
+                text=f"⏰ Ви ще не проголосували за питання:\n<b>{number}. {live.current_question}</b>\n\n"
+                     f"Оберіть один із варіантів: 'За', 'Проти', 'Утримався'",
+                parse_mode="HTML",
+                reply_markup=vote_inline_kb(session_code, item_id),
+            )
+            logging.info(f"Нагадування по питанню {number} сесії {session_code}: {len(non_voters)} учасникам")
+        except Exception as e:
+            logging.error(f"Не вдалося надіслати нагадування сесії {session_code}: {e}")
+        finally:
+            if self._timers.get(session_code) is asyncio.current_task():
+                del self._timers[session_code]
+
+
+vote_reminders = VoteReminders()
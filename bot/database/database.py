@@ -1,11 +1,36 @@
+import copy
+import json
 import logging
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 from typing import Any, Callable, Dict
 
 from aiogram import BaseMiddleware, types
-from sqlalchemy import BigInteger, Boolean, Column, ForeignKey, Integer, String, Text, delete, func
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    String,
+    Text,
+    delete,
+    func,
+    insert,
+    literal,
+    or_,
+    update,
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.future import select
 from sqlalchemy.orm import declarative_base, relationship
 
+from bot.database.fsm_storage import update_db
+from bot.database.loader import LoaderRegistry
+
 Base = declarative_base()
 
 class Session(Base):
@@ -49,16 +74,113 @@ class Participant(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     session_id = Column(Integer, ForeignKey("sessions.id"), nullable=False)
-    user_id = Column(BigInteger, nullable=False)  # Змінено на BigInteger
+    user_id = Column(BigInteger, nullable=False, index=True)  # Змінено на BigInteger
     name = Column(String(255), nullable=False)
 
     session = relationship("Session", back_populates="participants")
 
 
+class User(Base):
+    __tablename__ = "users"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=False)  # Telegram user_id
+    name = Column(String(255), nullable=True)  # Найчастіше ім'я серед участей у сесіях
+    first_seen = Column(DateTime, default=func.now())
+    last_seen = Column(DateTime, default=func.now())
+    session_count = Column(Integer, nullable=False, default=0)
+    admin_count = Column(Integer, nullable=False, default=0)
+
+
+class OutboxMessage(Base):
+    __tablename__ = 'outbox'
+
+    # Вихідне повідомлення, яке ще треба доставити; після доставки рядок видаляється
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id = Column(BigInteger, nullable=False)
+    text = Column(Text, nullable=False)
+    parse_mode = Column(String(10), nullable=True)
+    reply_markup = Column(Text, nullable=True)  # JSON клавіатури
+    attempts = Column(Integer, nullable=False, default=0)
+    failed = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime, default=func.now())
+    # Хто з процесів забрав рядок на доставку і до якого часу; після цього його може забрати інший
+    claimed_by = Column(String(36), nullable=True)
+    claimed_until = Column(DateTime, nullable=True)
+
+
+class FsmRecord(Base):
+    __tablename__ = 'fsm_states'
+
+    # Стан FSM одного ключа aiogram; version росте з кожним записом (оптимістичне блокування)
+    key = Column(String(255), primary_key=True)
+    state = Column(String(100), nullable=True)
+    data = Column(Text, nullable=False, default='{}')  # JSON
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class OpenSession(Base):
+    __tablename__ = 'open_sessions'
+
+    # Сесія, що ще не завершена (від створення до end_session); is_active гасне вже на старті голосування
+    code = Column(Integer, primary_key=True)
+    opened_at = Column(DateTime, default=func.now())
+
+
 # Database Utility Functions
 class Database:
-    def __init__(self, session_factory):
+    def __init__(self, session_factory, max_connections=None):
+        # max_connections — для сумісності з Postgres-бекендом: без батчів loaders пул тут не голодує
         self.session_factory = session_factory
+        self._after_commit = None
+        self._after_rollback = None
+        # Запити тут не батчуються; порожній реєстр лише для спільного з Postgres-бекендом звіту на зупинці
+        self.loaders = LoaderRegistry()
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        """
+        Відкриває одну транзакцію на весь апдейт.
+
+        Повертає копію Database, усі методи якої працюють через одне з'єднання з пулу.
+        Їхні commit() лише скидають зміни в цю транзакцію, а фіксується вона один раз
+        наприкінці хендлера (або відкочується, якщо хендлер впав).
+        """
+        async with self.session_factory() as session:
+            connection = await session.connection()
+            scoped = copy.copy(self)
+            scoped.session_factory = async_sessionmaker(bind=connection, expire_on_commit=False)
+            scoped._after_commit = []
+            scoped._after_rollback = []
+            committed = False
+            try:
+                try:
+                    yield scoped
+                except Exception:
+                    # Вкладена сесія могла вже відкотити транзакцію сама
+                    if connection.in_transaction():
+                        await session.rollback()
+                    raise
+                await session.commit()
+                committed = True
+            finally:
+                if not committed:
+                    # Хендлер упав, коміт не пройшов або задачу скасовано — зміни апдейту не зафіксовані
+                    for callback in scoped._after_rollback:
+                        callback()
+            for callback in scoped._after_commit:
+                callback()
+
+    def after_commit(self, callback):
+        """Викликає callback, коли зміни апдейту зафіксовано (одразу, якщо спільної транзакції немає)."""
+        if self._after_commit is None:
+            callback()
+        else:
+            self._after_commit.append(callback)
+
+    def after_rollback(self, callback):
+        """Викликає callback, якщо зміни апдейту відкочено (без спільної транзакції — ніколи)."""
+        if self._after_rollback is not None:
+            self._after_rollback.append(callback)
 
     async def add_session(self, session_code, session_name, session_password, admin_id):
         async with self.session_factory() as session:
@@ -83,6 +205,11 @@ class Database:
                 admin_id=admin_id
             )
             session.add(new_session)
+            await session.merge(OpenSession(code=session_code))
+
+            user = await self._get_or_create_user(session, admin_id)
+            user.admin_count += 1
+            user.last_seen = func.now()
             await session.commit()
 
     async def set_session_agenda(self, session_code, agenda):
@@ -126,6 +253,7 @@ class Database:
 
             if session_obj:
                 session_obj.is_active = False
+                await session.execute(delete(OpenSession).where(OpenSession.code == session_obj.code))
                 results = {}
 
                 # Отримуємо пов'язані agenda_items через асинхронний запит
@@ -194,6 +322,29 @@ class Database:
                 return [item.description for item in agenda_items]
             return []
 
+    async def get_agenda_item_ids(self, session_code):
+        """ID пунктів порядку денного в тому ж порядку, що й get_session_agenda."""
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(AgendaItem.id)
+                .join(Session, AgendaItem.session_id == Session.id)
+                .where(Session.code == session_code)
+            )
+            return tuple(result.scalars().all())
+
+    async def add_item_vote(self, agenda_item_id, user_id, vote):
+        """Додає або оновлює голос за пунктом порядку денного за його ID."""
+        async with self.session_factory() as session:
+            existing_vote_result = await session.execute(
+                select(Vote).where(Vote.agenda_item_id == agenda_item_id, Vote.user_id == user_id)
+            )
+            existing_vote = existing_vote_result.scalar_one_or_none()
+            if existing_vote:
+                existing_vote.vote = vote
+            else:
+                session.add(Vote(agenda_item_id=agenda_item_id, user_id=user_id, vote=vote))
+            await session.commit()
+
     async def add_vote(self, session_code, user_id, question, vote):
         """
         Додає голос учасника до бази даних.
@@ -356,9 +507,91 @@ class Database:
                 name=user_name
             )
             session.add(new_participant)
+
+            user = await self._get_or_create_user(session, user_id)
+            user.session_count += 1
+            user.last_seen = func.now()
+            user.name = await self._most_common_name(session, user_id)
             await session.commit()
             logging.info(f"Користувач {user_id} доданий до сесії {session_code} як {user_name}.")
 
+    async def get_join_info(self, session_code, user_id):
+        """
+        Одним запитом: сесія, до якої ще можна приєднатися (id, name, password),
+        і ім'я, під яким користувач брав участь востаннє (last_name). None, якщо сесії немає.
+        """
+        async with self.session_factory() as session:
+            last_name = (
+                select(Participant.name)
+                .where(Participant.user_id == user_id)
+                .order_by(Participant.id.desc())
+                .limit(1)
+                .scalar_subquery()
+            )
+            result = await session.execute(
+                select(Session.id, Session.name, Session.password, last_name.label("last_name"))
+                .where(Session.code == session_code, True == Session.is_active)
+            )
+            return result.one_or_none()
+
+    async def join_session(self, session_id, user_id, user_name):
+        """
+        Додає учасника, якщо його ще немає в сесії (INSERT ... SELECT ... WHERE NOT EXISTS),
+        і оновлює довідник users. Повертає True, якщо учасника додано.
+        """
+        async with self.session_factory() as session:
+            already_joined = (
+                select(Participant.id)
+                .where(Participant.session_id == session_id, Participant.user_id == user_id)
+                .exists()
+            )
+            inserted = await session.execute(
+                insert(Participant).from_select(
+                    ["session_id", "user_id", "name"],
+                    select(Session.id, literal(user_id, BigInteger), literal(user_name, String))
+                    .where(Session.id == session_id, ~already_joined)
+                )
+            )
+            if inserted.rowcount:
+                most_common_name = (
+                    select(Participant.name)
+                    .where(Participant.user_id == user_id)
+                    .group_by(Participant.name)
+                    .order_by(func.count(Participant.name).desc())
+                    .limit(1)
+                    .scalar_subquery()
+                )
+                updated = await session.execute(
+                    update(User)
+                    .where(User.id == user_id)
+                    .values(session_count=User.session_count + 1, last_seen=func.now(), name=most_common_name)
+                )
+                if not updated.rowcount:
+                    session.add(User(id=user_id, name=user_name, session_count=1, admin_count=0))
+            await session.commit()
+            return bool(inserted.rowcount)
+
+    @staticmethod
+    async def _get_or_create_user(session, user_id):
+        """Повертає запис довідника users, створюючи його при першій появі користувача."""
+        user = await session.get(User, user_id)
+        if user is None:
+            user = User(id=user_id, session_count=0, admin_count=0)
+            session.add(user)
+        return user
+
+    @staticmethod
+    async def _most_common_name(session, user_id):
+        """Найчастіше ім'я користувача серед його участей (лише його рядки, не вся таблиця)."""
+        result = await session.execute(
+            select(Participant.name)
+            .where(Participant.user_id == user_id)
+            .group_by(Participant.name)
+            .order_by(func.count(Participant.name).desc())
+            .limit(1)
+        )
+        return result.scalar_one_or_none()
+
     async def get_session_participants(self, session_code):
         async with self.session_factory() as session:
             result = await session.execute(
@@ -421,6 +654,23 @@ class Database:
             )
             return result.scalar_one_or_none() is not None
 
+    async def get_question_votes(self, session_code, question):
+        """Голоси за питання як пари (user_id, vote)."""
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(Vote.user_id, Vote.vote).where(
+                    Vote.agenda_item_id == select(AgendaItem.id)
+                    .where(
+                        AgendaItem.description == question,
+                        AgendaItem.session_id == select(Session.id)
+                        .where(Session.code == session_code)
+                        .scalar_subquery()
+                    )
+                    .scalar_subquery()
+                )
+            )
+            return result.all()
+
     async def remove_participant(self, session_code: int, user_id: int):
         """
         Видаляє учасника з сесії.
@@ -439,12 +689,17 @@ class Database:
                 raise Exception(f"Сесія з кодом {session_code} не знайдена.")
 
             # Видаляємо учасника
-            await session.execute(
+            deleted = await session.execute(
                 delete(Participant).where(
                     Participant.session_id == session_id,
                     user_id == Participant.user_id
                 )
             )
+
+            user = await session.get(User, user_id)
+            if user and deleted.rowcount:
+                user.session_count = max(0, user.session_count - deleted.rowcount)
+                user.name = await self._most_common_name(session, user_id) or user.name
             await session.commit()
 
     async def get_all_vote_results(self, session_code: int) -> dict:
@@ -511,6 +766,257 @@ class Database:
             participants = participants_result.scalars().all()
             return [{"id": p.user_id, "name": p.name} for p in participants]
 
+    async def backfill_users(self):
+        """Одноразово заповнює довідник users з історії participants/sessions, якщо він ще порожній."""
+        async with self.session_factory() as session:
+            has_users = await session.execute(select(User.id).limit(1))
+            if has_users.first():
+                return
+
+            users = {}
+
+            # Рядки відсортовані за частотою, тож перше ім'я кожного user_id - найчастіше
+            names_result = await session.execute(
+                select(Participant.user_id, Participant.name, func.count(Participant.id))
+                .group_by(Participant.user_id, Participant.name)
+                .order_by(Participant.user_id, func.count(Participant.id).desc())
+            )
+            for user_id, name, count in names_result.fetchall():
+                if user_id not in users:
+                    users[user_id] = User(id=user_id, name=name, session_count=0, admin_count=0)
+                users[user_id].session_count += count
+
+            admins_result = await session.execute(
+                select(Session.admin_id, func.count(Session.id)).group_by(Session.admin_id)
+            )
+            for admin_id, count in admins_result.fetchall():
+                if admin_id not in users:
+                    users[admin_id] = User(id=admin_id, session_count=0, admin_count=0)
+                users[admin_id].admin_count = count
+
+            session.add_all(users.values())
+            await session.commit()
+            logging.info(f"Довідник users заповнено з історії: {len(users)} користувачів.")
+
+
+    ### --- OUTBOX FUNCTIONS --- ###
+    async def add_outbox_messages(self, chat_ids, text, parse_mode=None, reply_markup=None):
+        """Записує одне повідомлення для кожного chat_id у чергу відправки."""
+        async with self.session_factory() as session:
+            session.add_all([
+                OutboxMessage(chat_id=chat_id, text=text, parse_mode=parse_mode, reply_markup=reply_markup)
+                for chat_id in chat_ids
+            ])
+            await session.commit()
+
+    async def claim_outbox(self, limit: int = 100, lease: float = 60.0):
+        """
+        Забирає на доставку найстаріші недоставлені повідомлення, яких не тримає інший процес.
+
+        Рядки позначаються токеном цього виклику на lease секунд (SKIP LOCKED там, де БД його
+        підтримує), тож кілька процесів з outbox не надішлють одне повідомлення двічі. Якщо процес
+        упав, не підтвердивши доставку, після lease рядок забере інший.
+
+        Повідомлення одного чату забираються лише суцільним префіксом від найстарішого
+        недоставленого: якщо раніший рядок чату тримає інший процес або він чекає повтору
+        після збою, пізніші не підуть раніше за нього.
+        """
+        token = uuid.uuid4().hex
+        # Колонки без часового поясу: зберігаємо UTC без tzinfo
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        free = or_(OutboxMessage.claimed_until.is_(None), OutboxMessage.claimed_until < now)
+        async with self.session_factory() as session:
+            ids = (await session.execute(
+                select(OutboxMessage.id)
+                .where(OutboxMessage.failed.is_(False), free)
+                .order_by(OutboxMessage.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )).scalars().all()
+            if not ids:
+                return []
+            ids = await self._outbox_chat_prefixes(session, ids)
+            if not ids:
+                await session.commit()
+                return []
+            # Умова повторюється в UPDATE: рядок, який уже забрав інший процес, не перепишеться
+            await session.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id.in_(ids), free)
+                .values(claimed_by=token, claimed_until=now + timedelta(seconds=lease))
+            )
+            result = await session.execute(
+                select(OutboxMessage).where(OutboxMessage.claimed_by == token).order_by(OutboxMessage.id)
+            )
+            messages = result.scalars().all()
+            await session.commit()
+            return messages
+
+    async def _outbox_chat_prefixes(self, session, ids):
+        """Лишає з ids лише рядки, перед якими в їхньому чаті немає недоставлених рядків поза ids."""
+        selected = set(ids)
+        rows = (await session.execute(
+            select(OutboxMessage.id, OutboxMessage.chat_id)
+            .where(
+                OutboxMessage.chat_id.in_(
+                    select(OutboxMessage.chat_id).where(OutboxMessage.id.in_(ids)).scalar_subquery()
+                ),
+                OutboxMessage.failed.is_(False),
+                OutboxMessage.id <= max(ids),
+            )
+            .order_by(OutboxMessage.id)
+        )).all()
+        blocked, prefix = set(), []
+        for message_id, chat_id in rows:
+            if chat_id in blocked:
+                continue
+            if message_id in selected:
+                prefix.append(message_id)
+            else:
+                blocked.add(chat_id)
+        return prefix
+
+    async def ack_outbox(self, delivered_ids, failed_ids, max_attempts: int = 5, released_ids=()):
+        """
+        Видаляє доставлені повідомлення; недоставленим додає спробу, після max_attempts - позначає failed.
+        released_ids (не надсилались, бо раніше в чаті був збій) просто повертаються в чергу.
+        """
+        async with self.session_factory() as session:
+            if delivered_ids:
+                await session.execute(delete(OutboxMessage).where(OutboxMessage.id.in_(delivered_ids)))
+            if released_ids:
+                await session.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id.in_(released_ids))
+                    .values(claimed_by=None, claimed_until=None)
+                )
+            if failed_ids:
+                await session.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id.in_(failed_ids))
+                    .values(
+                        attempts=OutboxMessage.attempts + 1,
+                        failed=OutboxMessage.attempts + 1 >= max_attempts,
+                        claimed_by=None,
+                        claimed_until=None,
+                    )
+                )
+            await session.commit()
+
+    async def purge_outbox(self, retention: float) -> int:
+        """Видаляє повідомлення, позначені failed, старші за retention секунд. Повертає кількість."""
+        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=retention)
+        async with self.session_factory() as session:
+            result = await session.execute(
+                delete(OutboxMessage).where(OutboxMessage.failed.is_(True), OutboxMessage.created_at < cutoff)
+            )
+            await session.commit()
+            return result.rowcount
+
+    ### --- OPEN SESSIONS FUNCTIONS --- ###
+    async def get_open_session_codes(self):
+        """Коди всіх незавершених сесій."""
+        async with self.session_factory() as session:
+            result = await session.execute(select(OpenSession.code))
+            return [code for (code,) in result.fetchall()]
+
+    async def is_session_open(self, session_code):
+        async with self.session_factory() as session:
+            result = await session.execute(select(OpenSession.code).where(OpenSession.code == int(session_code)))
+            return result.first() is not None
+
+    async def seed_open_sessions(self):
+        """
+        Додає в open_sessions незавершені сесії, яких там немає: ті, що ще приймають учасників (is_active),
+        і ті, що голосують — is_active знято на старті голосування, але адмін досі у стані FSM цієї
+        сесії (завершення сесії його очищає).
+        """
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(Session.code, Session.is_active, Session.admin_id)
+                .where(Session.code.not_in(select(OpenSession.code)))
+            )
+            rows = result.all()
+            codes = [code for code, is_active, _ in rows if is_active]
+            voting = await self._voting_session_codes(
+                session, {code: admin_id for code, is_active, admin_id in rows if not is_active}
+            )
+            codes += sorted(voting)
+            if codes:
+                session.add_all(OpenSession(code=code) for code in codes)
+                await session.commit()
+                logging.info(
+                    f"open_sessions доповнено {len(codes) - len(voting)} активними сесіями "
+                    f"і {len(voting)} сесіями, що голосують."
+                )
+
+    @staticmethod
+    async def _voting_session_codes(session, admins):
+        """Коди сесій, чий адмін має непорожній стан FSM з їхнім session_code. admins — {код: admin_id}."""
+        if not admins:
+            return set()
+        result = await session.execute(
+            select(FsmRecord.key, FsmRecord.data).where(FsmRecord.state.is_not(None))
+        )
+        codes = set()
+        for key, data in result.all():
+            try:
+                code = int(json.loads(data).get("session_code"))
+                user_id = int(key.split(":")[-2])  # fsm:<bot>:<chat>:<user>:<destiny>
+            except (TypeError, ValueError, AttributeError):
+                continue
+            if admins.get(code) == user_id:
+                codes.add(code)
+        return codes
+
+    async def get_session_bindings(self):
+        """Пари (код сесії, chat id) адміністраторів і учасників незавершених сесій, від давніших сесій до новіших."""
+        async with self.session_factory() as session:
+            admins = await session.execute(
+                select(Session.id, Session.code, Session.admin_id)
+                .join(OpenSession, OpenSession.code == Session.code)
+            )
+            participants = await session.execute(
+                select(Session.id, Session.code, Participant.user_id)
+                .join(Participant, Participant.session_id == Session.id)
+                .join(OpenSession, OpenSession.code == Session.code)
+            )
+            rows = sorted(admins.all() + participants.all(), key=lambda row: row[0])
+        return [(code, chat_id) for _, code, chat_id in rows]
+
+    ### --- FSM FUNCTIONS --- ###
+    async def get_fsm_record(self, key):
+        """Повертає (state, data JSON, version) ключа FSM або None."""
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(FsmRecord.state, FsmRecord.data, FsmRecord.version).where(FsmRecord.key == key)
+            )
+            return result.one_or_none()
+
+    async def save_fsm_record(self, key, state, data, expected_version):
+        """
+        Записує стан FSM, лише якщо в БД досі expected_version (0 — ключа ще немає).
+        Повертає False, якщо інший процес устиг записати раніше.
+        """
+        async with self.session_factory() as session:
+            if expected_version == 0:
+                # Точка збереження: конфлікт вставки не має відкотити решту транзакції апдейту
+                try:
+                    async with session.begin_nested():
+                        session.add(FsmRecord(key=key, state=state, data=data, version=1))
+                except IntegrityError:
+                    return False
+                await session.commit()
+                return True
+
+            result = await session.execute(
+                update(FsmRecord)
+                .where(FsmRecord.key == key, FsmRecord.version == expected_version)
+                .values(state=state, data=data, version=expected_version + 1)
+            )
+            await session.commit()
+            return result.rowcount == 1
+
 
 class DatabaseMiddleware(BaseMiddleware):
     def __init__(self, db: Database):
@@ -518,5 +1024,11 @@ class DatabaseMiddleware(BaseMiddleware):
         self.db = db
 
     async def __call__(self, handler: Callable, event: Any, data: Dict[str, Any]) -> Any:
-        data['db'] = self.db
-        return await handler(event, data)
\ No newline at end of file
+        async with self.db.unit_of_work() as db:
+            data['db'] = db
+            # Стан FSM, записаний хендлером, потрапляє в ту саму транзакцію
+            token = update_db.set(db)
+            try:
+                return await handler(event, data)
+            finally:
+                update_db.reset(token)
\ No newline at end of file
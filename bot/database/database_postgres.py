@@ -1,12 +1,39 @@
+import asyncio
+import copy
+import json
 import logging
+import uuid
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime, timedelta, timezone
 from typing import Any, Callable, Dict
 
 from aiogram import BaseMiddleware
-from sqlalchemy import BigInteger, Boolean, Column, DateTime, ForeignKey, Integer, String, Text, delete
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    String,
+    Text,
+    bindparam,
+    delete,
+    event,
+    insert,
+    literal,
+    or_,
+    update,
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.future import select
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.sql import expression, func
 
+from bot.database.fsm_storage import update_db
+from bot.database.loader import LoaderRegistry
+
 Base = declarative_base()
 
 class Session(Base):
@@ -54,7 +81,7 @@ class Participant(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     session_id = Column(Integer, ForeignKey("sessions.id"), nullable=False)
-    user_id = Column(BigInteger, nullable=False)
+    user_id = Column(BigInteger, nullable=False, index=True)
     name = Column(String(50), nullable=False)
 
     session = relationship("Session", back_populates="participants")
@@ -78,6 +105,59 @@ class Name(Base):
     name = Column(String(50), nullable=False)
     name_rv = Column(String(60), nullable=True)
 
+class User(Base):
+    __tablename__ = 'users'
+
+    id = Column(BigInteger, primary_key=True, autoincrement=False)  # Telegram user_id
+    name = Column(String(50), nullable=True)  # Найчастіше ім'я серед участей у сесіях
+    first_seen = Column(DateTime, default=func.now())
+    last_seen = Column(DateTime, default=func.now())
+    session_count = Column(Integer, nullable=False, default=0)
+    admin_count = Column(Integer, nullable=False, default=0)
+
+class OutboxMessage(Base):
+    __tablename__ = 'outbox'
+
+    # Вихідне повідомлення, яке ще треба доставити; після доставки рядок видаляється
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id = Column(BigInteger, nullable=False)
+    text = Column(Text, nullable=False)
+    parse_mode = Column(String(10), nullable=True)
+    reply_markup = Column(Text, nullable=True)  # JSON клавіатури
+    attempts = Column(Integer, nullable=False, default=0)
+    failed = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime, default=func.now())
+    # Хто з процесів забрав рядок на доставку і до якого часу; після цього його може забрати інший
+    claimed_by = Column(String(36), nullable=True)
+    claimed_until = Column(DateTime, nullable=True)
+
+class FsmRecord(Base):
+    __tablename__ = 'fsm_states'
+
+    # Стан FSM одного ключа aiogram; version росте з кожним записом (оптимістичне блокування)
+    key = Column(String(255), primary_key=True)
+    state = Column(String(100), nullable=True)
+    data = Column(Text, nullable=False, default='{}')  # JSON
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class OpenSession(Base):
+    __tablename__ = 'open_sessions'
+
+    # Сесія, що ще не завершена (від створення до end_session); is_active гасне вже на старті голосування
+    code = Column(Integer, primary_key=True)
+    opened_at = Column(DateTime, default=func.now())
+
+class ProtocolDraft(Base):
+    __tablename__ = 'protocol_drafts'
+
+    # Готова секція протоколу для питання: пишеться, щойно адмін ввів доповідача закритого питання
+    agenda_item_id = Column(Integer, ForeignKey("agenda_items.id"), primary_key=True)
+    wording = Column(Text, nullable=False)  # Формулювання рішення в інфінітиві
+    proposer_rv = Column(String(255), nullable=False)  # Доповідач у родовому відмінку
+    tallies = Column(Text, nullable=False)  # JSON: for, against, abstain, not_voted
+    created_at = Column(DateTime, default=func.now())
+
 class Logging(Base):
     __tablename__ = 'logs'
 
@@ -86,10 +166,183 @@ class Logging(Base):
     name = Column(String(100), nullable=False)
 
 
+# Гарячі запити голосування будуються один раз при імпорті. Значення підставляються
+# через bindparam, тож кожен виклик лише бере готовий скомпільований запит із кешу рушія.
+SESSION_BY_CODE = select(Session).where(Session.code == bindparam("session_code"))
+SESSION_ID_BY_CODE = select(Session.id).where(Session.code == bindparam("session_code")).scalar_subquery()
+ADMIN_IDS_BY_CODES = select(Session.code, Session.admin_id).where(
+    Session.code.in_(bindparam("codes", expanding=True))
+)
+QUESTION_INDEX_BY_CODE = select(Session.current_question_index).where(Session.code == bindparam("session_code"))
+AGENDAS_BY_CODES = (
+    select(Session.code, AgendaItem.description)
+    .join(Session, AgendaItem.session_id == Session.id)
+    .where(Session.code.in_(bindparam("codes", expanding=True)))
+    .order_by(AgendaItem.position)
+)
+AGENDA_ITEM_BY_QUESTION = select(AgendaItem).where(
+    AgendaItem.session_id == SESSION_ID_BY_CODE,
+    AgendaItem.description == bindparam("question")
+)
+AGENDA_ITEM_ID_BY_QUESTION = select(AgendaItem.id).where(
+    AgendaItem.session_id == SESSION_ID_BY_CODE,
+    AgendaItem.description == bindparam("question")
+).scalar_subquery()
+PROPOSED_NAME_BY_QUESTION = select(AgendaItem.proposed).where(
+    AgendaItem.session_id == SESSION_ID_BY_CODE,
+    AgendaItem.description == bindparam("question")
+)
+PARTICIPANT_IDS_BY_CODES = (
+    select(Session.code, Participant.user_id)
+    .join(Session, Participant.session_id == Session.id)
+    .where(Session.code.in_(bindparam("codes", expanding=True)))
+    .order_by(Participant.id)
+)
+PARTICIPANT_COUNT_BY_CODE = select(func.count(Participant.id)).where(Participant.session_id == SESSION_ID_BY_CODE)
+USER_VOTE_BY_QUESTION = select(Vote).where(
+    Vote.agenda_item_id == AGENDA_ITEM_ID_BY_QUESTION,
+    Vote.user_id == bindparam("user_id")
+)
+AGENDA_ITEM_IDS_BY_CODE = (
+    select(AgendaItem.id)
+    .where(AgendaItem.session_id == SESSION_ID_BY_CODE)
+    .order_by(AgendaItem.position)
+)
+USER_VOTE_BY_ITEM = select(Vote).where(
+    Vote.agenda_item_id == bindparam("agenda_item_id"),
+    Vote.user_id == bindparam("user_id")
+)
+LAST_NAME_BY_USER = (
+    select(Participant.name)
+    .where(Participant.user_id == bindparam("user_id"))
+    .order_by(Participant.id.desc())
+    .limit(1)
+    .scalar_subquery()
+)
+JOIN_INFO_BY_CODE = select(
+    Session.id, Session.name, Session.password, LAST_NAME_BY_USER.label("last_name")
+).where(Session.code == bindparam("session_code"), Session.is_active.is_(True))
+MOST_COMMON_NAME_BY_USER = (
+    select(Participant.name)
+    .where(Participant.user_id == bindparam("user_id"))
+    .group_by(Participant.name)
+    .order_by(func.count(Participant.name).desc())
+    .limit(1)
+    .scalar_subquery()
+)
+PROTOCOL_DRAFTS_BY_CODE = (
+    select(AgendaItem.description, ProtocolDraft.wording, ProtocolDraft.proposer_rv, ProtocolDraft.tallies)
+    .join(ProtocolDraft, ProtocolDraft.agenda_item_id == AgendaItem.id)
+    .where(AgendaItem.session_id == SESSION_ID_BY_CODE)
+)
+VOTES_BY_QUESTION = select(Vote.user_id, Vote.vote).where(Vote.agenda_item_id == AGENDA_ITEM_ID_BY_QUESTION)
+VOTE_COUNTS_BY_QUESTION = (
+    select(Vote.vote, func.count(Vote.id))
+    .where(Vote.agenda_item_id == AGENDA_ITEM_ID_BY_QUESTION)
+    .group_by(Vote.vote)
+)
+
+
+# З'єднання пулу, які не займають транзакції апдейтів: на них ідуть батчі loaders
+RESERVED_CONNECTIONS = 3
+# Таблиці, які читають loaders: після запису в них транзакція апдейту читає їх сама
+LOADER_TABLES = {"sessions", "agenda_items", "participants"}
+
+
+def _writes_loader_tables(context):
+    if not (context.isinsert or context.isupdate or context.isdelete):
+        return False
+    table = getattr(getattr(context.compiled, "statement", None), "table", None)
+    return table is None or getattr(table, "name", None) in LOADER_TABLES
+
+
 # Database Utility Functions
 class Database:
-    def __init__(self, session_factory):
+    def __init__(self, session_factory, max_connections=None):
+        """max_connections — pool_size + max_overflow рушія; None — пул без межі."""
         self.session_factory = session_factory
+        self._after_commit = None
+        self._after_rollback = None
+        self._wrote = False
+        # Транзакція апдейту тримає з'єднання, поки чекає батч loaders, якому потрібне ще одне.
+        # Якщо всі з'єднання зайняті такими транзакціями, батч не отримає жодного і всі чекають
+        # до тайм-ауту пулу, тож одночасних транзакцій завжди менше, ніж з'єднань.
+        limit = max(1, max_connections - RESERVED_CONNECTIONS) if max_connections else None
+        self._units_of_work = asyncio.Semaphore(limit) if limit else None
+        # Спільні для всіх апдейтів циклу: однакові одночасні запити йдуть в БД один раз,
+        # різні коди сесій з одного проходу циклу - одним запитом IN (...).
+        # Батч виконується через власне з'єднання, поза транзакцією апдейту (див. _batched).
+        self.loaders = LoaderRegistry(
+            admin_id=self._load_admin_ids,
+            agenda=self._load_agendas,
+            participants=self._load_participants,
+        )
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        """
+        Відкриває одну транзакцію на весь апдейт.
+
+        Повертає копію Database, усі методи якої працюють через одне з'єднання з пулу.
+        Їхні commit() лише скидають зміни в цю транзакцію, а фіксується вона один раз
+        наприкінці хендлера (або відкочується, якщо хендлер впав).
+        """
+        async with self._units_of_work or nullcontext(), self.session_factory() as session:
+            connection = await session.connection()
+            scoped = copy.copy(self)
+            scoped.session_factory = async_sessionmaker(bind=connection, expire_on_commit=False)
+            scoped._after_commit = []
+            scoped._after_rollback = []
+
+            def mark_write(conn, cursor, statement, parameters, context, executemany):
+                if _writes_loader_tables(context):
+                    scoped._wrote = True
+
+            event.listen(connection.sync_connection, "after_cursor_execute", mark_write)
+            committed = False
+            try:
+                try:
+                    yield scoped
+                except Exception:
+                    # Вкладена сесія могла вже відкотити транзакцію сама
+                    if connection.in_transaction():
+                        await session.rollback()
+                    raise
+                await session.commit()
+                committed = True
+            finally:
+                event.remove(connection.sync_connection, "after_cursor_execute", mark_write)
+                if not committed:
+                    # Хендлер упав, коміт не пройшов або задачу скасовано — зміни апдейту не зафіксовані
+                    for callback in scoped._after_rollback:
+                        callback()
+            for callback in scoped._after_commit:
+                callback()
+
+    def _batched(self, name, session_code, batch_fn):
+        """
+        Читання через спільний батч loaders, поки транзакція апдейту не писала в його таблиці.
+        Після запису батч на іншому з'єднанні не побачив би незакомічених змін, тож читаємо в транзакції.
+        """
+        if self._wrote:
+            return self._load_one(batch_fn, int(session_code))
+        return self.loaders.get(name).load(int(session_code))
+
+    @staticmethod
+    async def _load_one(batch_fn, key):
+        return (await batch_fn([key])).get(key)
+
+    def after_commit(self, callback):
+        """Викликає callback, коли зміни апдейту зафіксовано (одразу, якщо спільної транзакції немає)."""
+        if self._after_commit is None:
+            callback()
+        else:
+            self._after_commit.append(callback)
+
+    def after_rollback(self, callback):
+        """Викликає callback, якщо зміни апдейту відкочено (без спільної транзакції — ніколи)."""
+        if self._after_rollback is not None:
+            self._after_rollback.append(callback)
 
     async def add_session(self, session_code, session_name, session_password, admin_id):
         async with self.session_factory() as session:
@@ -109,6 +362,11 @@ class Database:
                 admin_id=admin_id
             )
             session.add(new_session)
+            await session.merge(OpenSession(code=int(session_code)))
+
+            user = await self._get_or_create_user(session, admin_id)
+            user.admin_count += 1
+            user.last_seen = func.now()
             await session.commit()
 
     async def set_session_agenda(self, session_code, agenda):
@@ -118,6 +376,9 @@ class Database:
             )
             session_obj = result.scalar_one_or_none()
             if session_obj:
+                await session.execute(delete(ProtocolDraft).where(ProtocolDraft.agenda_item_id.in_(
+                    select(AgendaItem.id).where(AgendaItem.session_id == session_obj.id)
+                )))
                 await session.execute(
                     delete(AgendaItem).where(AgendaItem.session_id == session_obj.id)
                 )
@@ -150,6 +411,7 @@ class Database:
 
             if session_obj:
                 session_obj.is_active = False
+                await session.execute(delete(OpenSession).where(OpenSession.code == session_obj.code))
                 results = {}
 
                 agenda_result = await session.execute(
@@ -200,23 +462,36 @@ class Database:
             return session_obj.code if session_obj else None
 
     async def get_session_agenda(self, session_code):
+        return await self._batched("agenda", session_code, self._load_agendas)
+
+    async def _load_agendas(self, codes):
         async with self.session_factory() as session:
-            result = await session.execute(
-                select(Session).where(Session.code == session_code)
+            result = await session.execute(AGENDAS_BY_CODES, {"codes": codes})
+            agendas = {code: [] for code in codes}
+            for code, description in result.all():
+                agendas[code].append(description)
+            # Відсортований порядок денний; кортеж, бо його ділять між собою кілька апдейтів
+            return {code: tuple(items) for code, items in agendas.items()}
+
+    async def get_agenda_item_ids(self, session_code):
+        """ID пунктів порядку денного в тому ж порядку, що й get_session_agenda."""
+        async with self.session_factory() as session:
+            result = await session.execute(AGENDA_ITEM_IDS_BY_CODE, {"session_code": int(session_code)})
+            return tuple(result.scalars().all())
+
+    async def add_item_vote(self, agenda_item_id, user_id, vote):
+        """Додає або оновлює голос за пунктом порядку денного за його ID — без пошуку за текстом питання."""
+        async with self.session_factory() as session:
+            existing_vote_result = await session.execute(
+                USER_VOTE_BY_ITEM, {"agenda_item_id": agenda_item_id, "user_id": user_id}
             )
-            session_obj = result.scalar_one_or_none()
-            if session_obj:
-                # Отримуємо відсортований порядок денний
-                agenda_result = await session.execute(
-                    select(AgendaItem)
-                    .where(AgendaItem.session_id == session_obj.id)
-                    .order_by(AgendaItem.position)
-                )
-                agenda_items = agenda_result.scalars().all()
+            existing_vote = existing_vote_result.scalar_one_or_none()
+            if existing_vote:
+                existing_vote.vote = vote
+            else:
+                session.add(Vote(agenda_item_id=agenda_item_id, user_id=user_id, vote=vote))
+            await session.commit()
 
-                sorted_agenda = [item.description for item in agenda_items]
-                return tuple(sorted_agenda)
-            return []
     async def add_vote(self, session_code, user_id, question, vote):
         """
         Додає голос учасника до бази даних.
@@ -226,25 +501,14 @@ class Database:
         :param vote: Варіант голосу ("За", "Проти", "Утримаюсь").
         """
         async with self.session_factory() as session:
-            result = await session.execute(
-                select(Session).where(Session.code == int(session_code))
-            )
-            session_obj = result.scalar_one_or_none()
-            if not session_obj:
-                logging.warning(f"Сесія з кодом {session_code} не знайдена для голосування.")
-                return
-
-            agenda_result = await session.execute(
-                select(AgendaItem).where(AgendaItem.session_id == session_obj.id, AgendaItem.description == question)
-            )
+            params = {"session_code": int(session_code), "question": question}
+            agenda_result = await session.execute(AGENDA_ITEM_BY_QUESTION, params)
             agenda_item = agenda_result.scalar_one_or_none()
             if not agenda_item:
                 logging.warning(f"Питання '{question}' не знайдено в порядку денному сесії {session_code}.")
                 return
 
-            existing_vote_result = await session.execute(
-                select(Vote).where(Vote.agenda_item_id == agenda_item.id, Vote.user_id == user_id)
-            )
+            existing_vote_result = await session.execute(USER_VOTE_BY_QUESTION, {**params, "user_id": user_id})
             existing_vote = existing_vote_result.scalar_one_or_none()
             if existing_vote:
                 logging.info(f"Користувач {user_id} вже голосував за питання '{question}'. Оновлюємо голос.")
@@ -262,71 +526,38 @@ class Database:
 
     async def check_all_votes_collected(self, session_code, question):
         async with self.session_factory() as session:
-            session_obj = await session.execute(
-                select(Session).where(Session.code == int(session_code))
-            )
-            session_obj = session_obj.scalar_one_or_none()
-            if not session_obj:
+            params = {"session_code": int(session_code), "question": question}
+            agenda_item_result = await session.execute(AGENDA_ITEM_BY_QUESTION, params)
+            if not agenda_item_result.scalar_one_or_none():
                 return False
 
-            agenda_item_result = await session.execute(
-                select(AgendaItem).where(AgendaItem.session_id == session_obj.id, AgendaItem.description == question)
-            )
-            agenda_item = agenda_item_result.scalar_one_or_none()
-            if not agenda_item:
-                return False
-
-            participants_result = await session.execute(
-                select(Participant).where(Participant.session_id == session_obj.id)
-            )
-            total_participants = len(participants_result.scalars().all())
-
-            vote_count_result = await session.execute(
-                select(Vote).where(Vote.agenda_item_id == agenda_item.id)
-            )
-            total_votes = len(vote_count_result.scalars().all())
+            total_participants = (await session.execute(PARTICIPANT_COUNT_BY_CODE, params)).scalar()
+            vote_counts = await session.execute(VOTE_COUNTS_BY_QUESTION, params)
+            total_votes = sum(count for _, count in vote_counts.all())
             return total_votes >= total_participants
 
     async def count_of_participants(self, session_code):
         async with self.session_factory() as session:
-            session_obj = await session.execute(
-                select(Session).where(Session.code == int(session_code))
-            )
-            session_obj = session_obj.scalar_one_or_none()
+            params = {"session_code": int(session_code)}
+            session_obj = (await session.execute(SESSION_BY_CODE, params)).scalar_one_or_none()
             if not session_obj:
                 return False
 
-            participants_result = await session.execute(
-                select(Participant).where(Participant.session_id == session_obj.id)
-            )
-            total_participants = len(participants_result.scalars().all())
-            return total_participants
+            return (await session.execute(PARTICIPANT_COUNT_BY_CODE, params)).scalar()
 
     async def get_vote_results(self, session_code, question):
         async with self.session_factory() as session:
-            session_obj = await session.execute(
-                select(Session).where(Session.code == int(session_code))
-            )
-            session_obj = session_obj.scalar_one_or_none()
-            if not session_obj:
+            params = {"session_code": int(session_code), "question": question}
+            agenda_item_result = await session.execute(AGENDA_ITEM_BY_QUESTION, params)
+            if not agenda_item_result.scalar_one_or_none():
                 return {}
 
-            agenda_item_result = await session.execute(
-                select(AgendaItem).where(AgendaItem.session_id == session_obj.id, AgendaItem.description == question)
-            )
-            agenda_item = agenda_item_result.scalar_one_or_none()
-            if not agenda_item:
-                return {}
-
-            vote_result = await session.execute(
-                select(Vote).where(Vote.agenda_item_id == agenda_item.id)
-            )
-            votes = vote_result.scalars().all()
+            vote_result = await session.execute(VOTE_COUNTS_BY_QUESTION, params)
 
             vote_counts = {"За": 0, "Проти": 0, "Утримаюсь": 0}
-            for vote in votes:
-                if vote.vote in vote_counts:
-                    vote_counts[vote.vote] += 1
+            for vote, count in vote_result.all():
+                if vote in vote_counts:
+                    vote_counts[vote] = count
 
             return vote_counts
 
@@ -357,21 +588,93 @@ class Database:
                 name=user_name
             )
             session.add(new_participant)
+
+            user = await self._get_or_create_user(session, user_id)
+            user.session_count += 1
+            user.last_seen = func.now()
+            user.name = await self._most_common_name(session, user_id)
             await session.commit()
             logging.info(f"Користувач {user_id} доданий до сесії {session_code} як {user_name}.")
 
-    async def get_session_participants(self, session_code):
+    async def get_join_info(self, session_code, user_id):
+        """
+        Одним запитом: сесія, до якої ще можна приєднатися (id, name, password),
+        і ім'я, під яким користувач брав участь востаннє (last_name). None, якщо сесії немає.
+        """
         async with self.session_factory() as session:
-            result = await session.execute(
-                select(Participant.user_id).join(Session).where(Session.code == int(session_code))
+            result = await session.execute(JOIN_INFO_BY_CODE, {"session_code": int(session_code), "user_id": user_id})
+            return result.one_or_none()
+
+    async def join_session(self, session_id, user_id, user_name):
+        """
+        Додає учасника, якщо його ще немає в сесії (INSERT ... SELECT ... WHERE NOT EXISTS),
+        і оновлює довідник users. Повертає True, якщо учасника додано.
+        """
+        async with self.session_factory() as session:
+            already_joined = (
+                select(Participant.id)
+                .where(Participant.session_id == session_id, Participant.user_id == user_id)
+                .exists()
+            )
+            inserted = await session.execute(
+                insert(Participant).from_select(
+                    ["session_id", "user_id", "name"],
+                    select(Session.id, literal(user_id, BigInteger), literal(user_name, String))
+                    .where(Session.id == session_id, ~already_joined)
+                )
             )
-            return [row[0] for row in result.fetchall()]  # Повертаємо лише user_id
+            if inserted.rowcount:
+                updated = await session.execute(
+                    update(User)
+                    .where(User.id == user_id)
+                    .values(
+                        session_count=User.session_count + 1,
+                        last_seen=func.now(),
+                        name=MOST_COMMON_NAME_BY_USER,
+                    ),
+                    {"user_id": user_id},
+                )
+                if not updated.rowcount:
+                    session.add(User(id=user_id, name=user_name, session_count=1, admin_count=0))
+            await session.commit()
+            return bool(inserted.rowcount)
+
+    @staticmethod
+    async def _get_or_create_user(session, user_id):
+        """Повертає запис довідника users, створюючи його при першій появі користувача."""
+        user = await session.get(User, user_id)
+        if user is None:
+            user = User(id=user_id, session_count=0, admin_count=0)
+            session.add(user)
+        return user
+
+    @staticmethod
+    async def _most_common_name(session, user_id):
+        """Найчастіше ім'я користувача серед його участей (лише його рядки, не вся таблиця)."""
+        result = await session.execute(
+            select(Participant.name)
+            .where(Participant.user_id == user_id)
+            .group_by(Participant.name)
+            .order_by(func.count(Participant.name).desc())
+            .limit(1)
+        )
+        return result.scalar_one_or_none()
+
+    async def get_session_participants(self, session_code):
+        # Копія, бо список ділять між собою кілька апдейтів
+        return list(await self._batched("participants", session_code, self._load_participants))  # Повертаємо лише user_id
+
+    async def _load_participants(self, codes):
+        async with self.session_factory() as session:
+            result = await session.execute(PARTICIPANT_IDS_BY_CODES, {"codes": codes})
+            participants = {code: [] for code in codes}
+            for code, user_id in result.all():
+                participants[code].append(user_id)
+            return participants
 
     async def get_current_question_index(self, session_code):
         async with self.session_factory() as session:
-            result = await session.execute(
-                select(Session.current_question_index).where(Session.code == int(session_code))
-            )
+            result = await session.execute(QUESTION_INDEX_BY_CODE, {"session_code": int(session_code)})
             return result.scalar_one_or_none()
 
     async def set_current_question_index(self, session_code, question_index):
@@ -388,29 +691,29 @@ class Database:
         """
         Отримати ID адміністратора за кодом сесії.
         """
+        return await self._batched("admin_id", session_code, self._load_admin_ids)
+
+    async def _load_admin_ids(self, codes):
         async with self.session_factory() as session:
-            result = await session.execute(
-                select(Session.admin_id).where(Session.code == int(session_code))
-            )
-            return result.scalar_one_or_none()
+            result = await session.execute(ADMIN_IDS_BY_CODES, {"codes": codes})
+            return dict(result.all())
 
     async def has_user_voted(self, session_code, user_id, question):
         async with self.session_factory() as session:
             result = await session.execute(
-                select(Vote).where(
-                    Vote.agenda_item_id == select(AgendaItem.id)
-                    .where(
-                        AgendaItem.description == question,
-                        AgendaItem.session_id == select(Session.id)
-                        .where(Session.code == int(session_code))
-                        .scalar_subquery()
-                    )
-                    .scalar_subquery(),
-                    Vote.user_id == user_id
-                )
+                USER_VOTE_BY_QUESTION,
+                {"session_code": int(session_code), "question": question, "user_id": user_id}
             )
             return result.scalar_one_or_none() is not None
 
+    async def get_question_votes(self, session_code, question):
+        """Голоси за питання як пари (user_id, vote)."""
+        async with self.session_factory() as session:
+            result = await session.execute(
+                VOTES_BY_QUESTION, {"session_code": int(session_code), "question": question}
+            )
+            return result.all()
+
     async def remove_participant(self, session_code: int, user_id: int):
         async with self.session_factory() as session:
             session_result = await session.execute(
@@ -420,12 +723,17 @@ class Database:
             if not session_id:
                 raise Exception(f"Сесія з кодом {session_code} не знайдена.")
 
-            await session.execute(
+            deleted = await session.execute(
                 delete(Participant).where(
                     Participant.session_id == session_id,
                     Participant.user_id == user_id
                 )
             )
+
+            user = await session.get(User, user_id)
+            if user and deleted.rowcount:
+                user.session_count = max(0, user.session_count - deleted.rowcount)
+                user.name = await self._most_common_name(session, user_id) or user.name
             await session.commit()
 
     async def get_all_vote_results(self, session_code: int) -> dict:
@@ -525,10 +833,7 @@ class Database:
     async def set_agenda_item_proposer(self, session_code, question, proposer_name):
         async with self.session_factory() as session:
             result = await session.execute(
-                select(AgendaItem).where(AgendaItem.session_id == select(Session.id)
-                                         .where(Session.code == int(session_code))
-                                         .scalar_subquery(),
-                                         AgendaItem.description == question)
+                AGENDA_ITEM_BY_QUESTION, {"session_code": int(session_code), "question": question}
             )
             agenda_item = result.scalar_one_or_none()
 
@@ -602,13 +907,7 @@ class Database:
         """
         async with self.session_factory() as session:
             result = await session.execute(
-                select(AgendaItem.proposed)
-                .where(
-                    AgendaItem.session_id == select(Session.id)
-                    .where(Session.code == int(session_code))
-                    .scalar_subquery(),
-                    AgendaItem.description == question
-                )
+                PROPOSED_NAME_BY_QUESTION, {"session_code": int(session_code), "question": question}
             )
             return result.scalar_one_or_none()
 
@@ -647,7 +946,13 @@ class Database:
             session_obj = result.scalar_one_or_none()
 
             if session_obj:
+                # Учасники видаляються каскадом разом із сесією, тож і лічильники знімаємо тут
+                await self._release_participations(session, session_obj.id)
+                admin = await session.get(User, session_obj.admin_id)
+                if admin:
+                    admin.admin_count = max(0, admin.admin_count - 1)
                 await session.delete(session_obj)
+                await session.execute(delete(OpenSession).where(OpenSession.code == session_code))
                 await session.commit()
                 logging.info(f"Сесія {session_code} успішно видалена.")
 
@@ -744,36 +1049,11 @@ class Database:
     async def get_user_statistics(self, user_id: int):
         """Отримує статистику користувача, якщо він існує, з найчастішим іменем та топ-3 молодіжними радами."""
         async with self.session_factory() as session:
-            # Перевіряємо, чи користувач існує в БД
-            user_exists = await session.execute(
-                select(Participant.user_id).where(Participant.user_id == user_id)
-            )
-            if not user_exists.fetchone():
+            # Ім'я та лічильники беремо з довідника users (читання за первинним ключем)
+            user = await session.get(User, user_id)
+            if not user or not user.name:
                 return None  # Користувача немає в базі
 
-            # Отримуємо ім'я, яке найчастіше зустрічається у таблиці `participants`
-            most_common_name_query = await session.execute(
-                select(Participant.name, func.count(Participant.name))
-                .where(Participant.user_id == user_id)
-                .group_by(Participant.name)
-                .order_by(func.count(Participant.name).desc())  # Сортуємо за частотою
-                .limit(1)
-            )
-            most_common_name_result = most_common_name_query.fetchone()
-            user_name = most_common_name_result[0] if most_common_name_result else "Невідомий"
-
-            # Отримуємо кількість сесій, у яких користувач брав участь
-            participation_count_query = await session.execute(
-                select(func.count()).where(Participant.user_id == user_id)
-            )
-            participation_count = participation_count_query.scalar()
-
-            # Отримуємо кількість разів, коли користувач був адміном
-            admin_count_query = await session.execute(
-                select(func.count()).where(Session.admin_id == user_id)
-            )
-            admin_count = admin_count_query.scalar()
-
             # Отримуємо топ-3 молодіжні ради, в яких користувач найчастіше виступав
             youth_council_query = await session.execute(
                 select(YouthCouncilInfo.name, func.count(YouthCouncilInfo.name))
@@ -793,37 +1073,22 @@ class Database:
 
             return {
                 "user_id": user_id,
-                "name": user_name,
-                "participation_count": participation_count,
-                "admin_count": admin_count,
+                "name": user.name,
+                "participation_count": user.session_count,
+                "admin_count": user.admin_count,
                 "top_youth_councils": top_youth_councils
             }
 
     async def get_all_users(self, limit: int = 30):
-        """Отримує список всіх користувачів (обмежено 30), використовуючи найчастіше зустрічаючеся ім'я."""
+        """Отримує список користувачів (обмежено 30) з їхнім канонічним ім'ям з довідника users."""
         async with self.session_factory() as session:
-            # Отримуємо користувачів разом із найчастішим іменем
             result = await session.execute(
-                select(
-                    Participant.user_id,
-                    Participant.name,
-                    func.count(Participant.name)
-                )
-                .group_by(Participant.user_id, Participant.name)
-                .order_by(Participant.user_id, func.count(Participant.name).desc())
-                # Сортуємо по user_id і найбільшому count
+                select(User.id, User.name)
+                .where(User.name.is_not(None))
+                .order_by(User.id)
+                .limit(limit)
             )
-
-            # Обробляємо дані, щоб залишити лише найчастіше ім'я для кожного user_id
-            user_data = {}
-            for user_id, name, count in result.fetchall():
-                if user_id not in user_data:  # Додаємо перший запис, бо він уже відсортований по найбільшій кількості
-                    user_data[user_id] = name
-
-            # Конвертуємо в список (обмежуємо `limit`)
-            users_list = list(user_data.items())[:limit]
-
-            return users_list
+            return [(user_id, name) for user_id, name in result.fetchall()]
 
     ### --- FULL SESSION CLEANUP FUNCTION --- ###
     async def delete_related_data(self, session_code: int):
@@ -837,12 +1102,16 @@ class Database:
 
             if session_obj:
                 # Видаляємо всі пов'язані записи
+                await session.execute(delete(ProtocolDraft).where(ProtocolDraft.agenda_item_id.in_(
+                    select(AgendaItem.id).where(AgendaItem.session_id == session_obj.id)
+                )))
                 await session.execute(
                     delete(AgendaItem).where(AgendaItem.session_id == session_obj.id)
                 )
                 await session.execute(
                     delete(Vote).where(Vote.agenda_item_id == session_obj.id)
                 )
+                await self._release_participations(session, session_obj.id)
                 await session.execute(
                     delete(Participant).where(Participant.session_id == session_obj.id)
                 )
@@ -850,28 +1119,24 @@ class Database:
                 await session.commit()
                 logging.info(f"Всі пов'язані дані для сесії {session_code} видалені.")
 
+    @staticmethod
+    async def _release_participations(session, session_id):
+        """Знімає участі сесії з users.session_count перед видаленням її учасників, як remove_participant."""
+        result = await session.execute(
+            select(Participant.user_id, func.count())
+            .where(Participant.session_id == session_id)
+            .group_by(Participant.user_id)
+        )
+        for user_id, count in result.all():
+            user = await session.get(User, user_id)
+            if user:
+                user.session_count = max(0, user.session_count - count)
+
     async def get_admin_name(self, admin_id: int):
-        """Отримує ім'я адміна, яке найчастіше зустрічається серед учасників його сесій."""
+        """Отримує канонічне ім'я адміна з довідника users."""
         async with self.session_factory() as session:
-            # Перевіряємо, чи адмін є учасником хоча б однієї сесії
-            admin_exists = await session.execute(
-                select(Participant.user_id).where(Participant.user_id == admin_id).limit(1)
-                # Запобігає MultipleResultsFound
-            )
-            if not admin_exists.scalar_one_or_none():
-                return "Невідомий адмін"
-
-            # Отримуємо ім'я, яке найчастіше зустрічається у таблиці `participants`
-            most_common_name_query = await session.execute(
-                select(Participant.name, func.count(Participant.name))
-                .where(Participant.user_id == admin_id)
-                .group_by(Participant.name)
-                .order_by(func.count(Participant.name).desc())  # Сортуємо за частотою
-                .limit(1)
-            )
-            most_common_name_result = most_common_name_query.fetchone()
-
-            return most_common_name_result[0] if most_common_name_result else "Невідомий адмін"
+            user = await session.get(User, admin_id)
+            return user.name if user and user.name else "Невідомий адмін"
 
     async def get_questions_count(self, session_id: int):
         """Підраховує кількість питань у сесії"""
@@ -922,6 +1187,309 @@ class Database:
             session_obj.is_active = False
             await session.commit()
 
+    async def backfill_users(self):
+        """Одноразово заповнює довідник users з історії participants/sessions, якщо він ще порожній."""
+        async with self.session_factory() as session:
+            has_users = await session.execute(select(User.id).limit(1))
+            if has_users.first():
+                return
+
+            users = {}
+
+            # Рядки відсортовані за частотою, тож перше ім'я кожного user_id - найчастіше
+            names_result = await session.execute(
+                select(Participant.user_id, Participant.name, func.count(Participant.id))
+                .group_by(Participant.user_id, Participant.name)
+                .order_by(Participant.user_id, func.count(Participant.id).desc())
+            )
+            for user_id, name, count in names_result.fetchall():
+                if user_id not in users:
+                    users[user_id] = User(id=user_id, name=name, session_count=0, admin_count=0)
+                users[user_id].session_count += count
+
+            admins_result = await session.execute(
+                select(Session.admin_id, func.count(Session.id)).group_by(Session.admin_id)
+            )
+            for admin_id, count in admins_result.fetchall():
+                if admin_id not in users:
+                    users[admin_id] = User(id=admin_id, session_count=0, admin_count=0)
+                users[admin_id].admin_count = count
+
+            seen_result = await session.execute(
+                select(Participant.user_id, func.min(Session.date), func.max(Session.date))
+                .join(Session, Participant.session_id == Session.id)
+                .group_by(Participant.user_id)
+            )
+            for user_id, first_seen, last_seen in seen_result.fetchall():
+                if first_seen:
+                    users[user_id].first_seen = first_seen
+                    users[user_id].last_seen = last_seen
+
+            session.add_all(users.values())
+            await session.commit()
+            logging.info(f"Довідник users заповнено з історії: {len(users)} користувачів.")
+
+
+    ### --- PROTOCOL DRAFT FUNCTIONS --- ###
+    async def save_protocol_draft(self, session_code, question, wording, proposer_rv, tallies):
+        """Зберігає (або переписує) готову секцію протоколу для питання."""
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(AGENDA_ITEM_ID_BY_QUESTION), {"session_code": int(session_code), "question": question}
+            )
+            agenda_item_id = result.scalar_one_or_none()
+            if agenda_item_id is None:
+                return
+            await session.merge(ProtocolDraft(
+                agenda_item_id=agenda_item_id,
+                wording=wording,
+                proposer_rv=proposer_rv,
+                tallies=json.dumps(tallies),
+            ))
+            await session.commit()
+
+    async def get_protocol_drafts(self, session_code):
+        """Готові секції протоколу сесії: {питання: {"wording", "proposer_rv", "tallies"}}."""
+        async with self.session_factory() as session:
+            result = await session.execute(PROTOCOL_DRAFTS_BY_CODE, {"session_code": int(session_code)})
+            return {
+                description: {"wording": wording, "proposer_rv": proposer_rv, "tallies": json.loads(tallies)}
+                for description, wording, proposer_rv, tallies in result.all()
+            }
+
+    async def set_drafts_proposer_rv(self, session_code, name, name_rv):
+        """Оновлює родовий відмінок доповідача в уже готових секціях протоколу сесії."""
+        async with self.session_factory() as session:
+            await session.execute(
+                update(ProtocolDraft)
+                .where(ProtocolDraft.agenda_item_id.in_(
+                    select(AgendaItem.id).where(
+                        AgendaItem.session_id == SESSION_ID_BY_CODE, AgendaItem.proposed == name
+                    )
+                ))
+                .values(proposer_rv=name_rv),
+                {"session_code": int(session_code)},
+            )
+            await session.commit()
+
+    ### --- OUTBOX FUNCTIONS --- ###
+    async def add_outbox_messages(self, chat_ids, text, parse_mode=None, reply_markup=None):
+        """Записує одне повідомлення для кожного chat_id у чергу відправки."""
+        async with self.session_factory() as session:
+            session.add_all([
+                OutboxMessage(chat_id=chat_id, text=text, parse_mode=parse_mode, reply_markup=reply_markup)
+                for chat_id in chat_ids
+            ])
+            await session.commit()
+
+    async def claim_outbox(self, limit: int = 100, lease: float = 60.0):
+        """
+        Забирає на доставку найстаріші недоставлені повідомлення, яких не тримає інший процес.
+
+        Рядки позначаються токеном цього виклику на lease секунд (SKIP LOCKED там, де БД його
+        підтримує), тож кілька процесів з outbox не надішлють одне повідомлення двічі. Якщо процес
+        упав, не підтвердивши доставку, після lease рядок забере інший.
+
+        Повідомлення одного чату забираються лише суцільним префіксом від найстарішого
+        недоставленого: якщо раніший рядок чату тримає інший процес або він чекає повтору
+        після збою, пізніші не підуть раніше за нього.
+        """
+        token = uuid.uuid4().hex
+        # Колонки без часового поясу: зберігаємо UTC без tzinfo
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        free = or_(OutboxMessage.claimed_until.is_(None), OutboxMessage.claimed_until < now)
+        async with self.session_factory() as session:
+            ids = (await session.execute(
+                select(OutboxMessage.id)
+                .where(OutboxMessage.failed.is_(False), free)
+                .order_by(OutboxMessage.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )).scalars().all()
+            if not ids:
+                return []
+            ids = await self._outbox_chat_prefixes(session, ids)
+            if not ids:
+                await session.commit()
+                return []
+            # Умова повторюється в UPDATE: рядок, який уже забрав інший процес, не перепишеться
+            await session.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id.in_(ids), free)
+                .values(claimed_by=token, claimed_until=now + timedelta(seconds=lease))
+            )
+            result = await session.execute(
+                select(OutboxMessage).where(OutboxMessage.claimed_by == token).order_by(OutboxMessage.id)
+            )
+            messages = result.scalars().all()
+            await session.commit()
+            return messages
+
+    async def _outbox_chat_prefixes(self, session, ids):
+        """Лишає з ids лише рядки, перед якими в їхньому чаті немає недоставлених рядків поза ids."""
+        selected = set(ids)
+        rows = (await session.execute(
+            select(OutboxMessage.id, OutboxMessage.chat_id)
+            .where(
+                OutboxMessage.chat_id.in_(
+                    select(OutboxMessage.chat_id).where(OutboxMessage.id.in_(ids)).scalar_subquery()
+                ),
+                OutboxMessage.failed.is_(False),
+                OutboxMessage.id <= max(ids),
+            )
+            .order_by(OutboxMessage.id)
+        )).all()
+        blocked, prefix = set(), []
+        for message_id, chat_id in rows:
+            if chat_id in blocked:
+                continue
+            if message_id in selected:
+                prefix.append(message_id)
+            else:
+                blocked.add(chat_id)
+        return prefix
+
+    async def ack_outbox(self, delivered_ids, failed_ids, max_attempts: int = 5, released_ids=()):
+        """
+        Видаляє доставлені повідомлення; недоставленим додає спробу, після max_attempts - позначає failed.
+        released_ids (не надсилались, бо раніше в чаті був збій) просто повертаються в чергу.
+        """
+        async with self.session_factory() as session:
+            if delivered_ids:
+                await session.execute(delete(OutboxMessage).where(OutboxMessage.id.in_(delivered_ids)))
+            if released_ids:
+                await session.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id.in_(released_ids))
+                    .values(claimed_by=None, claimed_until=None)
+                )
+            if failed_ids:
+                await session.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id.in_(failed_ids))
+                    .values(
+                        attempts=OutboxMessage.attempts + 1,
+                        failed=OutboxMessage.attempts + 1 >= max_attempts,
+                        claimed_by=None,
+                        claimed_until=None,
+                    )
+                )
+            await session.commit()
+
+    async def purge_outbox(self, retention: float) -> int:
+        """Видаляє повідомлення, позначені failed, старші за retention секунд. Повертає кількість."""
+        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=retention)
+        async with self.session_factory() as session:
+            result = await session.execute(
+                delete(OutboxMessage).where(OutboxMessage.failed.is_(True), OutboxMessage.created_at < cutoff)
+            )
+            await session.commit()
+            return result.rowcount
+
+    ### --- OPEN SESSIONS FUNCTIONS --- ###
+    async def get_open_session_codes(self):
+        """Коди всіх незавершених сесій."""
+        async with self.session_factory() as session:
+            result = await session.execute(select(OpenSession.code))
+            return [code for (code,) in result.fetchall()]
+
+    async def is_session_open(self, session_code):
+        async with self.session_factory() as session:
+            result = await session.execute(select(OpenSession.code).where(OpenSession.code == int(session_code)))
+            return result.first() is not None
+
+    async def seed_open_sessions(self):
+        """
+        Додає в open_sessions незавершені сесії, яких там немає: ті, що ще приймають учасників (is_active),
+        і ті, що голосують — is_active знято на старті голосування, але адмін досі у стані FSM цієї
+        сесії (завершення сесії його очищає).
+        """
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(Session.code, Session.is_active, Session.admin_id)
+                .where(Session.code.not_in(select(OpenSession.code)))
+            )
+            rows = result.all()
+            codes = [code for code, is_active, _ in rows if is_active]
+            voting = await self._voting_session_codes(
+                session, {code: admin_id for code, is_active, admin_id in rows if not is_active}
+            )
+            codes += sorted(voting)
+            if codes:
+                session.add_all(OpenSession(code=code) for code in codes)
+                await session.commit()
+                logging.info(
+                    f"open_sessions доповнено {len(codes) - len(voting)} активними сесіями "
+                    f"і {len(voting)} сесіями, що голосують."
+                )
+
+    @staticmethod
+    async def _voting_session_codes(session, admins):
+        """Коди сесій, чий адмін має непорожній стан FSM з їхнім session_code. admins — {код: admin_id}."""
+        if not admins:
+            return set()
+        result = await session.execute(
+            select(FsmRecord.key, FsmRecord.data).where(FsmRecord.state.is_not(None))
+        )
+        codes = set()
+        for key, data in result.all():
+            try:
+                code = int(json.loads(data).get("session_code"))
+                user_id = int(key.split(":")[-2])  # fsm:<bot>:<chat>:<user>:<destiny>
+            except (TypeError, ValueError, AttributeError):
+                continue
+            if admins.get(code) == user_id:
+                codes.add(code)
+        return codes
+
+    async def get_session_bindings(self):
+        """Пари (код сесії, chat id) адміністраторів і учасників незавершених сесій, від давніших сесій до новіших."""
+        async with self.session_factory() as session:
+            admins = await session.execute(
+                select(Session.id, Session.code, Session.admin_id)
+                .join(OpenSession, OpenSession.code == Session.code)
+            )
+            participants = await session.execute(
+                select(Session.id, Session.code, Participant.user_id)
+                .join(Participant, Participant.session_id == Session.id)
+                .join(OpenSession, OpenSession.code == Session.code)
+            )
+            rows = sorted(admins.all() + participants.all(), key=lambda row: row[0])
+        return [(code, chat_id) for _, code, chat_id in rows]
+
+    ### --- FSM FUNCTIONS --- ###
+    async def get_fsm_record(self, key):
+        """Повертає (state, data JSON, version) ключа FSM або None."""
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(FsmRecord.state, FsmRecord.data, FsmRecord.version).where(FsmRecord.key == key)
+            )
+            return result.one_or_none()
+
+    async def save_fsm_record(self, key, state, data, expected_version):
+        """
+        Записує стан FSM, лише якщо в БД досі expected_version (0 — ключа ще немає).
+        Повертає False, якщо інший процес устиг записати раніше.
+        """
+        async with self.session_factory() as session:
+            if expected_version == 0:
+                # Точка збереження: конфлікт вставки не має відкотити решту транзакції апдейту
+                try:
+                    async with session.begin_nested():
+                        session.add(FsmRecord(key=key, state=state, data=data, version=1))
+                except IntegrityError:
+                    return False
+                await session.commit()
+                return True
+
+            result = await session.execute(
+                update(FsmRecord)
+                .where(FsmRecord.key == key, FsmRecord.version == expected_version)
+                .values(state=state, data=data, version=expected_version + 1)
+            )
+            await session.commit()
+            return result.rowcount == 1
+
 
 class DatabaseMiddleware(BaseMiddleware):
     def __init__(self, db: Database):
@@ -929,5 +1497,11 @@ class DatabaseMiddleware(BaseMiddleware):
         self.db = db
 
     async def __call__(self, handler: Callable, event: Any, data: Dict[str, Any]) -> Any:
-        data['db'] = self.db
-        return await handler(event, data)
+        async with self.db.unit_of_work() as db:
+            data['db'] = db
+            # Стан FSM, записаний хендлером, потрапляє в ту саму транзакцію
+            token = update_db.set(db)
+            try:
+                return await handler(event, data)
+            finally:
+                update_db.reset(token)
@@ -0,0 +1,338 @@
+"""Спільне сховище станів FSM: переживає рестарт і доступне кільком процесам бота.
+
+Бекенди зберігають для кожного ключа (state, data, version). Запис проходить лише тоді,
+коли в сховищі досі та версія, яку процес бачив; інакше запис перечитується й повторюється.
+Гарячі ключі кешуються в процесі, тож звичайний апдейт читає стан без звернення до БД.
+Кеш вмикається лише там, де апдейти одного чату завжди обробляє той самий процес (FSM_CACHE_TTL).
+
+FSM_STORAGE=sql пише стан через з'єднання транзакції апдейту: окреме з'єднання на кожен запис
+не потрібне, а відкочений апдейт відкочує й свій стан.
+
+FSM_STORAGE=memory тримає стани лише в пам'яті процесу, але з межами: неактивні записи
+прибираються через FSM_IDLE_TTL, а понад FSM_MEMORY_LIMIT_MB витісняються найдавніші.
+Записи учасників сесії, що саме голосує, не витісняються.
+"""
+
+import json
+import logging
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
+
+from bot.common.live_voting import live_voting
+
+CACHE_TTL = 30.0  # Скільки секунд кешований стан вважається свіжим без перечитування
+MAX_RETRIES = 5
+SWEEP_INTERVAL = 60.0
+IDLE_TTL = 24 * 3600.0  # Запис FSM у пам'яті, якого не торкались добу, прибирається
+MEMORY_LIMIT = 32 * 1024 * 1024
+REPORT_INTERVAL = 3600.0
+
+# Копія Database транзакції поточного апдейту; її ставить DatabaseMiddleware
+update_db = ContextVar("update_db", default=None)
+
+# Lua-скрипт виконується в Redis атомарно: перевірка версії та запис — одна операція
+REDIS_CAS = """
+local current = redis.call('HGET', KEYS[1], 'version') or '0'
+if current ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'state', ARGV[2], 'data', ARGV[3], 'version', ARGV[4])
+return 1
+"""
+
+
+class SqlFsmBackend:
+    """
+    Стани FSM у таблиці fsm_states основної БД. Усередині апдейту читає й пише через його
+    транзакцію, поза ним (зовнішні middleware aiogram) — через основний Database процесу.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def _db(self):
+        return update_db.get() or self.db
+
+    async def read(self, key):
+        record = await self._db().get_fsm_record(key)
+        if record is None:
+            return None, "{}", 0
+        return record.state, record.data, record.version
+
+    async def write(self, key, state, data, expected_version):
+        return await self._db().save_fsm_record(key, state, data, expected_version)
+
+    def after_write(self, committed, rolled_back):
+        # Запис стане видно іншим апдейтам лише після коміту транзакції
+        db = self._db()
+        db.after_commit(committed)
+        db.after_rollback(rolled_back)
+
+    async def close(self):
+        pass
+
+
+class RedisFsmBackend:
+    """Стани FSM у Redis (або сумісному сервері) — хеш на ключ з полями state, data, version."""
+
+    def __init__(self, url):
+        try:
+            from redis.asyncio import Redis
+        except ImportError as e:
+            raise RuntimeError("FSM_STORAGE=redis потребує пакета redis: pip install redis") from e
+        self.redis = Redis.from_url(url, decode_responses=True)
+        self._cas = self.redis.register_script(REDIS_CAS)
+
+    async def read(self, key):
+        record = await self.redis.hgetall(key)
+        if not record:
+            return None, "{}", 0
+        return record.get("state") or None, record.get("data", "{}"), int(record.get("version", 0))
+
+    async def write(self, key, state, data, expected_version):
+        written = await self._cas(keys=[key], args=[expected_version, state or "", data, expected_version + 1])
+        return bool(written)
+
+    def after_write(self, committed, rolled_back):
+        committed()
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+class _Entry:
+    __slots__ = ("state", "data", "version", "loaded_at")
+
+    def __init__(self, state, data, version):
+        self.state = state
+        self.data = data
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+
+class VersionedStorage(BaseStorage):
+    """
+    Сховище aiogram поверх бекенда з версіями.
+
+    Кеш у процесі точний, поки апдейти одного чату обробляє один процес; якщо ключ змінив
+    інший процес, застарілий кеш виявиться на записі (версія не збіжеться) і буде перечитаний.
+    Читання ж застарілого кешу нічим не перевіряється, тому без такої гарантії cache_ttl=0.
+    """
+
+    def __init__(self, backend, cache_ttl=CACHE_TTL):
+        self.backend = backend
+        self.cache_ttl = cache_ttl
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache = {}
+        self._uncommitted = set()  # Ключі, записані транзакцією, що ще не зафіксована
+        self._last_sweep = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+
+    def _sweep(self):
+        # Протерміновані записи кешу все одно перечитуються, тож тримати їх немає сенсу
+        now = time.monotonic()
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        stale = [key for key, entry in self._cache.items() if now - entry.loaded_at >= self.cache_ttl]
+        for key in stale:
+            del self._cache[key]
+
+    async def _load(self, key, fresh=False):
+        self._sweep()
+        entry = self._cache.get(key)
+        if entry is not None and not fresh and time.monotonic() - entry.loaded_at < self.cache_ttl:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        state, data, version = await self.backend.read(key)
+        entry = _Entry(state, json.loads(data), version)
+        if key not in self._uncommitted:
+            self._cache[key] = entry
+        return entry
+
+    def _committed(self, key, entry):
+        self._uncommitted.discard(key)
+        self._cache[key] = entry
+
+    async def _write(self, storage_key, change):
+        """Застосовує change(state, data) -> (state, data) до актуальної версії ключа."""
+        key = self.key_builder.build(storage_key)
+        entry = await self._load(key)
+        for _ in range(MAX_RETRIES):
+            new_state, new_data = change(entry.state, entry.data)
+            if new_state == entry.state and new_data == entry.data:
+                return new_data
+            if await self.backend.write(key, new_state, json.dumps(new_data, ensure_ascii=False), entry.version):
+                # До коміту ключ читається з бекенда, тож відкочений апдейт не лишить у кеші свій стан
+                self._cache.pop(key, None)
+                self._uncommitted.add(key)
+                written = _Entry(new_state, new_data, entry.version + 1)
+                self.backend.after_write(lambda: self._committed(key, written), lambda: self._uncommitted.discard(key))
+                return new_data
+            # Ключ змінив інший процес — перечитуємо й накладаємо зміну на свіжу версію
+            self.conflicts += 1
+            entry = await self._load(key, fresh=True)
+        raise RuntimeError(f"Не вдалося записати стан FSM {key}: постійні конфлікти версій")
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await self._write(key, lambda _, data: (state, data))
+
+    async def get_state(self, key: StorageKey):
+        return (await self._load(self.key_builder.build(key))).state
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        data = dict(data)
+        await self._write(key, lambda state, _: (state, data))
+
+    async def get_data(self, key: StorageKey):
+        return dict((await self._load(self.key_builder.build(key))).data)
+
+    async def update_data(self, key: StorageKey, data):
+        # Зливаємо з актуальною версією, а не з прочитаною раніше копією, щоб не затерти чужі зміни
+        new_data = await self._write(key, lambda state, current: (state, {**current, **data}))
+        return dict(new_data)
+
+    def report(self):
+        total = self.hits + self.misses
+        if total:
+            logging.info(
+                f"FSM: {self.hits}/{total} читань з кешу ({self.hits / total:.0%}), "
+                f"конфліктів версій при записі: {self.conflicts}"
+            )
+
+    async def close(self) -> None:
+        self.report()
+        await self.backend.close()
+
+
+class _MemoryEntry:
+    __slots__ = ("state", "data", "size", "touched")
+
+    def __init__(self):
+        self.state = None
+        self.data = {}
+        self.size = 0
+        self.touched = time.monotonic()
+
+
+class BoundedMemoryStorage(BaseStorage):
+    """
+    Сховище FSM у пам'яті процесу з прибиранням: запис, якого не торкались idle_ttl секунд,
+    видаляється, а коли дані всіх записів перевищують memory_limit байтів, витісняються
+    найдавніше використані (LRU). Записи з session_code сесії, що зараз голосує, не чіпаються.
+
+    Розмір запису — довжина його даних у JSON, тобто оцінка, а не точний розмір об'єктів Python.
+    """
+
+    def __init__(self, idle_ttl=IDLE_TTL, memory_limit=MEMORY_LIMIT):
+        self.idle_ttl = idle_ttl
+        self.memory_limit = memory_limit
+        self._entries = OrderedDict()  # StorageKey -> _MemoryEntry, від найдавніше використаного
+        self._last_sweep = self._last_report = time.monotonic()
+        self.bytes = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.touched = time.monotonic()
+            self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, state, data):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _MemoryEntry()
+        self._entries.move_to_end(key)
+        entry.touched = time.monotonic()
+        entry.state = state
+        entry.data = data
+        size = len(json.dumps(data, ensure_ascii=False, default=str)) + len(state or "")
+        self.bytes += size - entry.size
+        entry.size = size
+        if state is None and not data:
+            # Порожній запис нічого не зберігає — не тримаємо під нього місце
+            self._drop(key)
+        self._evict()
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+
+    @staticmethod
+    def _protected(entry):
+        session_code = entry.data.get("session_code")
+        return session_code is not None and live_voting.get(session_code) is not None
+
+    def _evict(self):
+        now = time.monotonic()
+        if now - self._last_sweep >= SWEEP_INTERVAL:
+            self._last_sweep = now
+            idle = [
+                key for key, entry in self._entries.items()
+                if now - entry.touched >= self.idle_ttl and not self._protected(entry)
+            ]
+            for key in idle:
+                self._drop(key)
+            self.expired += len(idle)
+            if now - self._last_report >= REPORT_INTERVAL:
+                self._last_report = now
+                self.report()
+
+        if self.bytes <= self.memory_limit:
+            return
+        for key in list(self._entries):
+            if self.bytes <= self.memory_limit:
+                break
+            if not self._protected(self._entries[key]):
+                self._drop(key)
+                self.evicted += 1
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        state = state.state if isinstance(state, State) else state
+        entry = self._get(key)
+        self._put(key, state, entry.data if entry else {})
+
+    async def get_state(self, key: StorageKey):
+        entry = self._get(key)
+        return entry.state if entry else None
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        entry = self._get(key)
+        self._put(key, entry.state if entry else None, dict(data))
+
+    async def get_data(self, key: StorageKey):
+        entry = self._get(key)
+        return dict(entry.data) if entry else {}
+
+    def stats(self):
+        """Кількість записів і оцінка їхнього розміру в байтах."""
+        return len(self._entries), self.bytes
+
+    def report(self):
+        entries, size = self.stats()
+        logging.info(
+            f"FSM у пам'яті: {entries} записів, {size / 1024:.1f} КБ, "
+            f"прибрано неактивних {self.expired}, витіснено за лімітом {self.evicted}"
+        )
+
+    async def close(self) -> None:
+        self.report()
+
+
+def create_storage(kind, db, redis_url=None, idle_ttl=IDLE_TTL, memory_limit=MEMORY_LIMIT, cache_ttl=CACHE_TTL):
+    """Сховище FSM за FSM_STORAGE: sql (за замовчуванням), redis або memory."""
+    if kind == "memory":
+        return BoundedMemoryStorage(idle_ttl, memory_limit)
+    if kind == "redis":
+        return VersionedStorage(RedisFsmBackend(redis_url), cache_ttl)
+    return VersionedStorage(SqlFsmBackend(db), cache_ttl)
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import weakref
+
+
+class BatchLoader:
+    """
+    Single-flight та батчинг для одного типу запиту (у стилі DataLoader).
+
+    Однакові ключі, що вже завантажуються, отримують той самий future. Різні ключі,
+    запитані в межах одного проходу подієвого циклу, збираються в один виклик batch_fn.
+    Результати не кешуються: після відповіді наступний запит знову йде в БД.
+    """
+
+    def __init__(self, batch_fn):
+        # batch_fn(keys) -> {key: value}; відсутні ключі отримують None
+        self._batch_fn = batch_fn
+        self._pending = {}
+        self._inflight = {}
+        self._tasks = set()  # Запущені батчі, щоб задачі не зібрав GC посеред запиту
+        self.requests = 0
+        self.coalesced = 0
+        self.batches = 0
+
+    async def load(self, key):
+        self.requests += 1
+        future = self._inflight.get(key) or self._pending.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            if not self._pending:
+                loop.call_soon(self._dispatch)
+            self._pending[key] = future
+        # shield: скасування одного з очікувачів не скасовує спільний запит
+        return await asyncio.shield(future)
+
+    def _dispatch(self):
+        batch, self._pending = self._pending, {}
+        self._inflight.update(batch)
+        self.batches += 1
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            results = await self._batch_fn(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for key, future in batch.items():
+                if not future.done():
+                    future.set_result(results.get(key))
+        finally:
+            for key in batch:
+                self._inflight.pop(key, None)
+
+
+class LoaderRegistry:
+    """Набір BatchLoader-ів, окремий для кожного подієвого циклу (future прив'язані до циклу)."""
+
+    def __init__(self, **batch_fns):
+        self._batch_fns = batch_fns
+        self._by_loop = weakref.WeakKeyDictionary()
+
+    def get(self, name) -> BatchLoader:
+        loop = asyncio.get_running_loop()
+        loaders = self._by_loop.get(loop)
+        if loaders is None:
+            loaders = {loader_name: BatchLoader(fn) for loader_name, fn in self._batch_fns.items()}
+            self._by_loop[loop] = loaders
+        return loaders[name]
+
+    def report(self):
+        for loaders in self._by_loop.values():
+            for name, loader in loaders.items():
+                logging.info(
+                    f"Loader {name}: запитів {loader.requests}, спільних {loader.coalesced}, "
+                    f"SQL-батчів {loader.batches}"
+                )
@@ -0,0 +1,68 @@
+"""Перевірка сплеску апдейтів, більшого за пул з'єднань.
+
+Кожен «апдейт» — окрема транзакція unit_of_work, що читає адміна, порядок денний і учасників
+через loaders, тобто батчем на окремому з'єднанні, поки транзакція тримає своє. Без обмеження
+одночасних транзакцій такий сплеск вичерпує пул і всі апдейти падають з TimeoutError.
+Завершується з кодом 1, якщо хоч один апдейт не пройшов.
+
+Без --url працює на тимчасовій SQLite і потребує aiosqlite (pip install -r requirements-dev.txt).
+
+    python -m bot.database.pool_burst --updates 40 --pool-size 3 --max-overflow 0
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from bot.database.database_postgres import Base, Database
+
+SESSION_CODE = 4821
+
+
+async def update(db, user_id):
+    async with db.unit_of_work() as scoped:
+        await scoped.get_admin_id(SESSION_CODE)
+        await scoped.get_session_agenda(SESSION_CODE)
+        await scoped.get_session_participants(SESSION_CODE)
+        await scoped.has_user_voted(SESSION_CODE, user_id, "Бюджет")
+
+
+async def burst(url, updates, pool_size, max_overflow, pool_timeout):
+    engine = create_async_engine(url, pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout)
+    db = Database(async_sessionmaker(engine, expire_on_commit=False), max_connections=pool_size + max_overflow)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    await db.add_session(SESSION_CODE, "Засідання", "rada", admin_id=1)
+    await db.set_session_agenda(SESSION_CODE, ["Звіт голови", "Бюджет"])
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(update(db, user_id) for user_id in range(updates)), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    await engine.dispose()
+    failed = [result for result in results if isinstance(result, BaseException)]
+    print(
+        f"{updates} одночасних апдейтів на пулі {pool_size}+{max_overflow}: "
+        f"успішних {updates - len(failed)}, помилок {len(failed)}, за {elapsed:.2f} с"
+    )
+    for error in failed[:3]:
+        print(f"  {type(error).__name__}: {error}")
+    return not failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сплеск апдейтів, більший за пул з'єднань")
+    parser.add_argument("--updates", type=int, default=40)
+    parser.add_argument("--pool-size", type=int, default=3)
+    parser.add_argument("--max-overflow", type=int, default=0)
+    parser.add_argument("--pool-timeout", type=float, default=5.0)
+    parser.add_argument("--url", help="URL тестової БД; таблиці в ній перестворюються")
+    args = parser.parse_args()
+    url = args.url or f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'pool_burst.db')}"
+    ok = asyncio.run(burst(url, args.updates, args.pool_size, args.max_overflow, args.pool_timeout))
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,50 @@
+import logging
+
+from sqlalchemy import event
+from sqlalchemy.engine.default import DefaultDialect
+
+
+class QueryCacheStats:
+    """
+    Рахує влучання в кеш скомпільованих запитів SQLAlchemy для одного рушія.
+
+    Влучання - запит узято готовим, промах - його довелося компілювати заново.
+    Решта (DDL, text()) взагалі не кешується і рахується окремо.
+    """
+
+    def __init__(self, report_every: int = 1000):
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+        self.report_every = report_every
+
+    def attach(self, engine):
+        event.listen(engine.sync_engine, "after_cursor_execute", self._on_execute)
+        return self
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        cache_hit = getattr(context, "cache_hit", None)
+        if cache_hit is DefaultDialect.CACHE_HIT:
+            self.hits += 1
+        elif cache_hit is DefaultDialect.CACHE_MISS:
+            self.misses += 1
+        else:
+            self.uncached += 1
+
+        if self.report_every and self.total % self.report_every == 0:
+            self.report()
+
+    @property
+    def total(self):
+        return self.hits + self.misses + self.uncached
+
+    @property
+    def hit_rate(self):
+        cached = self.hits + self.misses
+        return self.hits / cached if cached else 0.0
+
+    def report(self):
+        logging.info(
+            f"Кеш SQL-запитів: влучань {self.hits}, промахів {self.misses}, "
+            f"без кешу {self.uncached}, hit rate {self.hit_rate:.1%}"
+        )
@@ -0,0 +1,15 @@
+from typing import Any
+
+from aiogram.filters import BaseFilter
+
+from bot.common.active_sessions import active_sessions
+
+
+class SessionFilter(BaseFilter):
+    """
+    Пропускає апдейт, лише якщо SessionMiddleware визначив для нього незавершену сесію.
+    Перевірка йде по бітмапі в пам'яті, тож фільтр не звертається до БД.
+    """
+
+    async def __call__(self, event: Any, session_code: int = None) -> bool:
+        return session_code is not None and session_code in active_sessions
@@ -3,14 +3,31 @@ import os
 import re
 from random import randint
 
-from aiogram import F, Router, types
-from aiogram.filters import Command, StateFilter
+from aiogram import F, types
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import FSInputFile
+from aiogram.utils.deep_linking import create_start_link
 
+from bot.common.active_sessions import active_sessions
+from bot.common.affinity import affinity
 from bot.common.ai import client, generate_post
-from bot.common.utils import generate_attendance_list_full, generate_protocol
+from bot.common.join_links import make_join_token
+from bot.common.live_voting import live_voting
+from bot.common.outbox import outbox
+from bot.common.session_documents import session_documents
+from bot.common.text_index import IndexedRouter
+from bot.common.utils import (
+    collect_session_snapshot,
+    draft_protocol_section,
+    generate_attendance_list_full,
+    generate_protocol,
+)
+from bot.common.vote_progress import vote_progress
+from bot.common.vote_reminders import vote_reminders
+from bot.filters.session_filter import SessionFilter
+from bot.handlers.participant import close_voting_item, end_session_in_memory, join_by_link
 from bot.keyboards.admin import (
     admin_end_vote_kb,
     admin_fea_kb,
@@ -22,7 +39,7 @@ from bot.keyboards.admin import (
     set_session_type_kb,
     yes_no_kb,
 )
-from bot.keyboards.common import common_kb, vote_kb
+from bot.keyboards.common import common_kb, vote_inline_kb
 from config import ALLOWED_ADMINS, OPTION
 
 if str(OPTION) == 'MySQL':
@@ -31,7 +48,7 @@ else:
     from bot.database.database_postgres import Database
 
 
-admin_router = Router()
+admin_router = IndexedRouter()
 
 
 class AdminStates(StatesGroup):
@@ -53,9 +70,13 @@ class AdminState(StatesGroup):
 
 
 @admin_router.message(Command("start"))
-async def start_command(message: types.Message, state: FSMContext):
+async def start_command(message: types.Message, state: FSMContext, command: CommandObject, db: Database):
     logging.info("Хендлер /start викликано")
     await state.clear()
+    if command.args:
+        # Посилання приєднання до сесії: t.me/<bot>?start=<token>
+        await join_by_link(message, state, db, command.args)
+        return
     await message.answer(
         "Вітаю! Ось список доступних дій:",
         reply_markup=common_kb()
@@ -119,13 +140,17 @@ async def set_session_password(message: types.Message, state: FSMContext, db: Da
         session_password=session_password,
         admin_id=message.from_user.id
     )
+    db.after_commit(lambda: active_sessions.open(session_code))
 
     # Оновлюємо session_code у стані
     await state.update_data(session_code=session_code)
+    affinity.bind(session_code, message.chat.id)  # Далі апдейти адміна йдуть на воркер сесії
 
     logging.info(f"Сесія створена: {session_data['session_name']} з кодом {session_code}")
+    join_link = await create_start_link(message.bot, make_join_token(session_code, session_password))
     await message.answer(
-        f"Сесія створена! \nКод сесії: <code>{session_code}</code>\nПароль: <code>{session_password}</code>",
+        f"Сесія створена! \nКод сесії: <code>{session_code}</code>\nПароль: <code>{session_password}</code>\n\n"
+        f"Посилання для приєднання одним натисканням (його ж можна вставити в QR-код):\n<code>{join_link}</code>",
         parse_mode="HTML"
     )
     await message.answer("Введіть ваше ім'я для участі в сесії:")
@@ -225,7 +250,7 @@ async def set_agenda(message: types.Message, state: FSMContext, db: Database):
     )
     logging.info(f"Порядок денний збережено для сесії {session_name}")
     await state.clear()
-    await state.update_data(session_code=session_code, session_name=session_name, agenda=agenda)
+    await state.update_data(session_code=session_code, session_name=session_name)
 
 
 @admin_router.message(F.text == "⚙️ Налаштувати інформацію про МР")
@@ -269,7 +294,7 @@ async def cancel_youth_council_update(message: types.Message, state: FSMContext,
     if len(agenda) > current_question_index + 1:
         await message.answer("Налаштування інформації про МР скасовано.", reply_markup=session_control_kb())
         await state.clear()
-        await state.update_data(session_code=session_code, session_name=session_name, agenda=agenda, current_question_index=current_question_index)
+        await state.update_data(session_code=session_code, session_name=session_name)
         return
 
     await message.answer(
@@ -278,7 +303,7 @@ async def cancel_youth_council_update(message: types.Message, state: FSMContext,
     )
     await state.clear()
     await state.set_state("admin_control")
-    await state.update_data(session_code=session_code, session_name=session_name, agenda=agenda, current_question_index=current_question_index)
+    await state.update_data(session_code=session_code, session_name=session_name)
     return
 
 
@@ -333,7 +358,7 @@ async def set_youth_council_secretary(message: types.Message, state: FSMContext,
     if len(agenda) > current_question_index + 1:
         await message.answer("Інформація про МР збережена!", reply_markup=session_control_kb())
         await state.clear()
-        await state.update_data(session_code=session_code, session_name=session_name, agenda=agenda, current_question_index=current_question_index)
+        await state.update_data(session_code=session_code, session_name=session_name)
         return
 
 
@@ -343,7 +368,7 @@ async def set_youth_council_secretary(message: types.Message, state: FSMContext,
     )
     await state.clear()
     await state.set_state("admin_control")
-    await state.update_data(session_code=session_code, session_name=session_name, agenda=agenda, current_question_index=current_question_index)
+    await state.update_data(session_code=session_code, session_name=session_name)
     return
 
 
@@ -379,9 +404,6 @@ async def start_voting(message: types.Message, state: FSMContext, db: Database):
         await message.answer("Порядок денний порожній.")
         return
 
-    # Зберігаємо питання у стані
-    await state.update_data(agenda=agenda, current_question_index=0)
-
     # Починаємо голосування за перше питання
     current_question = agenda[0]
 
@@ -389,18 +411,24 @@ async def start_voting(message: types.Message, state: FSMContext, db: Database):
 
     # Надсилаємо питання всім учасникам сесії
     participants = await db.get_session_participants(session_code)
-    for participant_id in participants:
-        # Відправляємо голосування учасникам
-        await message.bot.send_message(
-            chat_id=participant_id,
-            text=f"📋 Перше питання для голосування:\n<b>{current_question}</b>\n\nОберіть один із варіантів: 'За', 'Проти', 'Утримався'",
-            parse_mode="HTML",
-            reply_markup=vote_kb()
-        )
+    item_ids = await db.get_agenda_item_ids(session_code)
+    # Ростер фіксується на старті голосування; у пам'ять — лише після коміту close_session
+    db.after_commit(lambda: live_voting.start(session_code, agenda, participants, item_ids))
+    affinity.bind(session_code, message.chat.id, *participants)
+    keyboard = vote_inline_kb(session_code, item_ids[0])  # Один раз на всю розсилку
+    await outbox.enqueue(
+        db,
+        participants,
+        text=f"📋 Перше питання для голосування:\n<b>{current_question}</b>\n\nОберіть один із варіантів: 'За', 'Проти', 'Утримався'",
+        parse_mode="HTML",
+        reply_markup=keyboard,
+    )
+    await vote_progress.open(message.bot, message.from_user.id, session_code, 1, current_question, len(participants))
+    db.after_commit(lambda: vote_reminders.schedule(session_code, item_ids[0]))
     await state.set_state("voting")
 
 
-@admin_router.message(StateFilter("voting"), F.text.in_({"За", "Проти", "Утримаюсь"}))
+@admin_router.message(StateFilter("voting"), F.text.in_({"За", "Проти", "Утримаюсь"}), SessionFilter())
 async def collect_votes(message: types.Message, state: FSMContext, db: Database):
     print('collect_votes')
     session_data = await state.get_data()
@@ -412,22 +440,25 @@ async def collect_votes(message: types.Message, state: FSMContext, db: Database)
         await message.answer("Помилка: Сесія не знайдена.")
         return
 
-    # Отримуємо поточне питання та порядок денний із бази даних
-    current_question_index = await db.get_current_question_index(session_code)
-    agenda = await db.get_session_agenda(session_code)
-
-    if current_question_index is None or not agenda or current_question_index >= len(agenda):
+    # Поточне питання, ростер і бюлетені тримає рушій голосування (після перезапуску відновлює з БД)
+    live = await live_voting.ensure(db, session_code)
+    if live is None or live.current_question is None:
         await message.answer("Помилка: Питання не знайдені.")
         return
 
-    current_question = agenda[current_question_index]
+    current_question_index = live.current_index
+    current_question = live.current_question
+
+    if live.slot(message.from_user.id) is None:
+        await message.answer("Ви не є учасником цього голосування.", reply_markup=types.ReplyKeyboardRemove())
+        return
+
+    if live.current.closed:
+        await message.answer("Голосування за це питання вже завершено.", reply_markup=types.ReplyKeyboardRemove())
+        return
 
     # Перевіряємо, чи користувач уже голосував за це питання
-    user_voted = await db.has_user_voted(
-        session_code=session_code,
-        user_id=message.from_user.id,
-        question=current_question
-    )
+    user_voted = live.has_voted(message.from_user.id)
 
     admin_id = await db.get_admin_id(session_code)
 
@@ -440,6 +471,8 @@ async def collect_votes(message: types.Message, state: FSMContext, db: Database)
         await message.answer("Ви вже проголосували за це питання. Дочекайтеся завершення голосування.", reply_markup=types.ReplyKeyboardRemove())
         return
 
+    ledger = live.current
+    completes = False
     if not force_close and not user_voted:
     # Зберігаємо голос
         await db.add_vote(
@@ -448,13 +481,23 @@ async def collect_votes(message: types.Message, state: FSMContext, db: Database)
             question=current_question,
             vote=message.text
         )
+        # У бюлетень голос потрапляє лише після коміту, тож свій голос рахуємо окремо
+        vote = message.text
+        slot = live.slot(message.from_user.id)
+        completes = ledger.completes(slot)
+        db.after_commit(lambda: ledger.record(slot, vote))
         await message.answer("Ваш голос зараховано.", reply_markup=types.ReplyKeyboardRemove())
-
-    all_votes_collected = await db.check_all_votes_collected(session_code, current_question)
-    if all_votes_collected or force_close:
-        # Отримуємо результати голосування
-        vote_results = await db.get_vote_results(session_code, current_question)
-        count_participants = await db.count_of_participants(session_code)
+        user_id = message.from_user.id
+        db.after_commit(lambda: vote_progress.record(session_code, user_id, vote))
+
+    if completes or force_close:
+        # Результати — з бюлетенів у пам'яті, без повторного читання голосів з БД
+        item_id = live.current_item_id
+        db.after_commit(lambda: close_voting_item(session_code, item_id))
+        vote_results = ledger.results()
+        if completes:
+            vote_results[vote] += 1
+        count_participants = ledger.expected
         vote_results['Не голосували'] = count_participants - sum(vote_results.values())
         results_text = "\n".join(
             [f"<b>{key}</b>: {value}" for key, value in vote_results.items()]
@@ -464,15 +507,19 @@ async def collect_votes(message: types.Message, state: FSMContext, db: Database)
         if int(vote_results['За']) * 2 > count_participants:
             decision = "Ухвалено"
 
+        # Після record власного голосу, щоб фінальний лічильник його врахував
+        db.after_commit(lambda: vote_progress.finish(session_code))
+
         # Надсилаємо результати всім учасникам
         participants = await db.get_session_participants(session_code)
-        for participant_id in participants:
-            await message.bot.send_message(
-                chat_id=participant_id,
-                text=f"Голосування завершено для питання:\n<b>{current_question_index + 1}. {current_question}</b>\n\nРезультати:\n{results_text}\n\nРішення було <b>{decision}</b>",
-                parse_mode="HTML",
-                reply_markup=types.ReplyKeyboardRemove()
-            )
+        keyboard = types.ReplyKeyboardRemove()  # Один раз на всю розсилку
+        await outbox.enqueue(
+            db,
+            participants,
+            text=f"Голосування завершено для питання:\n<b>{current_question_index + 1}. {current_question}</b>\n\nРезультати:\n{results_text}\n\nРішення було <b>{decision}</b>",
+            parse_mode="HTML",
+            reply_markup=keyboard,
+        )
 
         await message.bot.send_message(
             chat_id=admin_id,
@@ -509,27 +556,28 @@ async def collect_votes(message: types.Message, state: FSMContext, db: Database)
 async def force_end_vote_and_set_proposed_entry(message: types.Message, state: FSMContext, db: Database):
     session_data = await state.get_data()
     session_code = session_data.get("session_code")
-    current_question_index = session_data.get("current_question_index", 0)
-    agenda = session_data.get("agenda", [])
+    if not session_code:
+        await message.answer("Помилка: сесія або питання не знайдені.")
+        return
 
-    if not session_code or current_question_index is None or not agenda:
+    # Порядок денний і поточне питання — зі спільного стану сесії, а не з копії у FSM адміна
+    live = await live_voting.ensure(db, session_code)
+    if live is None or live.current is None:
         await message.answer("Помилка: сесія або питання не знайдені.")
         return
 
-    current_question = agenda[current_question_index]
+    current_question_index = live.current_index
+    current_question = live.current_question
     admin_id = await db.get_admin_id(session_code)
 
-    current_question_index = await db.get_current_question_index(session_code)
-
-    if current_question_index is None:
-        await message.answer("Номер питання не був знайденим")
-        return
-
     proposer_name = message.text.strip() if message.text else ''
 
     if message.text.strip() == "Завершити опитування по поточному питанню":
-        vote_results = await db.get_vote_results(session_code, current_question)
-        count_participants = await db.count_of_participants(session_code)
+        ledger = live.current
+        item_id = live.current_item_id
+        db.after_commit(lambda: close_voting_item(session_code, item_id))
+        vote_results = ledger.results()
+        count_participants = ledger.expected
         vote_results['Не голосували'] = count_participants - sum(vote_results.values())
         results_text = "\n".join(
             [f"<b>{key}</b>: {value}" for key, value in vote_results.items()]
@@ -539,15 +587,18 @@ async def force_end_vote_and_set_proposed_entry(message: types.Message, state: F
         if int(vote_results['За']) * 2 > count_participants:
             decision = "Ухвалено"
 
+        db.after_commit(lambda: vote_progress.finish(session_code))
+
         # Відправляємо результати всім учасникам
         participants = await db.get_session_participants(session_code)
-        for participant_id in participants:
-            await message.bot.send_message(
-                chat_id=participant_id,
-                text=f"Голосування завершено для питання:\n<b>{current_question_index + 1}. {current_question}</b>\n\nРезультати:\n{results_text}\n\nРішення було <b>{decision}</b>",
-                parse_mode="HTML",
-                reply_markup=types.ReplyKeyboardRemove()
-            )
+        keyboard = types.ReplyKeyboardRemove()  # Один раз на всю розсилку
+        await outbox.enqueue(
+            db,
+            participants,
+            text=f"Голосування завершено для питання:\n<b>{current_question_index + 1}. {current_question}</b>\n\nРезультати:\n{results_text}\n\nРішення було <b>{decision}</b>",
+            parse_mode="HTML",
+            reply_markup=keyboard,
+        )
 
         await message.bot.send_message(
             chat_id=admin_id,
@@ -558,19 +609,15 @@ async def force_end_vote_and_set_proposed_entry(message: types.Message, state: F
     else:
         logging.info(f"Зайшло в функцію встановлення імені для питання")
 
-        agenda = await db.get_session_agenda(session_code)
-
-        if not agenda or current_question_index >= len(agenda):
-            await message.answer("Помилка: Питання/agenda не знайдені.")
-            return
-
         await db.set_agenda_item_proposer(session_code, current_question, proposer_name)
         await message.answer("Ім'я збережено✅.")
 
         logging.info(f"Відповідальна особа {proposer_name} записана для питання {current_question}")
 
-        if len(agenda) > current_question_index + 1:
-            new_question = agenda[current_question_index + 1]
+        if live.remaining:
+            new_question = live.agenda[current_question_index + 1]
+            # Питання, яке запропоновано адміну: повторне натискання «наступне питання» його вже не відкриє
+            await state.update_data(offered_question_index=current_question_index + 1)
             await message.bot.send_message(
                 chat_id=admin_id,
                 text=f"Голосуємо за наступне питання порядку денного?\n\n<b>{current_question_index + 2}. {new_question}</b>\n\nОберіть дію: ",
@@ -597,7 +644,18 @@ async def force_end_vote_and_set_proposed_entry(message: types.Message, state: F
                 reply_markup=admin_end_vote_kb()
             )
 
-        await db.set_current_question_index(session_code, current_question_index + 1)
+        ledger = live.current
+        if ledger.closed:
+            # Секція протоколу готується зараз, тож наприкінці сесії документ лише збирається з готових частин
+            votes = ledger.results()
+            tallies = {
+                "for": votes["За"],
+                "against": votes["Проти"],
+                "abstain": votes["Утримаюсь"],
+                "not_voted": max(0, ledger.expected - sum(votes.values())),
+            }
+            await draft_protocol_section(db, session_code, admin_id, current_question, proposer_name, tallies)
+
         await state.set_state('voting')
 
 
@@ -606,10 +664,18 @@ async def next_question(message: types.Message, state: FSMContext, db: Database)
     session_data = await state.get_data()
 
     session_code = session_data.get("session_code")
-    current_question_index = session_data.get("current_question_index", 0)
-    agenda = session_data.get("agenda", [])
+    live = await live_voting.ensure(db, session_code) if session_code else None
+    if live is None:
+        await message.answer("Помилка: сесія або питання не знайдені.")
+        return
 
-    if current_question_index + 1 >= len(agenda):
+    # Вихід учасника чи закриття голосування питання не змінюють, тож порівнюється лише індекс
+    offered_index = session_data.get("offered_question_index")
+    if offered_index is not None and live.current_index >= offered_index:
+        await message.answer("Наступне питання вже надіслано учасникам.")
+        return
+
+    if not live.remaining:
         admin_id = message.from_user.id
         youth_council_info = await db.get_youth_council_info(admin_id)
 
@@ -631,20 +697,28 @@ async def next_question(message: types.Message, state: FSMContext, db: Database)
         return
 
     # Переходимо до наступного питання
-    next_question_index = current_question_index + 1
-    next_question_from_agenda = agenda[next_question_index]
+    next_question_index = live.current_index + 1
+    next_question_from_agenda = live.agenda[next_question_index]
+
+    item_id = live.item_ids[next_question_index] if next_question_index < len(live.item_ids) else None
+    await db.set_current_question_index(session_code, next_question_index)
+    # Рушій переходить на питання лише разом із БД: відкочений апдейт лишає його на поточному
+    db.after_commit(lambda: live_voting.advance(session_code, next_question_index))
 
     # Надсилаємо питання всім учасникам сесії
     participants = await db.get_session_participants(session_code)
-    for participant_id in participants:
-        await message.bot.send_message(
-            chat_id=participant_id,
-            text=f"📋 Голосування по питанню <b>{next_question_index + 1}</b>:\n<b>{next_question_index + 1}. {next_question_from_agenda}</b>\n\nОберіть один із варіантів: 'За', 'Проти', 'Утримався'",
-            parse_mode="HTML",
-            reply_markup=vote_kb()
-        )
-
-    await state.update_data(current_question_index=next_question_index)
+    keyboard = vote_inline_kb(session_code, item_id)  # Один раз на всю розсилку
+    await outbox.enqueue(
+        db,
+        participants,
+        text=f"📋 Голосування по питанню <b>{next_question_index + 1}</b>:\n<b>{next_question_index + 1}. {next_question_from_agenda}</b>\n\nОберіть один із варіантів: 'За', 'Проти', 'Утримався'",
+        parse_mode="HTML",
+        reply_markup=keyboard,
+    )
+    await vote_progress.open(
+        message.bot, message.from_user.id, session_code, next_question_index + 1, next_question_from_agenda, len(participants)
+    )
+    db.after_commit(lambda: vote_reminders.schedule(session_code, item_id))
 
 
 @admin_router.message(F.text == "📝 Заповнити родові відмінки імен")
@@ -717,6 +791,8 @@ async def update_name_rv(message: types.Message, state: FSMContext, db: Database
     current_index = session_data.get("current_index", 0)
 
     await db.update_name_rv(message.from_user.id, current_name, message.text.strip())
+    # Уже готові секції протоколу з цим доповідачем отримують новий відмінок
+    await db.set_drafts_proposer_rv(session_data.get("session_code"), current_name, message.text.strip())
     await message.answer(f"Родовий відмінок для імені <b>{current_name}</b> тепер <b>{message.text.strip()}</b>!", parse_mode="HTML")
 
     await state.update_data(current_index=current_index + 1)
@@ -770,40 +846,28 @@ async def finalize_session_details(message: types.Message, state: FSMContext, db
 async def complete_session(message: types.Message, session_code: str, session_name: str, state: FSMContext,
                            db: Database):
     results = await db.end_session(session_code)
-    total_participants = await db.count_of_participants(session_code)
+    db.after_commit(lambda: vote_progress.finish(session_code))
+    db.after_commit(lambda: end_session_in_memory(session_code))
+    # Один знімок даних на розсилку результатів і обидва документи
+    snapshot = await collect_session_snapshot(session_code, db, voting_results=results)
+    total_participants = len(snapshot.participants)
     results_text = "\n".join([
         f"<b>{index + 1}. {question}</b>\nЗа: {votes['for']}, Проти: {votes['against']}, Утримались: {votes['abstain']}, Не голосували: {votes['not_voted']}\nЦе рішення було <b>{'Прийнято' if votes['for'] * 2 > total_participants else 'Не прийнято'}</b>"
         for index, (question, votes) in enumerate(results.items())
     ])
 
-    try:
-        protocol_path = await generate_protocol(session_code, db)
-        attendance_list_path = await generate_attendance_list_full(session_code, db)
-
-        protocol_file = FSInputFile(protocol_path)
-        await message.answer_document(document=protocol_file)
-
-        attendance_file = FSInputFile(attendance_list_path)
-        await message.answer_document(document=attendance_file)
-
-        # Видалення файлів після відправки
-        os.remove(protocol_path)
-        os.remove(attendance_list_path)
-        logging.info(f"Файли {protocol_path} та {attendance_list_path} були видалені.")
-    except Exception as e:
-        logging.error(f"Помилка під час генерації документів: {e}")
-        await message.answer(f"Сталася помилка під час генерації документів: {str(e)}")
-
-    participants = await db.get_session_participants(session_code)
-    for participant_id in participants:
-        await message.bot.send_message(
-            chat_id=participant_id,
-            text=f"Сесію <b>{session_name}</b> завершено. \nРезультати голосування:\n\n{results_text}",
-            parse_mode="HTML"
-        )
+    queued = await outbox.enqueue(
+        db,
+        [participant["id"] for participant in snapshot.participants],
+        text=f"Сесію <b>{session_name}</b> завершено. \nРезультати голосування:\n\n{results_text}",
+        parse_mode="HTML",
+    )
+    # Документи рендеряться вже після фіксації, паралельно з розсилкою результатів
+    db.after_commit(lambda: session_documents.start(message.bot, message.chat.id, snapshot))
 
     await message.answer(
-        f"Сесію <b>{session_name}</b> завершено. Результати розіслані всім учасникам.",
+        f"Сесію <b>{session_name}</b> завершено. Результати розсилаються всім учасникам ({queued}), "
+        f"протокол і додаток присутності надійдуть, щойно будуть готові.",
         parse_mode="HTML", reply_markup=admin_menu_kb()
     )
     await state.clear()
@@ -2,11 +2,12 @@ import logging
 import os
 
 import PyPDF2
-from aiogram import Bot, F, Router, types
+from aiogram import Bot, F, types
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
+from bot.common.text_index import IndexedRouter
 from bot.keyboards.admin import session_control_kb
 from bot.keyboards.common import common_kb, pdf_kb
 from config import OPTION
@@ -16,10 +17,10 @@ if str(OPTION) == 'MySQL':
 else:
     from bot.database.database_postgres import Database
 
-common_router = Router()
+common_router = IndexedRouter()
 
 
-pdf_router = Router()
+pdf_router = IndexedRouter()
 
 class PDFMergeStates(StatesGroup):
     uploading = State()
@@ -28,15 +29,6 @@ class PDFMergeStates(StatesGroup):
 pdf_files = {}
 
 
-@common_router.message(Command("start"))
-async def start_command(message: types.Message, state: FSMContext):
-    logging.info("Хендлер /start викликано")
-    await state.clear()
-    await message.answer(
-        "Вітаю! Ось список доступних дій:",
-        reply_markup=common_kb()
-    )
-
 @common_router.message(Command("info"))
 @common_router.message(F.text == "ℹ️ Інформація про сесію")
 @common_router.message(F.text == "Інформація про сесію")
@@ -1,12 +1,27 @@
+import asyncio
+import hashlib
+import hmac
 import logging
 
-from aiogram import F, Router, types
+from aiogram import F, types
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.filters.state import StateFilter
 from aiogram.fsm.context import FSMContext
 
+from bot.common.active_sessions import active_sessions
+from bot.common.affinity import affinity
+from bot.common.join_links import token_session_code, verify_join_token
+from bot.common.live_voting import OPTIONS, live_voting
+from bot.common.outbox import outbox
+from bot.common.text_index import IndexedRouter
+from bot.common.vote_progress import vote_progress
+from bot.common.vote_reminders import vote_reminders
+from bot.filters.session_filter import SessionFilter
 from bot.keyboards.admin import admin_menu_kb, force_end_vote_kb
-from bot.keyboards.participant import participant_menu_kb
+from bot.keyboards.common import VoteCallback
+from bot.keyboards.participant import last_name_kb, participant_menu_kb
+from bot.middlewares.throttling import throttling
 from config import OPTION
 
 if str(OPTION) == 'MySQL':
@@ -14,7 +29,7 @@ if str(OPTION) == 'MySQL':
 else:
     from bot.database.database_postgres import Database
 
-participant_router = Router()
+participant_router = IndexedRouter()
 
 class ParticipantStates:
     entering_session_code = "entering_session_code"
@@ -22,6 +37,12 @@ class ParticipantStates:
     entering_name = "entering_name"
     voting = "voting"
 
+
+def _password_hash(password):
+    # У FSM зберігається лише хеш пароля сесії, а не сам пароль
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
 @participant_router.message(Command("join"))
 @participant_router.message(F.text == "Приєднатися до сесії")
 async def join_session(message: types.Message, state: FSMContext):
@@ -37,16 +58,26 @@ async def join_session(message: types.Message, state: FSMContext):
 async def handle_session_code(message: types.Message, state: FSMContext, db: Database):
     """
     Учасник вводить код сесії.
+
+    Єдиний запит приєднання до БД на цьому кроці: рядок сесії та останнє ім'я користувача
+    кешуються у FSM, тож пароль перевіряється без звернення до БД.
     """
-    session_code = int(message.text.strip())
-    session = await db.check_session(session_code)
+    text = (message.text or "").strip()
+    join = await db.get_join_info(int(text), message.from_user.id) if text.isdigit() else None
 
-    if not session:
+    if not join:
         await message.answer("❌ Сесія з таким кодом не знайдена або вже неактивна. Спробуйте ще раз.")
         return
 
+    session_code = int(text)
     logging.info(f"✅ Користувач {message.from_user.id} заходить до сесії {session_code}")
-    await state.update_data(session_code=session_code)
+    await state.update_data(
+        session_code=session_code,
+        session_id=join.id,
+        session_name=join.name,
+        password_hash=_password_hash(join.password),
+        last_name=join.last_name,
+    )
     await state.set_state(ParticipantStates.entering_session_password)
     await message.answer("🔒 Введіть пароль сесії:")
 
@@ -58,94 +89,168 @@ async def handle_session_password(message: types.Message, state: FSMContext, db:
     """
     data = await state.get_data()
     session_code = data.get("session_code")
-    session = await db.get_session_by_code(session_code)
+    password_hash = data.get("password_hash")
 
-    if not session or session.password != message.text.strip():
+    if not password_hash or not hmac.compare_digest(password_hash, _password_hash((message.text or "").strip())):
         await message.answer("Неправильний пароль. Спробуйте ще раз.")
         return
 
     logging.info(f"Користувач {message.from_user.id} успішно приєднався до сесії {session_code}")
     await state.set_state(ParticipantStates.entering_name)
-    await message.answer("Введіть своє ім'я:")
+    last_name = data.get("last_name")
+    if last_name:
+        await message.answer("Введіть своє ім'я або оберіть збережене:", reply_markup=last_name_kb(last_name))
+    else:
+        await message.answer("Введіть своє ім'я:")
 
 @participant_router.message(StateFilter(ParticipantStates.entering_name))
 async def handle_name(message: types.Message, state: FSMContext, db: Database):
     """
     Учасник вводить своє ім'я.
     """
-    user_name = message.text.strip()
     data = await state.get_data()
-    session_code = data.get("session_code")
+    # Назва й id сесії вже є у FSM з першого кроку
+    await _complete_join(
+        message, state, db, data.get("session_code"), data.get("session_id"), data.get("session_name"), message.text.strip()
+    )
 
-    # Додаємо учасника до сесії з ім'ям
-    await db.add_participant(session_code=session_code, user_id=message.from_user.id, user_name=user_name)
 
-    # Зберігаємо session_code, session_name та user_name
-    session = await db.get_session_by_code(session_code)
+async def _complete_join(message: types.Message, state: FSMContext, db: Database, session_code, session_id, session_name,
+                         user_name):
+    user_id = message.from_user.id
+    if session_id is None and session_code:
+        # Стан FSM, записаний до появи session_id у ньому: id сесії дочитуємо за кодом
+        join = await db.get_join_info(int(session_code), user_id)
+        session_id = join.id if join else None
+
+    joined = session_id is not None and await db.join_session(session_id, user_id, user_name)
+    if not joined and (session_id is None or user_id not in await db.get_session_participants(session_code)):
+        # Вставка нічого не змінила, а учасником користувач так і не став — сесії вже немає
+        await state.clear()
+        await state.set_state(ParticipantStates.entering_session_code)
+        await message.answer("❌ Не вдалося приєднатися: сесія не знайдена або вже неактивна. Введіть код сесії ще раз.")
+        return
+    affinity.bind(session_code, message.chat.id)
 
     await state.set_state("voting")
-    await state.update_data(session_code=session.code, session_name=session.name, user_name=user_name)
+    # Кешований рядок сесії більше не потрібен — у FSM лишається лише посилання на сесію
+    await state.set_data({"session_code": session_code, "session_name": session_name, "user_name": user_name})
 
-    await message.answer(
-        f"Ви успішно приєдналися до сесії <b>{session.name}</b> як <b>{user_name}</b>!",
-        parse_mode="HTML",
-        reply_markup=participant_menu_kb()
-    )
+    if joined:
+        text = f"Ви успішно приєдналися до сесії <b>{session_name}</b> як <b>{user_name}</b>!"
+    else:
+        text = f"Ви вже є учасником сесії <b>{session_name}</b>."
+    await message.answer(text, parse_mode="HTML", reply_markup=participant_menu_kb())
 
-@participant_router.message(StateFilter("voting"), F.text.in_({"За", "Проти", "Утримаюсь"}))
-async def collect_votes(message: types.Message, state: FSMContext, db: Database):
-    session_data = await state.get_data()
+async def join_by_link(message: types.Message, state: FSMContext, db: Database, token: str):
+    """
+    Приєднання за посиланням t.me/<bot>?start=<token> одним апдейтом: підпис у посиланні
+    замінює пароль, а ім'я береться з попередньої участі. Новачка бот лише питає ім'я.
+    """
+    session_code = token_session_code(token)
+    join = await db.get_join_info(session_code, message.from_user.id) if session_code else None
 
-    print('user_participant')
+    if not join or not verify_join_token(token, session_code, join.password):
+        await message.answer("❌ Посилання недійсне або сесія вже неактивна.")
+        return
 
-    # Отримуємо session_code
-    session_code = session_data.get("session_code")
-    if not session_code:
-        await message.answer("Помилка: Сесія не знайдена.")
+    logging.info(f"✅ Користувач {message.from_user.id} заходить до сесії {session_code} за посиланням")
+    if join.last_name:
+        await _complete_join(message, state, db, session_code, join.id, join.name, join.last_name)
         return
 
-    # Отримуємо поточне питання та порядок денний із бази даних
-    current_question_index = session_data.get("current_question_index", 0)
-    agenda = session_data.get("agenda", [])
+    await state.update_data(session_code=session_code, session_id=join.id, session_name=join.name)
+    await state.set_state(ParticipantStates.entering_name)
+    await message.answer(f"Сесія <b>{join.name}</b>. Введіть своє ім'я:", parse_mode="HTML")
 
-    if current_question_index is None or not agenda or current_question_index >= len(agenda):
-        await message.answer("Помилка: Питання не знайдені.")
-        return
 
-    current_question = agenda[current_question_index]
+_prompts = set()  # Запущені підказки адміну, щоб задачі не зібрав GC до завершення
 
-    # Перевіряємо, чи користувач уже голосував за це питання
-    user_voted = await db.has_user_voted(
-        session_code=session_code,
-        user_id=message.from_user.id,
-        question=current_question
-    )
 
-    admin_id = await db.get_admin_id(session_code)
+def close_voting_item(session_code, item_id):
+    """Закриває питання в пам'яті процесу; викликається після коміту апдейту, що його закрив."""
+    live_voting.close_item(session_code)
+    vote_reminders.cancel(session_code)
+    throttling.forget_item(item_id)
+
 
-    force_close = False
-    if message.text == "Завершити опитування по поточному питанню" and admin_id == message.from_user.id:
-        force_close = True
+def end_session_in_memory(session_code):
+    """Прибирає завершену сесію зі стану процесу; викликається після коміту end_session."""
+    live_voting.end(session_code)
+    vote_reminders.cancel(session_code)
+    active_sessions.close(session_code)
+    affinity.unbind(session_code)
+
+
+def _check_missed_close(bot, ledger, session_code, admin_id):
+    # Двоє останніх, що голосують одночасно, не бачать незакомічених голосів одне одного,
+    # і жоден не закриває питання — тоді закрити його пропонуємо адміну
+    if ledger.all_voted() and not ledger.closed:
+        logging.warning(f"Сесія {session_code}: усі проголосували, але питання не закрите")
+        task = asyncio.create_task(bot.send_message(
+            chat_id=admin_id,
+            text="Усі учасники проголосували. Завершіть голосування по поточному питанню.",
+            reply_markup=force_end_vote_kb()
+        ))
+        _prompts.add(task)
+        task.add_done_callback(_prompts.discard)
 
-    if user_voted and not force_close:
-        await message.answer("Ви вже проголосували за це питання. Дочекайтеся завершення голосування.", reply_markup=types.ReplyKeyboardRemove())
+
+@participant_router.callback_query(VoteCallback.filter(), SessionFilter())
+async def vote_callback(callback: types.CallbackQuery, callback_data: VoteCallback, state: FSMContext, db: Database):
+    """
+    Голос з inline-кнопки. Сесія й пункт порядку денного приходять у callback_data,
+    тож стан FSM не читається, а питання не шукається за текстом.
+    """
+    user_id = callback.from_user.id
+    session_code = callback_data.session
+
+    live = await live_voting.ensure(db, session_code)
+    if live is None or live.current_item_id != callback_data.item or live.current.closed:
+        await callback.answer("Голосування за це питання вже завершено.", show_alert=True)
+        return
+
+    if live.slot(user_id) is None:
+        await callback.answer("Ви не є учасником цього голосування.", show_alert=True)
+        return
+
+    if live.has_voted(user_id):
+        throttling.mark_voted(user_id, callback_data.item)
+        await callback.answer("Ви вже проголосували за це питання. Дочекайтеся завершення голосування.")
         return
 
-    if not force_close and not user_voted:
-    # Зберігаємо голос
-        await db.add_vote(
-            session_code=session_code,
-            user_id=message.from_user.id,
-            question=current_question,
-            vote=message.text
+    vote = OPTIONS[callback_data.option]
+    await db.add_item_vote(callback_data.item, user_id, vote)
+    # У бюлетень і у відсічку повторів голос потрапляє лише після коміту: відкочений голос
+    # не має ні рахуватись, ні блокувати повторне натискання
+    ledger = live.current
+    slot = live.slot(user_id)
+    completes = ledger.completes(slot)
+    db.after_commit(lambda: ledger.record(slot, vote))
+    db.after_commit(lambda: throttling.mark_voted(user_id, callback_data.item))
+    db.after_commit(lambda: vote_progress.record(session_code, user_id, vote))
+
+    await callback.answer("Ваш голос зараховано.")
+    try:
+        await callback.message.edit_text(
+            f"{callback.message.html_text}\n\nВаш голос: <b>{vote}</b>",
+            parse_mode="HTML",
+            reply_markup=None
         )
-        await message.answer("Ваш голос зараховано.", reply_markup=types.ReplyKeyboardRemove())
+    except TelegramBadRequest as e:
+        # Голос уже збережено; не вдалося лише прибрати кнопки
+        logging.warning(f"Не вдалося оновити повідомлення голосування для {user_id}: {e}")
 
-    all_votes_collected = await db.check_all_votes_collected(session_code, current_question)
-    if all_votes_collected or force_close:
-        # Отримуємо результати голосування
-        vote_results = await db.get_vote_results(session_code, current_question)
-        count_participants = await db.count_of_participants(session_code)
+    admin_id = await db.get_admin_id(session_code)
+    current_question_index = live.current_index
+    current_question = live.current_question
+
+    if completes:
+        item_id = live.current_item_id
+        db.after_commit(lambda: close_voting_item(session_code, item_id))
+        vote_results = ledger.results()
+        vote_results[vote] += 1  # Власний голос ляже в бюлетень лише після коміту
+        count_participants = ledger.expected
         vote_results['Не голосували'] = count_participants - sum(vote_results.values())
         results_text = "\n".join(
             [f"<b>{key}</b>: {value}" for key, value in vote_results.items()]
@@ -155,62 +260,35 @@ async def collect_votes(message: types.Message, state: FSMContext, db: Database)
         if int(vote_results['За']) * 2 > count_participants:
             decision = "Ухвалено"
 
+        # Після record власного голосу, щоб фінальний лічильник його врахував
+        db.after_commit(lambda: vote_progress.finish(session_code))
+
         # Надсилаємо результати всім учасникам
         participants = await db.get_session_participants(session_code)
-        for participant_id in participants:
-            await message.bot.send_message(
-                chat_id=participant_id,
-                text=f"Голосування завершено для питання:\n<b>{current_question_index + 1}. {current_question}</b>\n\nРезультати:\n{results_text}\n\nРішення було <b>{decision}</b>",
-                parse_mode="HTML",
-                reply_markup=types.ReplyKeyboardRemove()
-            )
+        await outbox.enqueue(
+            db,
+            participants,
+            text=f"Голосування завершено для питання:\n<b>{current_question_index + 1}. {current_question}</b>\n\nРезультати:\n{results_text}\n\nРішення було <b>{decision}</b>",
+            parse_mode="HTML",
+        )
 
-        await message.bot.send_message(
+        await callback.bot.send_message(
             chat_id=admin_id,
             text=f"Введіть Прізвище та Ім'я людини, яка запропонувала це питання:",
             reply_markup=types.ReplyKeyboardRemove()
         )
 
     else:
-        if message.from_user.id == admin_id:
-            await message.answer(
+        db.after_commit(lambda: _check_missed_close(callback.bot, ledger, session_code, admin_id))
+        if user_id == admin_id:
+            await callback.message.answer(
                 "Не всі проголосували. Ви можете дочекатися або завершити голосування вручну.",
                 reply_markup=force_end_vote_kb()
             )
 
-
-@participant_router.message(Command("info"))
-@participant_router.message(F.text == "ℹ️ Інформація про сесію")
-async def session_info(message: types.Message, state: FSMContext, db: Database):
-    """
-    Учасник переглядає інформацію про сесію.
-    """
-    session_data = await state.get_data()
-    logging.info(f"Дані стану для користувача {message.from_user.id}: {session_data}")
-
-    session_code = session_data.get("session_code")
-    session_name = session_data.get("session_name")
-
-    if not session_code or not session_name:
-        await message.answer("Помилка: Ви не перебуваєте в активній сесії.", reply_markup=admin_menu_kb())
-        return
-
-    # Отримуємо список учасників
-    participants = await db.get_session_participants_with_names(session_code)
-    participant_list = "\n".join([f"{i + 1}. {p['name']}" for i, p in enumerate(participants)])
-
-    # Отримуємо порядок денний
-    agenda = await db.get_session_agenda(session_code)
-    agenda_text = "\n".join([f"{i + 1}. {item}" for i, item in enumerate(agenda)])
-
-    await message.answer(
-        f"Інформація про сесію:\n"
-        f"🔑 Код: <code>{session_code}</code>\n"
-        f"📋 Назва: <b>{session_name}</b>\n\n"
-        f"Учасники:\n{participant_list}\n\n"
-        f"Порядок денний:\n{agenda_text}",
-        parse_mode="HTML"
-    )
+    # Адмін після свого голосу вводить ім'я доповідача або завершує питання вручну
+    if user_id == admin_id:
+        await state.set_state("proposer_entry")
 
 
 @participant_router.message(Command('leave'))
@@ -241,6 +319,8 @@ async def leave_session(message: types.Message, state: FSMContext, db: Database)
 
         # Завершуємо сесію та отримуємо результати
         results = await db.end_session(session_code)
+        db.after_commit(lambda: vote_progress.finish(session_code))
+        db.after_commit(lambda: end_session_in_memory(session_code))
 
         # Форматуємо результати
         results_text = "\n".join([
@@ -249,15 +329,15 @@ async def leave_session(message: types.Message, state: FSMContext, db: Database)
         ])
 
         participants = await db.get_session_participants(session_code)
-        for participant_id in participants:
-            await message.bot.send_message(
-                chat_id=participant_id,
-                text=f"Сесію <b>{session_name}</b> завершено. \nРезультати голосування:\n\n{results_text}",
-                parse_mode="HTML"
-            )
+        queued = await outbox.enqueue(
+            db,
+            participants,
+            text=f"Сесію <b>{session_name}</b> завершено. \nРезультати голосування:\n\n{results_text}",
+            parse_mode="HTML",
+        )
 
         await message.answer(
-            f"Сесію <b>{session_name}</b> завершено. Результати розіслані всім учасникам.",
+            f"Сесію <b>{session_name}</b> завершено. Результати розсилаються всім учасникам ({queued}).",
             parse_mode="HTML", reply_markup=admin_menu_kb()
         )
         await state.clear()
@@ -266,6 +346,7 @@ async def leave_session(message: types.Message, state: FSMContext, db: Database)
         # Видаляємо учасника з бази даних
         try:
             await db.remove_participant(session_code=session_code, user_id=user_id)
+            live_voting.leave(session_code, user_id)
             await state.clear()
             await message.answer(
                 f"Ви успішно вийшли із сесії <b>{session_name}</b> (код: {session_code}).",
@@ -1,5 +1,15 @@
+from aiogram.filters.callback_data import CallbackData
 from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
-from aiogram.utils.keyboard import ReplyKeyboardBuilder
+from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
+
+from bot.common.live_voting import OPTIONS
+
+
+class VoteCallback(CallbackData, prefix="v"):
+    """Голос з inline-кнопки: код сесії, ID пункту порядку денного та індекс варіанта в OPTIONS."""
+    session: int
+    item: int
+    option: int
 
 
 def common_kb():
@@ -23,6 +33,16 @@ def vote_kb():
     )
     return keyboard.adjust(1).as_markup(resize_keyboard=True)
 
+def vote_inline_kb(session_code, item_id):
+    """Inline-кнопки голосування за конкретним пунктом порядку денного."""
+    keyboard = InlineKeyboardBuilder()
+    for index, option in enumerate(OPTIONS):
+        keyboard.button(
+            text=option,
+            callback_data=VoteCallback(session=int(session_code), item=item_id, option=index)
+        )
+    return keyboard.adjust(3).as_markup()
+
 def pdf_kb():
     keyboard = ReplyKeyboardBuilder()
     keyboard.add(
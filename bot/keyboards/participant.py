@@ -9,4 +9,11 @@ def participant_menu_kb():
         KeyboardButton(text="ℹ️ Інформація про сесію"),
         KeyboardButton(text='🚪 Вийти з сесії'),
     )
-    return keyboard.as_markup(resize_keyboard=True)
\ No newline at end of file
+    return keyboard.as_markup(resize_keyboard=True)
+
+
+def last_name_kb(name):
+    """Ім'я з попередньої участі — одним натисканням замість набору."""
+    keyboard = ReplyKeyboardBuilder()
+    keyboard.add(KeyboardButton(text=name))
+    return keyboard.as_markup(resize_keyboard=True, one_time_keyboard=True)
\ No newline at end of file
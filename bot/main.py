@@ -0,0 +1,174 @@
+"""Збирає та запускає Telegram-бота всередині власного процесу.
+
+Рушій БД, пул з'єднань і Bot створюються тут, у процесі бота, а не при імпорті app.py,
+тож жоден інший процес їх не успадковує.
+"""
+
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
+from aiogram.enums import ParseMode
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+
+from bot.catchup import catch_up
+from bot.common.active_sessions import active_sessions
+from bot.common.chat_queues import chat_queues
+from bot.common.commands import set_bot_commands
+from bot.common.memory import log_memory_usage
+from bot.common.outbox import outbox
+from bot.common.session_documents import session_documents
+from bot.common.vote_reminders import vote_reminders
+from bot.database.fsm_storage import create_storage
+from bot.database.query_stats import QueryCacheStats
+from bot.handlers.admin import admin_router
+from bot.handlers.common import common_router, pdf_router
+from bot.handlers.participant import participant_router
+from bot.middlewares.session_middleware import SessionMiddleware
+from bot.middlewares.throttling import throttling
+from bot.webhook import run_webhook
+from config import (
+    BOT_MODE,
+    BOT_WORKERS,
+    DATABASE_URL,
+    DB_MAX_OVERFLOW,
+    DB_POOL_SIZE,
+    FSM_CACHE_TTL,
+    FSM_IDLE_TTL,
+    FSM_MEMORY_LIMIT_MB,
+    FSM_STORAGE,
+    OPTION,
+    POSTGRESQL,
+    REDIS_URL,
+    TELEGRAM_TOKEN,
+    UPDATE_ORDERING,
+    VOTE_REMINDER_DELAY,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+)
+
+if str(OPTION) == 'MySQL':
+    DATABASE = DATABASE_URL
+    from bot.database.database import Base, Database, DatabaseMiddleware
+else:
+    from bot.database.database_postgres import Base, Database, DatabaseMiddleware
+    DATABASE = "postgresql+asyncpg" + str(POSTGRESQL)
+
+
+def create_dispatcher(engine: AsyncEngine, db: Database, query_stats: QueryCacheStats) -> Dispatcher:
+    """Створює диспетчер з роутерами та хуками життєвого циклу процесу бота."""
+    # Стани FSM переживають рестарт і спільні для реплік
+    storage = create_storage(
+        FSM_STORAGE, db, REDIS_URL, FSM_IDLE_TTL, FSM_MEMORY_LIMIT_MB * 1024 * 1024, FSM_CACHE_TTL
+    )
+    # Апдейти різних чатів — паралельно, одного чату — строго по черзі
+    events_isolation = chat_queues if UPDATE_ORDERING == "chat" else None
+    dp = Dispatcher(
+        storage=storage, events_isolation=events_isolation, engine=engine, db=db, query_stats=query_stats
+    )
+    # Антифлуд і повторні голоси відсікаються до фільтрів і до транзакції DatabaseMiddleware
+    dp.message.outer_middleware(throttling)
+    dp.callback_query.outer_middleware(throttling)
+    # Апдейти завершених сесій відхиляються за бітмапою в пам'яті, ще до запитів хендлерів
+    session_middleware = SessionMiddleware(db)
+    dp.message.outer_middleware(session_middleware)
+    dp.callback_query.outer_middleware(session_middleware)
+    # Нагадування запускаються поза апдейтом, тож пишуть в outbox через основний Database процесу
+    vote_reminders.configure(db, VOTE_REMINDER_DELAY)
+    database_middleware = DatabaseMiddleware(db)
+    dp.message.middleware(database_middleware)
+    dp.callback_query.middleware(database_middleware)
+
+    dp.include_router(admin_router)
+    dp.include_router(common_router)
+    dp.include_router(participant_router)
+    dp.include_router(pdf_router)
+
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+
+async def create_tables(engine: AsyncEngine, db: Database):
+    """Створює таблиці у базі даних."""
+    async with engine.begin() as conn:
+        # await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+    logging.info("Таблиці створено.")
+    await db.backfill_users()
+    await db.seed_open_sessions()
+
+
+async def on_startup(bot: Bot, dispatcher: Dispatcher, engine: AsyncEngine, db: Database):
+    """Стартовий хук процесу бота: таблиці, вебхук, команди, outbox і догін черги апдейтів."""
+    await create_tables(engine, db)
+    if BOT_MODE == "webhook":
+        # Повторна реєстрація того самого URL після рестарту нічого не змінює
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=dispatcher.resolve_used_update_types(),
+            )
+            logging.info("Вебхук зареєстровано.")
+    logging.info("Встановлення команд для бота...")
+    await set_bot_commands(bot)  # Встановлюємо команди
+    logging.info("Команди встановлено. Telegram-бот запущено.")
+    outbox.start(bot, db)  # Дошле все, що не встигли розіслати до рестарту
+    if BOT_MODE != "webhook":
+        # Голоси й відповіді, надіслані під час рестарту, обробляються, а не скидаються
+        await catch_up(bot, dispatcher)
+    log_memory_usage("bot")
+
+
+async def on_shutdown(dispatcher: Dispatcher, engine: AsyncEngine, db: Database, query_stats: QueryCacheStats):
+    """Хук завершення: дочікується документів сесій, зупиняє outbox, звітує про кеш запитів і закриває пул, поки подієвий цикл ще живий."""
+    # Сховище FSM і черги чатів закриває сам Dispatcher (fsm.close зареєстровано раніше за цей хук)
+    vote_reminders.stop()
+    await session_documents.stop()
+    await outbox.stop()
+    throttling.report()
+    active_sessions.report()
+    query_stats.report()
+    db.loaders.report()
+    await engine.dispose()
+    logging.info("Пул з'єднань БД закрито.")
+
+
+def create_resources():
+    """Рушій БД зі статистикою кешу запитів, Database і Bot — окремі для кожного процесу."""
+    engine = create_async_engine(DATABASE, future=True, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+    query_stats = QueryCacheStats().attach(engine)
+    async_session = async_sessionmaker(engine, expire_on_commit=False)
+    db = Database(session_factory=async_session, max_connections=DB_POOL_SIZE + DB_MAX_OVERFLOW)
+
+    # Ініціалізація Telegram-бота
+    bot = Bot(
+        token=TELEGRAM_TOKEN,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+    return engine, query_stats, db, bot
+
+
+async def run_bot():
+    """Запускає Telegram-бота."""
+    if BOT_WORKERS > 1 and BOT_MODE == "webhook":
+        # Шардування за сесіями є лише в polling-режимі; вебхук обслуговує один процес
+        raise RuntimeError("BOT_MODE=webhook працює лише з BOT_WORKERS=1: для кількох воркерів використовуйте polling")
+    if BOT_WORKERS > 1 and FSM_STORAGE == "memory":
+        # Стан у пам'яті бачить лише свій воркер, а апдейти чату можуть перейти на інший разом із сесією
+        raise RuntimeError("FSM_STORAGE=memory працює лише з BOT_WORKERS=1: оберіть sql або redis")
+    if BOT_WORKERS > 1:
+        from bot.sharding import run_supervisor
+
+        await run_supervisor(BOT_WORKERS)
+        return
+
+    engine, query_stats, db, bot = create_resources()
+    dp = create_dispatcher(engine, db, query_stats)
+    if BOT_MODE == "webhook":
+        await run_webhook(dp, bot)
+    else:
+        await dp.start_polling(bot)
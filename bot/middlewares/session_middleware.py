@@ -1,15 +1,57 @@
-from aiogram.dispatcher.middlewares.base import BaseMiddleware
-from aiogram.types import Message
+import logging
+from typing import Any, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import CallbackQuery
+
+from bot.common.active_sessions import active_sessions
+from bot.keyboards.common import VoteCallback
 
 
 class SessionMiddleware(BaseMiddleware):
+    """
+    Зовнішній middleware: перевіряє, що сесія апдейту ще не завершена, до фільтрів і хендлерів.
+
+    Код сесії береться з кнопки голосування (VoteCallback) або з даних FSM. Застарілий голос
+    отримує alert. Повідомлення в завершеній сесії скидає стан FSM і йде далі вже без сесії:
+    /start з посиланням, приєднання чи створення сесії мають спрацювати, а хендлери сесії
+    відсікає SessionFilter. Лише якщо повідомлення ніхто не обробив, користувач дізнається,
+    що сесію завершено. Для актуальної сесії код кладеться в data["session_code"].
+    """
+
     def __init__(self, db):
-        self.db = db
         super().__init__()
+        self.db = db
+
+    async def __call__(self, handler: Callable, event: Any, data: Dict[str, Any]) -> Any:
+        state = data.get("state")
+        vote = isinstance(event, CallbackQuery) and event.data and event.data.startswith(f"{VoteCallback.__prefix__}:")
+        if vote:
+            session_code = VoteCallback.unpack(event.data).session
+        elif state is not None:
+            session_code = (await state.get_data()).get("session_code")
+        else:
+            session_code = None
+
+        if session_code is None:
+            return await handler(event, data)
+
+        if not await active_sessions.is_active(self.db, session_code):
+            if vote:
+                logging.info(f"Голос користувача {event.from_user.id} для завершеної сесії {session_code} відхилено")
+                await event.answer("Сесія не знайдена або завершена.", show_alert=True)
+                return None
+            logging.info(f"Стан користувача {event.from_user.id} із завершеною сесією {session_code} скинуто")
+            await state.clear()
+            data["raw_state"] = None  # Фільтри станів мають бачити вже скинутий стан
+            result = await handler(event, data)
+            if result is UNHANDLED:
+                if isinstance(event, CallbackQuery):
+                    await event.answer("Сесія не знайдена або завершена.", show_alert=True)
+                else:
+                    await event.answer("Сесія не знайдена або завершена.")
+            return result
 
-    async def on_pre_process_message(self, message: Message, data: dict):
-        session_code = data.get("session_code")
-        if session_code and not self.db.get_session(session_code):
-            await message.answer("Сесія не знайдена або завершена.")
-            return False
-        return True
+        data["session_code"] = session_code
+        return await handler(event, data)
@@ -0,0 +1,101 @@
+import logging
+import time
+from typing import Any, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+
+from bot.keyboards.common import VoteCallback
+
+# Людина не натискає частіше: 2 апдейти за секунду з запасом на 5 поспіль
+USER_RATE = 2.0
+USER_BURST = 5.0
+IDLE_TTL = 60.0
+REPORT_INTERVAL = 3600.0
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, now):
+        self.tokens = USER_BURST
+        self.updated = now
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Зовнішній middleware перед DatabaseMiddleware: відсікає флуд і повторні голоси ще до фільтрів
+    і до відкриття транзакції.
+
+    - відро токенів на користувача: зайві апдейти відкидаються (dropped), крім догону після рестарту;
+    - множина (пункт, користувач), хто вже проголосував: повторне натискання кнопки
+      отримує відповідь з пам'яті, без хендлера і БД (deduplicated).
+    """
+
+    def __init__(self, rate=USER_RATE, burst=USER_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._voted = {}  # agenda_item_id -> set(user_id)
+        self._last_sweep = self._last_report = time.monotonic()
+        self.dropped = 0
+        self.deduplicated = 0
+
+    def mark_voted(self, user_id, item_id):
+        self._voted.setdefault(item_id, set()).add(user_id)
+
+    def forget_item(self, item_id):
+        """Питання закрите — далі застарілі натискання відхиляє сам хендлер."""
+        self._voted.pop(item_id, None)
+
+    def _allow(self, user_id):
+        now = time.monotonic()
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = _Bucket(now)
+        bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+        bucket.updated = now
+        if now - self._last_sweep >= IDLE_TTL:
+            self._sweep(now)
+        if bucket.tokens < 1:
+            return False
+        bucket.tokens -= 1
+        return True
+
+    def _sweep(self, now):
+        self._last_sweep = now
+        idle = [user_id for user_id, bucket in self._buckets.items() if now - bucket.updated >= IDLE_TTL]
+        for user_id in idle:
+            del self._buckets[user_id]
+        # Лічильники видно й під час роботи, а не лише в звіті при зупинці
+        if now - self._last_report >= REPORT_INTERVAL:
+            self._last_report = now
+            self.report()
+
+    async def __call__(self, handler: Callable, event: Any, data: Dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        # Черга, що накопичилась за час рестарту (catch_up), — не флуд, її обробляємо повністю
+        if not data.get("catch_up") and not self._allow(user.id):
+            self.dropped += 1
+            if isinstance(event, CallbackQuery):
+                await event.answer("Забагато натискань. Зачекайте секунду.")
+            return None
+
+        if isinstance(event, CallbackQuery) and event.data and event.data.startswith(f"{VoteCallback.__prefix__}:"):
+            item_id = VoteCallback.unpack(event.data).item
+            if user.id in self._voted.get(item_id, ()):
+                self.deduplicated += 1
+                await event.answer("Ви вже проголосували за це питання. Дочекайтеся завершення голосування.")
+                return None
+
+        return await handler(event, data)
+
+    def report(self):
+        logging.info(f"Антифлуд: відкинуто {self.dropped}, повторних голосів з пам'яті {self.deduplicated}")
+
+
+throttling = ThrottlingMiddleware()
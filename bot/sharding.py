@@ -0,0 +1,256 @@
+"""Шардований режим бота: супервізор і BOT_WORKERS процесів-воркерів.
+
+Супервізор один забирає апдейти з Telegram (long polling), розбирає outbox і спрямовує
+кожен апдейт на воркер за ключем: кодом сесії, якщо чат прив'язаний до сесії, інакше chat id.
+Так усі учасники однієї сесії потрапляють на один воркер разом з її рушієм голосування
+та кешами, а важкі кроки (spaCy, генерація DOCX) однієї ради не зупиняють інші.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import time
+
+from aiogram.exceptions import TelegramNetworkError, TelegramServerError
+from aiogram.methods import GetUpdates
+
+from bot.common.active_sessions import active_sessions
+from bot.common.affinity import affinity
+from bot.common.chat_queues import chat_queues
+from bot.common.commands import set_bot_commands
+from bot.common.memory import log_memory_usage
+from bot.common.outbox import outbox
+from bot.common.session_documents import session_documents
+from bot.common.vote_reminders import vote_reminders
+from bot.keyboards.common import VoteCallback
+from bot.main import create_dispatcher, create_resources, create_tables
+from bot.middlewares.throttling import throttling
+
+POLL_TIMEOUT = 30
+ALLOWED_UPDATES = ["message", "callback_query"]
+REPORT_INTERVAL = 60.0
+
+
+class ShardRouter:
+    """Вибір воркера для апдейту з урахуванням прив'язок чат → сесія."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.sessions = {}  # chat_id -> session_code
+        self.routed = [0] * workers
+
+    def worker_for(self, key):
+        return int(key) % self.workers
+
+    def bind(self, session_code, chat_ids):
+        for chat_id in chat_ids:
+            self.sessions[chat_id] = session_code
+
+    def unbind(self, session_code):
+        for chat_id in [chat_id for chat_id, code in self.sessions.items() if code == session_code]:
+            del self.sessions[chat_id]
+
+    def restore(self, bindings):
+        """Відновлює прив'язки після рестарту супервізора з незавершених сесій у БД."""
+        for session_code, chat_id in bindings:
+            self.sessions[chat_id] = session_code
+
+    def route(self, update: dict) -> int:
+        callback = update.get("callback_query")
+        session_code = None
+        if callback:
+            chat_id = (callback.get("message") or {}).get("chat", {}).get("id") or callback["from"]["id"]
+            data = callback.get("data") or ""
+            if data.startswith(f"{VoteCallback.__prefix__}:"):
+                # Голос сам несе код сесії. Прив'язку не запам'ятовуємо: кнопка старої, вже завершеної
+                # сесії інакше знову прив'язала б чат, і словник ріс би без меж
+                session_code = VoteCallback.unpack(data).session
+        else:
+            message = update.get("message") or {}
+            chat_id = message.get("chat", {}).get("id", 0)
+
+        if session_code is None:
+            session_code = self.sessions.get(chat_id)
+        index = self.worker_for(session_code if session_code is not None else chat_id)
+        self.routed[index] += 1
+        return index
+
+
+class WorkerLoad:
+    """Лічильники навантаження воркера, які він періодично надсилає супервізору."""
+
+    def __init__(self, index):
+        self.index = index
+        self.processed = 0
+        self.errors = 0
+        self.in_flight = 0
+        self._cpu = time.process_time()
+        self._wall = time.monotonic()
+
+    async def track(self, coro):
+        self.in_flight += 1
+        try:
+            await coro
+            self.processed += 1
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Воркер {self.index}: помилка обробки апдейту: {e}")
+        finally:
+            self.in_flight -= 1
+
+    def snapshot(self):
+        cpu, wall = time.process_time(), time.monotonic()
+        load = (cpu - self._cpu) / max(wall - self._wall, 1e-9)
+        self._cpu, self._wall = cpu, wall
+        _, busy_chats, waiting, _ = chat_queues.depths()
+        return ("load", self.index, self.processed, self.errors, self.in_flight, load, busy_chats, waiting)
+
+
+def run_worker(index, inbox, events):
+    """Точка входу процесу-воркера."""
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_worker_main(index, inbox, events))
+
+
+async def _worker_main(index, inbox, events):
+    engine, query_stats, db, bot = create_resources()
+    dp = create_dispatcher(engine, db, query_stats)
+    # Прив'язки чатів і пробудження outbox ідуть до супервізора
+    affinity.channel = events
+    outbox.notify = affinity.wake_outbox
+
+    load = WorkerLoad(index)
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    async def report():
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            events.put(load.snapshot())
+
+    reporter = asyncio.create_task(report())
+    log_memory_usage(f"bot-worker-{index}")
+    try:
+        while True:
+            update = await loop.run_in_executor(None, inbox.get)
+            if update is None:
+                break
+            task = asyncio.create_task(load.track(dp.feed_raw_update(bot, update)))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        reporter.cancel()
+        vote_reminders.stop()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await session_documents.stop()
+        await dp.fsm.close()
+        throttling.report()
+        active_sessions.report()
+        query_stats.report()
+        db.loaders.report()
+        await engine.dispose()
+        await bot.session.close()
+
+
+class Supervisor:
+    def __init__(self, workers):
+        self.context = multiprocessing.get_context("spawn")
+        self.router = ShardRouter(workers)
+        self.events = self.context.Queue()
+        self.inboxes = [self.context.Queue() for _ in range(workers)]
+        self.processes = [None] * workers
+        self.loads = {}
+
+    def start_worker(self, index):
+        process = self.context.Process(
+            target=run_worker, args=(index, self.inboxes[index], self.events), name=f"bot-worker-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+
+    async def consume_events(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            event = await loop.run_in_executor(None, self.events.get)
+            if event is None:
+                return
+            if event[0] == "bind":
+                _, session_code, chat_ids = event
+                self.router.bind(session_code, chat_ids)
+            elif event[0] == "unbind":
+                self.router.unbind(event[1])
+            elif event[0] == "wake":
+                outbox.wake()
+            elif event[0] == "load":
+                self.loads[event[1]] = event[2:]
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    # Черга воркера лишається тією самою, тож апдейти, що чекають, не губляться
+                    logging.error(f"Воркер {index} завершився з кодом {process.exitcode}, перезапускаємо.")
+                    self.start_worker(index)
+                processed, errors, in_flight, cpu, busy_chats, waiting = self.loads.get(index, (0, 0, 0, 0.0, 0, 0))
+                sessions = sum(1 for code in set(self.router.sessions.values()) if self.router.worker_for(code) == index)
+                logging.info(
+                    f"Воркер {index}: спрямовано {self.router.routed[index]}, оброблено {processed}, "
+                    f"помилок {errors}, в обробці {in_flight}, CPU {cpu:.0%}, сесій {sessions}, "
+                    f"чатів з чергою {busy_chats}, апдейтів в очікуванні {waiting}"
+                )
+
+    async def poll(self, bot):
+        offset = None
+        backoff = 1
+        while True:
+            try:
+                updates = await bot(
+                    GetUpdates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=ALLOWED_UPDATES),
+                    request_timeout=POLL_TIMEOUT + 10,
+                )
+                backoff = 1
+            except (TelegramNetworkError, TelegramServerError) as e:
+                logging.warning(f"Помилка отримання апдейтів: {e}. Повтор за {backoff} с.")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+
+            for update in updates:
+                offset = update.update_id + 1
+                raw = update.model_dump(mode="json", exclude_unset=True, by_alias=True)
+                self.inboxes[self.router.route(raw)].put(raw)
+
+
+async def run_supervisor(workers):
+    """Запускає воркери та обслуговує їх до зупинки процесу."""
+    engine, query_stats, db, bot = create_resources()
+    await create_tables(engine, db)
+    await bot.delete_webhook()  # Черга апдейтів лишається: poll роздасть її воркерам першими пакетами
+    await set_bot_commands(bot)
+
+    supervisor = Supervisor(workers)
+    # Інакше після рестарту текст адміна піде на воркер chat_id, а голоси — на воркер сесії
+    supervisor.router.restore(await db.get_session_bindings())
+    for index in range(workers):
+        supervisor.start_worker(index)
+    logging.info(f"Запущено {workers} воркерів бота.")
+
+    outbox.start(bot, db)  # Розсилки всіх воркерів розбирає лише супервізор
+    background = [asyncio.create_task(supervisor.consume_events()), asyncio.create_task(supervisor.report())]
+    log_memory_usage("bot-supervisor")
+    try:
+        await supervisor.poll(bot)
+    finally:
+        for inbox in supervisor.inboxes:
+            inbox.put(None)
+        loop = asyncio.get_running_loop()
+        for process in supervisor.processes:
+            await loop.run_in_executor(None, process.join)
+        supervisor.events.put(None)
+        for task in background:
+            task.cancel()
+        await outbox.stop()
+        query_stats.report()
+        await engine.dispose()
+        await bot.session.close()
@@ -0,0 +1,92 @@
+"""Режим вебхука: aiohttp-сервер замість long polling.
+
+Telegram (напряму або через reverse proxy) надсилає апдейти POST-запитом. Сервер перевіряє
+секрет із заголовка X-Telegram-Bot-Api-Secret-Token, одразу відповідає 200, а сам апдейт
+обробляється у фоновій задачі.
+
+Лише одна репліка: голосування (live_voting), прогрес і нагадування живуть у пам'яті процесу,
+і ніщо не спрямовує апдейти однієї сесії на ту саму репліку. Для кількох процесів —
+BOT_WORKERS у режимі polling, де супервізор шардує апдейти за сесією.
+
+Локальна перевірка без Telegram — підробний апдейт на запущений сервер:
+
+    python -m bot.webhook "Приєднатися до сесії" --user-id 42 --count 20
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import ClientSession, web
+
+from config import WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def create_webhook_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    """Застосунок aiohttp з обробником вебхука; хуки диспетчера прив'язані до життєвого циклу сервера."""
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET,
+        handle_in_background=True,  # 200 одразу, обробка — після відповіді
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Слухає WEBHOOK_HOST:WEBHOOK_PORT, доки процес не зупинять."""
+    runner = web.AppRunner(create_webhook_app(dp, bot))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logging.info(f"Вебхук слухає http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def fake_message_update(update_id: int, user_id: int, text: str) -> dict:
+    """Мінімальний апдейт з текстовим повідомленням у приватному чаті."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"Test {user_id}"},
+            "text": text,
+        },
+    }
+
+
+async def post_fake_updates(text: str, user_id: int, count: int, url: str):
+    """Надсилає count апдейтів від послідовних user_id і показує статуси та час відповіді сервера."""
+    headers = {SECRET_HEADER: WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+    started = time.perf_counter()
+    async with ClientSession(headers=headers) as http:
+        async def post(index):
+            update = fake_message_update(int(time.time() * 1000) + index, user_id + index, text)
+            async with http.post(url, json=update) as response:
+                return response.status
+
+        statuses = await asyncio.gather(*(post(index) for index in range(count)))
+    elapsed = time.perf_counter() - started
+    print(f"{count} апдейтів за {elapsed:.3f} с, статуси: {sorted(set(statuses))}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Підробні апдейти для локального вебхука")
+    parser.add_argument("text", nargs="?", default="/start")
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    args = parser.parse_args()
+    asyncio.run(post_fake_updates(args.text, args.user_id, args.count, args.url))
@@ -10,8 +10,13 @@ API_HASH = os.getenv('API_HASH')
 GOOGLE_DOCX_URL = os.getenv('GOOGLE_DOCX_URL')
 DATABASE_URL = os.getenv('DATABASE_URL')
 POSTGRESQL = os.getenv('POSTGRESQL')
+# Connection pool of the bot process: pool_size + max_overflow is the hard limit of open connections
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
 OPENAI_KEY = os.getenv('OPENAI')
 OPTION = os.getenv('OPTION')
+# Key for signing join deep links (t.me/<bot>?start=...); derived from TELEGRAM_TOKEN when empty
+JOIN_LINK_SECRET = os.getenv('JOIN_LINK_SECRET')
 
 TELEGRAM_TOKEN_TEST = os.getenv('TELEGRAM_TOKEN_TEST')
 # Telegram user ids allowed to run admin commands, comma-separated
@@ -20,3 +25,31 @@ ALLOWED_ADMINS = {
     for admin_id in os.getenv('ALLOWED_ADMINS', '').split(',')
     if admin_id.strip()
 }
+
+# Updates transport: "polling" (default) or "webhook" served by aiohttp
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Public base URL behind the reverse proxy; when empty the webhook is not registered with Telegram
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+
+# FSM storage: "sql" (fsm_states table in the main database, default), "redis" or "memory"
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sql')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+# FSM_STORAGE=memory: idle entries are dropped after FSM_IDLE_TTL seconds, least recently used ones above the limit
+FSM_IDLE_TTL = int(os.getenv('FSM_IDLE_TTL', str(24 * 3600)))
+FSM_MEMORY_LIMIT_MB = int(os.getenv('FSM_MEMORY_LIMIT_MB', '32'))
+# FSM_STORAGE=sql/redis: seconds a read state stays cached in the process. Stale reads are not revalidated, so the
+# cache is only safe when one process handles every update of a chat: off by default with several workers
+FSM_CACHE_TTL = float(os.getenv('FSM_CACHE_TTL', '30' if int(os.getenv('BOT_WORKERS', '1')) <= 1 else '0'))
+
+# Seconds after an agenda item is sent before participants who have not voted get a reminder; 0 disables it
+VOTE_REMINDER_DELAY = int(os.getenv('VOTE_REMINDER_DELAY', '120'))
+
+# Bot worker processes; above 1 a supervisor polls Telegram and shards updates by chat / session
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '1'))
+
+# "chat": updates of one chat are handled strictly in order, different chats concurrently; "off": aiogram default
+UPDATE_ORDERING = os.getenv('UPDATE_ORDERING', 'chat')
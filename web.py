@@ -0,0 +1,20 @@
+"""Flask-сервіс, що працює поруч із ботом.
+
+Імпортує лише Flask: процес веб-сервера не тягне aiogram, SQLAlchemy та шар БД.
+"""
+
+from flask import Flask, jsonify, request
+
+app = Flask(__name__)
+
+
+@app.route("/")
+def index():
+    return "Flask-сервер працює. Бот запущено!"
+
+
+@app.route("/params", methods=["GET"])
+def get_params():
+    """Обробляє GET запити й повертає передані параметри."""
+    params = request.args
+    return jsonify({"parameters": params})